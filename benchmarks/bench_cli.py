@@ -0,0 +1,365 @@
+"""Benchmark the CLI subcommands on deterministic synthetic Hub-scale databases.
+
+Each subcommand runs in a fresh process with the Hub listing and the size estimator stubbed,
+so no network is used. The wall time of the process, the time in main(), the peak RSS, the
+number of memory blocks allocated by main() and still alive, and optionally the peak traced
+memory of tracemalloc are reported per subcommand.
+
+Usage:
+    # Run the default scales (1k/10k models x 10/100 dates).
+    python benchmarks/bench_cli.py
+    # Run the full Hub scale.
+    python benchmarks/bench_cli.py --models 1000 10000 100000 --dates 10 100 500
+    # Run a scale and save the results.
+    python benchmarks/bench_cli.py --models 100000 --dates 500 --save results.json
+    # Compare two commits, each checked out to a temporary worktree.
+    python benchmarks/bench_cli.py --models 10000 --dates 100 --commits main HEAD
+    # Compare with saved results.
+    python benchmarks/bench_cli.py --compare results.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from collections import namedtuple
+
+# The default scales. The full Hub scale is --models 1000 10000 100000 --dates 10 100 500.
+MODELS = [1000, 10000]
+DATES = [10, 100]
+
+# The fraction of models in the synthetic size DB. Others are estimated by update_size_db.
+SIZE_DB_COVERAGE = 0.9
+
+# The sizes in billions of synthetic models.
+MODEL_SIZES = [0.01, 0.1, 0.3, 1.3, 6.7, 13, 70]
+
+# A model in the stubbed Hub listing, which has the same attributes as query_hf_hub returns.
+SyntheticModel = namedtuple("SyntheticModel", ["modelId", "downloads"])
+
+
+def model_id(idx):
+    return f"org-{idx % 997}/model-{idx}"
+
+
+def model_size(model_id):
+    """The deterministic synthetic size of a model."""
+    digest = hashlib.md5(model_id.encode()).digest()
+    return MODEL_SIZES[digest[0] % len(MODEL_SIZES)]
+
+
+def synthetic_downloads(n_models, n_dates, seed=0):
+    """Yield (date, downloads) of each date. Downloads are Pareto-distributed and follow a
+    multiplicative random walk, and 5% of models are absent (-1) at each date."""
+    import datetime
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    downloads = (rng.pareto(1.2, n_models) + 1) * 100
+    start = datetime.date(2020, 1, 1)
+    for day in range(n_dates):
+        downloads *= np.exp(rng.normal(0, 0.1, n_models))
+        absent = rng.random(n_models) < 0.05
+        date = (start + datetime.timedelta(days=day)).strftime("%m-%d-%y")
+        yield date, np.where(absent, -1, downloads.astype(np.int64))
+
+
+def generate(fixture_dir, n_models, n_dates, download_format="json"):
+    """Generate the download trend DB and the size DB of a scale if they do not exist."""
+    import numpy as np
+
+    from hf_hub_stats import serialization
+    from hf_hub_stats.download_db import convert_download_db
+    from hf_hub_stats.size_db import CalcModelSizeResult, SizeDB
+
+    done = os.path.join(fixture_dir, "done")
+    if not os.path.exists(done):
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+        os.makedirs(fixture_dir)
+        print(f"Generating {n_models} models x {n_dates} dates in {fixture_dir}", flush=True)
+        model_ids = [model_id(idx) for idx in range(n_models)]
+
+        def items():
+            # Write one date at a time, so the memory is bounded by a date.
+            for date, downloads in synthetic_downloads(n_models, n_dates):
+                order = np.argsort(-downloads, kind="stable")
+                order = order[downloads[order] >= 0]
+                yield date, [
+                    {"model_id": model_ids[idx], "download": download}
+                    for idx, download in zip(order.tolist(), downloads[order].tolist())
+                ]
+
+        with open(os.path.join(fixture_dir, "download_db.json"), "wb") as filep:
+            serialization.dump_object(filep, items())
+
+        size_db = SizeDB(os.path.join(fixture_dir, "size_db.json"))
+        for idx, name in enumerate(model_ids):
+            if idx % 100 < SIZE_DB_COVERAGE * 100:
+                size_db[name] = CalcModelSizeResult(name, model_size(name), 0)
+        size_db.persist()
+
+        with open(done, "w") as filep:
+            filep.write("")
+
+    src = os.path.join(fixture_dir, "download_db.json")
+    dst = {
+        "json": src,
+        "columnar": os.path.join(fixture_dir, "download_db"),
+        "delta": os.path.join(fixture_dir, "download_db.delta"),
+        "sqlite": os.path.join(fixture_dir, "download_db.sqlite"),
+    }[download_format]
+    if not os.path.exists(dst):
+        convert_download_db(src, dst)
+    return dst, os.path.join(fixture_dir, "size_db.json")
+
+
+def subcommands(download_db, size_db, n_models, scratch):
+    """The (name, argv, files to copy to the scratch directory before running) of each
+    benchmark. Subcommands that write a DB run on a scratch copy."""
+    model_ids = [model_id(idx) for idx in range(0, n_models, max(1, n_models // 10))]
+    scratch_size_db = os.path.join(scratch, "size_db.json")
+    scratch_download_db = os.path.join(scratch, os.path.basename(download_db))
+    chart = os.path.join(scratch, "trend.png")
+    return [
+        ("query_top", ["--download-db", download_db, "--size-db", size_db, "--limit", "20"], []),
+        (
+            "query_top (1-10B)",
+            ["--download-db", download_db, "--size-db", size_db, "--limit", "20"]
+            + ["--min-size", "1", "--max-size", "10"],
+            [],
+        ),
+        ("query_download", ["--download-db", download_db, "--model-ids"] + model_ids, []),
+        ("query_size", ["--size-db", size_db, "--model-ids"] + model_ids, []),
+        (
+            "draw_download_trend",
+            ["--download-db", download_db, "--size-db", size_db, "--limit", "20", "-o", chart]
+            + ["--min-size", "1", "--max-size", "10"],
+            [],
+        ),
+        ("update_size_db", ["--size-db", scratch_size_db], [(size_db, scratch_size_db)]),
+        (
+            "update_download_trend_db",
+            ["--download-db", scratch_download_db],
+            [(download_db, scratch_download_db)],
+        ),
+    ]
+
+
+def install_stubs(n_models, estimate_ms):
+    """Stub the Hub listing and the size estimator of the package in this process."""
+
+    def query_hf_hub(cache_expire=7, stream=False, top_k=None, cache_dir=None):
+        _, downloads = next(synthetic_downloads(n_models, 1, seed=1))
+        models = [
+            SyntheticModel(model_id(idx), download)
+            for idx, download in enumerate(downloads.tolist())
+        ]
+        models.sort(key=lambda m: m.downloads, reverse=True)
+        return models if top_k is None else models[:top_k]
+
+    # Replace the Hub client module, so the Hub client is not imported either.
+    query_hub = types.ModuleType("hf_hub_stats.query_hub")
+    query_hub.query_hf_hub = query_hf_hub
+    sys.modules["hf_hub_stats.query_hub"] = query_hub
+
+    from hf_hub_stats import query_db, size_db
+
+    def estimate(model_id, *args, **kwargs):
+        time.sleep(estimate_ms / 1e3)
+        return size_db.CalcModelSizeResult(model_id, model_size(model_id), 0)
+
+    # Both the module attribute and the name imported by query_db are used.
+    size_db.get_model_size_in_b_with_empty_weights = estimate
+    query_db.get_model_size_in_b_with_empty_weights = estimate
+
+
+def run_one(args):
+    """Run one subcommand in this process and print the metrics as JSON."""
+    for src, dst in args.copy:
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copyfile(src, dst)
+
+    import tracemalloc
+
+    install_stubs(args.models, args.estimate_ms)
+    from hf_hub_stats import __main__ as cli
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    sys.argv = ["hf_hub_stats", args.subcommand] + args.argv
+    tic = time.perf_counter()
+    cli.main()
+    elapsed = time.perf_counter() - tic
+
+    metrics = {
+        "main_s": elapsed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "blocks": sys.getallocatedblocks() - blocks,
+    }
+    if args.tracemalloc:
+        metrics["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    print("METRICS " + json.dumps(metrics), flush=True)
+
+
+def run_suite(args, python_path):
+    """Run all subcommands of all scales with the package at python_path."""
+    env = dict(os.environ, PYTHONPATH=python_path, MPLBACKEND="Agg")
+    results = []
+    for n_models, n_dates in args.scales:
+        fixture_dir = os.path.join(args.fixture_dir, f"{n_models}x{n_dates}")
+        download_db, size_db = generate(fixture_dir, n_models, n_dates, args.download_format)
+        for name, argv, copy in subcommands(download_db, size_db, n_models, "{scratch}"):
+            if args.only and name.split(" ")[0] not in args.only:
+                continue
+            with tempfile.TemporaryDirectory() as scratch:
+                argv = [arg.replace("{scratch}", scratch) for arg in argv]
+                cmd = [sys.executable, os.path.abspath(__file__), "_run_one"]
+                cmd += ["--models", str(n_models), "--estimate-ms", str(args.estimate_ms)]
+                for src, dst in copy:
+                    cmd += ["--copy", src, dst.replace("{scratch}", scratch)]
+                if args.tracemalloc:
+                    cmd.append("--tracemalloc")
+                cmd += [name.split(" ")[0], "--"] + argv
+
+                tic = time.perf_counter()
+                proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+                wall = time.perf_counter() - tic
+
+            row = {"subcommand": name, "models": n_models, "dates": n_dates, "wall_s": wall}
+            lines = [line for line in proc.stdout.splitlines() if line.startswith("METRICS ")]
+            if proc.returncode != 0 or not lines:
+                row["error"] = (proc.stderr.strip().splitlines() or ["unknown error"])[-1]
+            else:
+                row.update(json.loads(lines[-1][len("METRICS ") :]))
+            print(format_row(row), flush=True)
+            results.append(row)
+    return results
+
+
+def format_row(row, base=None):
+    scale = f"{row['models']}x{row['dates']}"
+    if "error" in row:
+        return f"{row['subcommand']:<26}{scale:>12}  failed: {row['error']}"
+    text = (
+        f"{row['subcommand']:<26}{scale:>12}{row['wall_s']:>10.2f}{row['main_s']:>10.2f}"
+        f"{row['peak_rss_mb']:>10.0f}{row.get('peak_traced_mb', float('nan')):>10.1f}"
+        f"{row['blocks']:>12}"
+    )
+    if base is not None and "error" not in base:
+        text += f"{row['main_s'] / max(base['main_s'], 1e-9):>9.2f}x"
+        text += f"{row['peak_rss_mb'] / max(base['peak_rss_mb'], 1e-9):>9.2f}x"
+    return text
+
+
+def print_header(compare=False):
+    header = (
+        f"{'Subcommand':<26}{'Scale':>12}{'Wall (s)':>10}{'Main (s)':>10}{'RSS (MB)':>10}"
+        f"{'Peak (MB)':>10}{'Blocks':>12}"
+    )
+    if compare:
+        header += f"{'Main':>10}{'RSS':>10}"
+    print(header)
+
+
+def print_comparison(base_results, results):
+    base = {(r["subcommand"], r["models"], r["dates"]): r for r in base_results}
+    print("\nRatios are against the base results")
+    print_header(compare=True)
+    for row in results:
+        print(format_row(row, base.get((row["subcommand"], row["models"], row["dates"]))))
+
+
+def run_commit(args, commit):
+    """Run the suite with the package checked out at a commit to a temporary worktree."""
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        worktree = os.path.join(tmpdir, "worktree")
+        subprocess.run(
+            ["git", "-C", repo, "worktree", "add", "--detach", worktree, commit], check=True
+        )
+        try:
+            print(f"Running {commit}", flush=True)
+            print_header()
+            return run_suite(args, worktree)
+        finally:
+            subprocess.run(["git", "-C", repo, "worktree", "remove", "--force", worktree])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, nargs="+", default=MODELS)
+    parser.add_argument("--dates", type=int, nargs="+", default=DATES)
+    parser.add_argument(
+        "--only", nargs="+", help="Only run these subcommands. Default runs all subcommands"
+    )
+    parser.add_argument(
+        "--download-format", choices=["json", "columnar", "delta", "sqlite"], default="json"
+    )
+    parser.add_argument(
+        "--estimate-ms", type=float, default=0, help="The latency of the stubbed size estimator"
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Trace the peak memory of Python allocations, which slows down the subcommands",
+    )
+    parser.add_argument(
+        "--fixture-dir",
+        default=os.path.expanduser("~/.cache/hf_hub_stats_bench"),
+        help="The directory to cache the synthetic databases",
+    )
+    parser.add_argument("--save", type=str, help="Save the results to a JSON file")
+    parser.add_argument("--compare", type=str, help="Compare with results saved by --save")
+    parser.add_argument(
+        "--commits", nargs=2, metavar=("BASE", "HEAD"), help="Compare two commits of the repo"
+    )
+    args = parser.parse_args()
+    args.scales = [(n_models, n_dates) for n_models in args.models for n_dates in args.dates]
+    return args
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "_run_one":
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--models", type=int, required=True)
+        parser.add_argument("--estimate-ms", type=float, default=0)
+        parser.add_argument("--copy", nargs=2, action="append", default=[])
+        parser.add_argument("--tracemalloc", action="store_true")
+        parser.add_argument("subcommand")
+        parser.add_argument("argv", nargs=argparse.REMAINDER)
+        args = parser.parse_args(sys.argv[2:])
+        args.argv = args.argv[1:] if args.argv[:1] == ["--"] else args.argv
+        run_one(args)
+        return
+
+    args = parse_args()
+    if args.commits:
+        base_results = run_commit(args, args.commits[0])
+        results = run_commit(args, args.commits[1])
+        print_comparison(base_results, results)
+    else:
+        repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        print_header()
+        results = run_suite(args, repo)
+        if args.compare:
+            with open(args.compare, "r") as filep:
+                print_comparison(json.load(filep), results)
+
+    if args.save:
+        with open(args.save, "w") as filep:
+            json.dump(results, filep, indent=2)
+
+
+if __name__ == "__main__":
+    main()
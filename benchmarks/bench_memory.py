@@ -0,0 +1,100 @@
+"""Benchmark the memory of download records with plain dataclasses, slotted dataclasses,
+and struct-of-arrays snapshots.
+
+Usage: python benchmarks/bench_memory.py --models 100000 --dates 10
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass
+
+import numpy as np
+
+# Benchmark the package in this checkout.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hf_hub_stats.download_db import ModelNDownload
+from hf_hub_stats.query_engine import Snapshot
+from hf_hub_stats.size_db import CalcModelSizeResult
+
+
+@dataclass
+class DictModelNDownload:
+    """ModelNDownload before it was slotted."""
+
+    model_id: str
+    download: int
+
+
+@dataclass
+class DictCalcModelSizeResult:
+    """CalcModelSizeResult before it was slotted."""
+
+    model_id: str
+    size: float
+    code: int
+    memo: str = None
+    failed_at: float = None
+    error_class: str = None
+    n_failures: int = 0
+    config_hash: str = None
+
+
+def measure(build):
+    """The memory in bytes allocated by build() that is alive after it returns."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    ret = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del ret
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, default=100000)
+    parser.add_argument("--dates", type=int, default=10)
+    args = parser.parse_args()
+
+    # Share model ID strings among all representations like a loaded DB does.
+    model_ids = [f"org-{i % 997}/model-{i}" for i in range(args.models)]
+
+    def records(cls):
+        return [[cls(m, i * 7 + d) for i, m in enumerate(model_ids)] for d in range(args.dates)]
+
+    def snapshots():
+        model_index = {m: i for i, m in enumerate(model_ids)}
+        return [
+            Snapshot(
+                model_ids,
+                np.arange(args.models, dtype=np.int64),
+                np.arange(args.models, dtype=np.int64) * 7 + d,
+                model_index,
+            )
+            for d in range(args.dates)
+        ]
+
+    def results(cls):
+        return [cls(m, 0.1 * (i % 100), 0) for i, m in enumerate(model_ids)]
+
+    rows = [
+        ("ModelNDownload (dict)", measure(lambda: records(DictModelNDownload))),
+        ("ModelNDownload (slots)", measure(lambda: records(ModelNDownload))),
+        ("Snapshot (arrays)", measure(snapshots)),
+        ("CalcModelSizeResult (dict)", measure(lambda: results(DictCalcModelSizeResult))),
+        ("CalcModelSizeResult (slots)", measure(lambda: results(CalcModelSizeResult))),
+    ]
+
+    print(f"{args.models} models x {args.dates} dates ({args.models} size results)")
+    print(f"{'Representation':<32}{'Memory (MB)':>14}{'Bytes/record':>14}")
+    for name, size in rows:
+        n_records = args.models if name.startswith("Calc") else args.models * args.dates
+        print(f"{name:<32}{size / 1e6:>14.1f}{size / n_records:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Benchmark the vectorized query engine against the per-record loops on a synthetic snapshot.
+
+Usage: python benchmarks/bench_query.py --models 100000
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+# Benchmark the package in this checkout.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hf_hub_stats.download_db import (
+    DownloadTrendDB,
+    ModelNDownload,
+    convert_download_db,
+    open_download_db,
+)
+from hf_hub_stats.query_engine import Snapshot
+from hf_hub_stats.size_db import CalcModelSizeResult, SizeDB
+from hf_hub_stats.utils import print_model_in_md
+
+
+def make_dbs(n_models, tmpdir):
+    rng = random.Random(0)
+    records = [
+        ModelNDownload(f"org-{i % 997}/model-{i}", int(rng.paretovariate(1.2) * 100))
+        for i in range(n_models)
+    ]
+    download_db = DownloadTrendDB(f"{tmpdir}/download_db.json")
+    download_db["01-01-23"] = records
+    download_db.persist()
+
+    size_db = SizeDB(None)
+    for record in records:
+        size = rng.choice([0.01, 0.1, 0.3, 1.3, 6.7, 13, 70])
+        size_db[record.model_id] = CalcModelSizeResult(record.model_id, size, 0)
+    return download_db, size_db
+
+
+def loop_query_top(records, size_db, limit, min_size, max_size):
+    """The per-record loop of query_top_models."""
+    skip_size = min_size == 0 and max_size == float("inf")
+    models = []
+    for model in sorted(records, key=lambda x: x.download, reverse=True):
+        size = 0
+        if not skip_size:
+            result = size_db[model.model_id]
+            if not result.valid or result.size < min_size or result.size > max_size:
+                continue
+            size = result.size
+        models.append(ModelNDownload(model.model_id, model.download, size))
+        if len(models) == limit:
+            break
+    return models
+
+
+def engine_query_top(snapshot, size_db, limit, min_size, max_size):
+    models = []
+    for pos, result in snapshot.select_top(
+        size_db.lookup, None, limit=limit, min_size=min_size, max_size=max_size
+    ):
+        size = 0 if result is None else result.size
+        models.append(ModelNDownload(snapshot.model_id(pos), int(snapshot.downloads[pos]), size))
+    return models
+
+
+def loop_query_download(records, model_ids):
+    model_id_set = set(model_ids)
+    return [r for r in records if r.model_id in model_id_set]
+
+
+def engine_query_download(snapshot, model_ids):
+    return [
+        ModelNDownload(snapshot.model_id(pos), int(snapshot.downloads[pos]))
+        for pos in snapshot.find(model_ids).tolist()
+    ]
+
+
+def timeit(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        ret = func()
+        best = min(best, time.perf_counter() - tic)
+    return best, ret
+
+
+def markdown(models):
+    with redirect_stdout(io.StringIO()) as out:
+        print_model_in_md(models)
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=int, default=100000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir, redirect_stdout(io.StringIO()):
+        download_db, size_db = make_dbs(args.models, tmpdir)
+        convert_download_db(f"{tmpdir}/download_db.json", f"{tmpdir}/download_db")
+        columnar_db = open_download_db(f"{tmpdir}/download_db")
+        # The snapshot of the columnar DB is memory-mapped, so load it before tmpdir is removed.
+        snapshot = Snapshot.from_download_db(columnar_db, "01-01-23")
+        snapshot.model_indices = snapshot.model_indices.copy()
+        snapshot.downloads = snapshot.downloads.copy()
+    records = download_db["01-01-23"]
+    model_ids = [records[i].model_id for i in range(0, len(records), len(records) // 10)]
+
+    rows = []
+    for name, min_size, max_size in [("all", 0, float("inf")), ("1-10B", 1, 10)]:
+        loop_time, expected = timeit(
+            lambda: loop_query_top(records, size_db, args.limit, min_size, max_size), args.repeat
+        )
+        engine_time, actual = timeit(
+            lambda: engine_query_top(snapshot, size_db, args.limit, min_size, max_size),
+            args.repeat,
+        )
+        assert markdown(expected) == markdown(actual), "Outputs are different"
+        rows.append((f"query_top ({name})", loop_time, engine_time))
+
+    loop_time, expected = timeit(lambda: loop_query_download(records, model_ids), args.repeat)
+    engine_time, actual = timeit(lambda: engine_query_download(snapshot, model_ids), args.repeat)
+    assert expected == actual, "Outputs are different"
+    rows.append(("query_download", loop_time, engine_time))
+
+    print(f"Synthetic snapshot with {args.models} models")
+    print(f"{'Query':<24}{'Loop (ms)':>12}{'Vectorized (ms)':>18}{'Speedup':>10}")
+    for name, loop_time, engine_time in rows:
+        print(
+            f"{name:<24}{loop_time * 1e3:>12.2f}{engine_time * 1e3:>18.2f}"
+            f"{loop_time / engine_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Check the startup time of read-only subcommands against a budget.
+
+query_download and query_size (on size DB hits) are run in fresh processes on small
+synthetic databases. The check fails if the best wall time of a subcommand exceeds its
+budget, or if any heavy dependency is imported by it.
+
+Usage: python benchmarks/bench_startup.py --repeat 5 --budget-ms 500
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Benchmark the package in this checkout.
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+# Dependencies that read-only subcommands must not import.
+HEAVY_MODULES = [
+    "transformers",
+    "accelerate",
+    "torch",
+    "huggingface_hub",
+    "pandas",
+    "matplotlib",
+    "tabulate",
+]
+
+# Run a subcommand and print the heavy modules it imported.
+RUN_CODE = """
+import json, sys
+argv, heavy_modules = json.loads(sys.argv[1]), json.loads(sys.argv[2])
+from hf_hub_stats.__main__ import main
+sys.argv = ["hf_hub_stats"] + argv
+main()
+print("IMPORTED " + json.dumps([m for m in heavy_modules if m in sys.modules]))
+"""
+
+
+def make_dbs(tmpdir, n_models=1000, n_dates=10):
+    from hf_hub_stats.download_db import DownloadTrendDB, ModelNDownload
+    from hf_hub_stats.size_db import CalcModelSizeResult, SizeDB
+
+    model_ids = [f"org-{i % 97}/model-{i}" for i in range(n_models)]
+    download_db = DownloadTrendDB(os.path.join(tmpdir, "download_db.json"))
+    for day in range(n_dates):
+        download_db[f"01-{day + 1:02d}-23"] = [
+            ModelNDownload(m, (i * 7919 + day * 104729) % 1000003) for i, m in enumerate(model_ids)
+        ]
+    download_db.persist()
+
+    size_db = SizeDB(os.path.join(tmpdir, "size_db.json"))
+    for i, model_id in enumerate(model_ids):
+        size_db[model_id] = CalcModelSizeResult(model_id, 0.1 * (i % 100), 0)
+    size_db.persist()
+    return download_db.file_name, size_db.file_name, model_ids[:: n_models // 10]
+
+
+def run(argv, repeat, env):
+    """Return the best wall time in seconds and the heavy modules imported."""
+    best = float("inf")
+    imported = []
+    for _ in range(repeat):
+        cmd = [sys.executable, "-c", RUN_CODE, json.dumps(argv), json.dumps(HEAVY_MODULES)]
+        tic = time.perf_counter()
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        best = min(best, time.perf_counter() - tic)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{argv[0]} failed: {proc.stderr}")
+        for line in proc.stdout.splitlines():
+            if line.startswith("IMPORTED "):
+                imported = json.loads(line[len("IMPORTED ") :])
+    return best, imported
+
+
+def python_startup(repeat):
+    """The best startup time in seconds of the bare interpreter for reference."""
+    best = float("inf")
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms", type=float, default=500, help="The startup budget of each subcommand"
+    )
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=REPO)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        download_db, size_db, model_ids = make_dbs(tmpdir)
+        cases = [
+            ("query_download", ["--download-db", download_db, "--model-ids"] + model_ids),
+            ("query_size", ["--size-db", size_db, "--model-ids"] + model_ids),
+        ]
+
+        print(f"{'Subcommand':<20}{'Time (ms)':>12}{'Budget (ms)':>14}  Heavy imports")
+        print(f"{'(python)':<20}{python_startup(args.repeat) * 1e3:>12.0f}")
+        failed = False
+        for name, argv in cases:
+            elapsed, imported = run([name] + argv, args.repeat, env)
+            ok = elapsed * 1e3 <= args.budget_ms and not imported
+            failed = failed or not ok
+            print(
+                f"{name:<20}{elapsed * 1e3:>12.0f}{args.budget_ms:>14.0f}  "
+                f"{', '.join(imported) or '-'}{'' if ok else '  FAILED'}"
+            )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,75 @@
-"""CLI Entry point."""
+"""CLI Entry point.
+
+Modules of subcommands are imported in the branch of each subcommand, so read-only queries
+do not pay for importing the modules (and their dependencies) of other subcommands.
+"""
 import argparse
+import os
+
+from . import profiling
+
+
+def add_pretty_arg(parser):
+    # Databases are written in compact JSON by default.
+    parser.add_argument(
+        "--pretty",
+        action="store_true",
+        help="Write JSON databases with indent=2, which is the same as json.dump(indent=2)",
+    )
 
-from .query_hub import query_hf_hub
-from .query_db import query_top_models, query_model_size, draw_download_trend, query_model_download
-from .size_db import SizeDB
-from .download_db import DownloadTrendDB
+
+def add_config_store_args(parser):
+    parser.add_argument(
+        "--config-store",
+        type=str,
+        help="The directory of the local config store. If specified, configs of models "
+        "missing in the size DB are bulk fetched to the store before estimating sizes",
+    )
+    parser.add_argument(
+        "--fetch-concurrency", type=int, default=16, help="The maximum concurrent config fetches"
+    )
+    parser.add_argument(
+        "--fetch-rate", type=float, default=10, help="The maximum config fetches per second"
+    )
+
+
+def add_size_stats_args(parser):
+    parser.add_argument(
+        "--size-db", type=str, required=True, help="The path to model size database in JSON"
+    )
+    parser.add_argument(
+        "--download-db", type=str, required=True, help="The path to download time database"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="The number of top downloaded models of each date. Default 20, and 0 for all models",
+    )
+    parser.add_argument(
+        "--min-size", type=float, default=0, help="The minimum model size in billions"
+    )
+    parser.add_argument(
+        "--max-size", type=float, default=float("inf"), help="The maximum model size in billions"
+    )
+    parser.add_argument(
+        "--percentiles",
+        type=float,
+        nargs="+",
+        default=[10, 50, 90],
+        help="The percentiles of model sizes. Default 10 50 90",
+    )
+    parser.add_argument(
+        "--max-history",
+        type=int,
+        default=0,
+        help="The maximum number of records to query. Default 0 queries all records.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Recompute the stats of all dates instead of using the cached stats",
+    )
 
 
 def parse_args():
@@ -13,7 +78,45 @@ def parse_args():
     common_parser.add_argument(
         "--end", type=int, default=float("inf"), help="Stop at top-n th model"
     )
+    common_parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the model list of the Hub and only keep the top --end models",
+    )
+    common_parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="The directory to cache the model list of the Hub. Default ~/.cache/query_hf_hub/",
+    )
+    common_parser.add_argument(
+        "--cache-ttl", type=float, default=7, help="The days to use the cached model list"
+    )
+    add_pretty_arg(common_parser)
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time of each phase and the counters (e.g., cache hits) on exit",
+    )
+    parser.add_argument(
+        "--profile-cpu", type=str, help="Profile with cProfile and dump the stats to this file"
+    )
+    parser.add_argument(
+        "--profile-memory", action="store_true", help="Trace the peak memory with tracemalloc"
+    )
+    parser.add_argument(
+        "--metrics-out",
+        type=str,
+        help="Append the phase times and counters to this file in JSON lines",
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=os.environ.get("HF_HUB_STATS_SERVER"),
+        help="The URL of the query server (e.g., http://127.0.0.1:8765) to forward query_top, "
+        "query_download and query_size to. Queries run locally if the server is not running. "
+        "Default $HF_HUB_STATS_SERVER",
+    )
     subprasers = parser.add_subparsers(dest="mode", help="Execution modes")
 
     # CLI for querying top downloaded models.
@@ -44,6 +147,14 @@ def parse_args():
     query_top_parser.add_argument(
         "--include-unsupported", action="store_true", help="Include unsupported models"
     )
+    query_top_parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=0,
+        help="With size filters, estimate the sizes of the next N uncached models in the rank "
+        "order in N background processes. Default 0 estimates them one at a time",
+    )
+    add_config_store_args(query_top_parser)
 
     # CLI for updating the size database.
     size_db_parser = subprasers.add_parser(
@@ -52,6 +163,30 @@ def parse_args():
     size_db_parser.add_argument(
         "--size-db", type=str, required=True, help="The path to model size database in JSON"
     )
+    size_db_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of processes to estimate model sizes. Default 1 runs sequentially",
+    )
+    size_db_parser.add_argument(
+        "--fallback-mem-gb",
+        type=float,
+        default=0,
+        help="The memory budget in GB of concurrent pretrained fallbacks with --workers > 1."
+        "Default 0 runs the fallbacks one at a time.",
+    )
+    add_config_store_args(size_db_parser)
+    size_db_parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Only re-estimate the failed models in the DB whose retry time has come",
+    )
+    size_db_parser.add_argument(
+        "--fsync",
+        action="store_true",
+        help="Flush the DB and the journal to disk on every write for durability",
+    )
 
     # CLI for querying the model size.
     query_size_parser = subprasers.add_parser(
@@ -63,6 +198,19 @@ def parse_args():
     query_size_parser.add_argument(
         "--model-ids", nargs="+", required=True, help="The model ID to query"
     )
+    add_config_store_args(query_size_parser)
+
+    # CLI for verifying the analytic parameter counter.
+    verify_parser = subprasers.add_parser(
+        "verify_param_count",
+        parents=[common_parser],
+        help="Cross-check analytic parameter counts with empty-weight models",
+    )
+    verify_parser.add_argument(
+        "--model-ids",
+        nargs="+",
+        help="The model IDs to verify. Models in [start, end) of the Hub are used if unspecified",
+    )
 
     # CLI for updating the download trend database.
     download_db_parser = subprasers.add_parser(
@@ -71,6 +219,21 @@ def parse_args():
     download_db_parser.add_argument(
         "--download-db", type=str, required=True, help="The path to database in JSON"
     )
+    download_db_parser.add_argument(
+        "--append-only",
+        action="store_true",
+        help="Write the new records to an immutable segment file instead of rewriting the DB."
+        "Use the compact mode to merge segments into the DB.",
+    )
+
+    # CLI for compacting the download trend database.
+    compact_parser = subprasers.add_parser(
+        "compact", help="Merge append-only segments into the download trend database"
+    )
+    compact_parser.add_argument(
+        "--download-db", type=str, required=True, help="The path to database in JSON"
+    )
+    add_pretty_arg(compact_parser)
 
     # CLI for querying the model download.
     query_download_parser = subprasers.add_parser(
@@ -89,6 +252,48 @@ def parse_args():
         "The latest date in the download DB will be used if unspecified.",
     )
 
+    # CLI for querying the download growth.
+    query_growth_parser = subprasers.add_parser(
+        "query_growth",
+        parents=[common_parser],
+        help="Query top movers by the change of downloads over a period",
+    )
+    query_growth_parser.add_argument(
+        "--download-db", type=str, required=True, help="The path to download time database"
+    )
+    query_growth_parser.add_argument(
+        "--date",
+        type=str,
+        help="The date in %m-%d-%y format to query."
+        "The latest date in the download DB will be used if unspecified.",
+    )
+    query_growth_parser.add_argument(
+        "--window",
+        type=int,
+        default=7,
+        help="Compare with the latest date at least this number of days before. Default 7",
+    )
+    query_growth_parser.add_argument(
+        "--by",
+        choices=["change", "growth"],
+        default="change",
+        help="Rank by the absolute change or the growth ratio of downloads",
+    )
+    query_growth_parser.add_argument(
+        "--min-downloads",
+        type=int,
+        default=0,
+        help="Only include models with at least this number of downloads at the previous date",
+    )
+    query_growth_parser.add_argument(
+        "--all-dates",
+        action="store_true",
+        help="Rank models by their best period in the whole history instead of the given date",
+    )
+    query_growth_parser.add_argument(
+        "--limit", type=int, default=20, help="The maximum number of returned models"
+    )
+
     # CLI for drawing download trend.
     draw_download_trend_parser = subprasers.add_parser(
         "draw_download_trend", parents=[common_parser], help="Draw download trends"
@@ -115,26 +320,216 @@ def parse_args():
         help="The maximum number of records to draw." "Default 0 draws all records.",
     )
     draw_download_trend_parser.add_argument("-o", "--output", type=str, help="The output file name")
+    draw_download_trend_parser.add_argument(
+        "--size-ranges",
+        nargs="+",
+        help="Render one chart per size range in billions, e.g., 0:1 1:10 10:. Charts are "
+        "written to <output>-<min>-<max>B.<ext>, and --min-size/--max-size are ignored.",
+    )
+    draw_download_trend_parser.add_argument(
+        "--workers", type=int, default=1, help="The number of processes to render charts"
+    )
+    draw_download_trend_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Render charts even if their data is unchanged since the last render",
+    )
+
+    # CLI for querying the model size statistics.
+    query_size_stats_parser = subprasers.add_parser(
+        "query_size_stats",
+        parents=[common_parser],
+        help="Query the size statistics of top download models of each date",
+    )
+    add_size_stats_args(query_size_stats_parser)
+
+    # CLI for drawing the model size trend.
+    draw_size_trend_parser = subprasers.add_parser(
+        "draw_size_trend",
+        parents=[common_parser],
+        help="Draw the max/mean/min size trends of top download models",
+    )
+    add_size_stats_args(draw_size_trend_parser)
+    draw_size_trend_parser.add_argument("-o", "--output", type=str, help="The output file name")
+
+    # CLI for managing the model list cache.
+    cache_parser = subprasers.add_parser("cache", help="Manage the cached model list of the Hub")
+    cache_parser.add_argument("action", choices=["info", "clear"], help="The cache operation")
+    cache_parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="The directory to cache the model list of the Hub. Default ~/.cache/query_hf_hub/",
+    )
+
+    # CLI for converting the download trend database between storage formats.
+    convert_download_db_parser = subprasers.add_parser(
+        "convert_download_db",
+        help="Convert download trend database between JSON, columnar, and delta formats."
+        "Paths ending with .json are JSON files, .delta are delta-encoded directories, and "
+        "others are columnar directories.",
+    )
+    convert_download_db_parser.add_argument(
+        "--src", type=str, required=True, help="The path to the source download trend database"
+    )
+    convert_download_db_parser.add_argument(
+        "--dst", type=str, required=True, help="The path to the target download trend database"
+    )
+    add_pretty_arg(convert_download_db_parser)
+
+    # CLI for migrating the JSON databases to a SQLite file.
+    migrate_parser = subprasers.add_parser(
+        "migrate_to_sqlite",
+        help="Copy the model size database and/or the download trend database into a SQLite "
+        "file, which can then be used as --size-db and --download-db",
+    )
+    migrate_parser.add_argument(
+        "--size-db", type=str, help="The path to model size database in JSON"
+    )
+    migrate_parser.add_argument(
+        "--download-db", type=str, help="The path to download trend database"
+    )
+    migrate_parser.add_argument(
+        "--dst", type=str, required=True, help="The path to the SQLite file (.sqlite or .db)"
+    )
+
+    # CLI for serving queries with the DBs in memory.
+    serve_parser = subprasers.add_parser(
+        "serve", help="Serve query_top, query_download and query_size over localhost HTTP"
+    )
+    serve_parser.add_argument("--size-db", type=str, help="The path to model size database in JSON")
+    serve_parser.add_argument("--download-db", type=str, help="The path to download trend database")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1", help="The host to bind")
+    serve_parser.add_argument("--port", type=int, default=8765, help="The port to listen on")
+    serve_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1,
+        help="The seconds between checks of the DB files for changes",
+    )
+    add_config_store_args(serve_parser)
+    add_pretty_arg(serve_parser)
     return parser.parse_args()
 
 
+def query_hub(args):
+    from .query_hub import query_hf_hub
+
+    top_k = None if args.end == float("inf") else args.end
+    with profiling.phase("hub.list_models"):
+        return query_hf_hub(args.cache_ttl, args.stream, top_k, cache_dir=args.cache_dir)
+
+
 def main():
     args = parse_args()
 
+    if args.profile or args.profile_cpu or args.profile_memory or args.metrics_out:
+        profiling.enable(cpu_profile=args.profile_cpu, trace_memory=args.profile_memory)
+    try:
+        run(args)
+    finally:
+        profiling.report(args.mode, args.metrics_out, print_summary=args.profile)
+
+
+def run(args):
+    if args.server is not None and args.mode in ("query_top", "query_download", "query_size"):
+        from .server import forward
+
+        if forward(args):
+            return
+
     if args.mode == "update_size_db":
-        SizeDB(args.size_db).update(query_hf_hub(), args)
+        from .size_db import open_size_db
+
+        size_db = open_size_db(args.size_db, fsync=args.fsync, pretty=args.pretty)
+        if args.retry_failed:
+            size_db.retry_failed(args)
+        else:
+            size_db.update(query_hub(args), args)
     elif args.mode == "update_download_trend_db":
-        DownloadTrendDB(args.download_db).update(query_hf_hub(), args)
+        from .download_db import open_download_db
+        from .rank_index import open_rank_index
+        from .size_stats import open_size_stats
+
+        download_db = open_download_db(args.download_db, pretty=args.pretty)
+        today = download_db.update(query_hub(args), args, append_only=args.append_only)
+
+        # Incrementally index the ranks of the new records, and drop the stale size stats.
+        open_rank_index(download_db, args.download_db).add_date(today)
+        open_size_stats(args.download_db).invalidate(today)
+    elif args.mode == "compact":
+        from .download_db import open_download_db
+
+        open_download_db(args.download_db, pretty=args.pretty).compact()
     elif args.mode == "draw_download_trend":
+        from .query_db import draw_download_trend
+
         draw_download_trend(args)
+    elif args.mode == "draw_size_trend":
+        from .query_db import draw_size_trend
+
+        draw_size_trend(args)
+    elif args.mode == "query_size_stats":
+        from .query_db import query_size_stats
+
+        query_size_stats(args, print_markdown=True)
     elif args.mode == "query_top":
+        from .query_db import query_top_models
+
         query_top_models(args, print_markdown=True)
+    elif args.mode == "query_growth":
+        from .query_db import query_growth
+
+        query_growth(args, print_markdown=True)
     elif args.mode == "query_download":
+        from .download_db import open_download_db
+        from .query_db import query_model_download
+
         query_model_download(
-            args.model_ids, args.date, DownloadTrendDB(args.download_db), print_result=True
+            args.model_ids, args.date, open_download_db(args.download_db), print_result=True
         )
     elif args.mode == "query_size":
-        query_model_size(args.model_ids, SizeDB(args.size_db), print_result=True)
+        from .query_db import query_model_size
+        from .size_db import open_size_db
+
+        size_db = open_size_db(args.size_db, pretty=args.pretty)
+        config_store = None
+        if args.config_store is not None:
+            from .config_store import ConfigStore, prefetch_configs
+
+            config_store = ConfigStore(args.config_store)
+            missing = [m for m in args.model_ids if size_db.lookup(m) is None]
+            prefetch_configs(missing, config_store, args.fetch_concurrency, args.fetch_rate)
+        query_model_size(args.model_ids, size_db, print_result=True, config_store=config_store)
+        size_db.persist()
+    elif args.mode == "verify_param_count":
+        from .size_db import verify_param_count
+
+        if args.model_ids is None:
+            all_models = query_hub(args)
+            model_ids = [m.modelId for m in all_models[args.start : min(args.end, len(all_models))]]
+        else:
+            model_ids = args.model_ids
+        verify_param_count(model_ids)
+    elif args.mode == "cache":
+        from .model_list_cache import ModelListCache
+
+        cache = ModelListCache(args.cache_dir)
+        if args.action == "info":
+            cache.info()
+        else:
+            cache.clear()
+    elif args.mode == "convert_download_db":
+        from .download_db import convert_download_db
+
+        convert_download_db(args.src, args.dst, pretty=args.pretty)
+    elif args.mode == "migrate_to_sqlite":
+        from .sqlite_db import migrate_to_sqlite
+
+        migrate_to_sqlite(args.dst, size_db=args.size_db, download_db=args.download_db)
+    elif args.mode == "serve":
+        from .server import serve
+
+        serve(args)
 
 
 if __name__ == "__main__":
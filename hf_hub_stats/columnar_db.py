@@ -0,0 +1,166 @@
+"""Columnar storage backend of the model download trend database.
+
+The database is a directory with one interned model ID table (``models.json``), the order
+of dates (``dates.json``), and one ``<date>.npy`` file per date. Each date file is an int64
+array of shape (N, 2) holding (model index, download) pairs, and it is opened with mmap so
+that a query only touches the dates it needs.
+"""
+from typing import List
+import datetime
+import os
+
+import json
+import numpy as np
+
+from . import profiling
+from .download_db import DATE_FORMAT, ModelNDownload
+
+MODEL_TABLE_FILE = "models.json"
+DATE_ORDER_FILE = "dates.json"
+
+
+class ColumnarDownloadTrendDB:
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self.model_ids = []
+        self.model_index = {}
+        self.columns = {}
+        self.dirty_dates = set()
+        self.dirty_models = False
+
+        model_table = os.path.join(dir_name, MODEL_TABLE_FILE)
+        if os.path.exists(model_table):
+            with open(model_table, "r") as filep:
+                self.model_ids = json.load(filep)
+            self.model_index = {model_id: idx for idx, model_id in enumerate(self.model_ids)}
+            files = {f[: -len(".npy")] for f in os.listdir(dir_name) if f.endswith(".npy")}
+
+            # Dates are in the order they were added, e.g., the order of the converted DB, and
+            # dates missing in the order file (e.g., written before it) are in chronological
+            # order.
+            dates = []
+            date_order = os.path.join(dir_name, DATE_ORDER_FILE)
+            if os.path.exists(date_order):
+                with open(date_order, "r") as filep:
+                    dates = [date for date in json.load(filep) if date in files]
+            dates.extend(
+                sorted(
+                    files.difference(dates),
+                    key=lambda d: datetime.datetime.strptime(d, DATE_FORMAT),
+                )
+            )
+
+            # Columns are loaded lazily on the first access.
+            self.columns = dict.fromkeys(dates)
+            print(f"{len(self.columns)} records loaded from the download trend DB", flush=True)
+
+    def _date_file(self, date):
+        return os.path.join(self.dir_name, f"{date}.npy")
+
+    def get_columns(self, date):
+        """Get the (model index, download) columns of the given date."""
+        if date not in self.columns:
+            raise KeyError(date)
+        if self.columns[date] is None:
+            self.columns[date] = np.load(self._date_file(date), mmap_mode="r")
+        return self.columns[date][:, 0], self.columns[date][:, 1]
+
+    def date_signature(self, date):
+        """The signature of the persisted records of the date, which changes when they are
+        rewritten, or None if the date has unpersisted modifications."""
+        if date in self.dirty_dates:
+            return None
+        stat = os.stat(self._date_file(date))
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def intern(self, model_id):
+        """Get the index of the model ID in the model table, adding it if absent."""
+        if model_id not in self.model_index:
+            self.model_index[model_id] = len(self.model_ids)
+            self.model_ids.append(model_id)
+            self.dirty_models = True
+        return self.model_index[model_id]
+
+    def __getitem__(self, key):
+        model_indices, downloads = self.get_columns(key)
+        return [
+            ModelNDownload(self.model_ids[idx], download)
+            for idx, download in zip(model_indices.tolist(), downloads.tolist())
+        ]
+
+    def __setitem__(self, key, val):
+        data = [(self.intern(m.model_id), m.download) for m in val]
+        self.columns[key] = np.array(data, dtype=np.int64).reshape(-1, 2)
+        self.dirty_dates.add(key)
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def latest(self) -> str:
+        return self[self.dates(sort=True)[-1]]
+
+    def dates(self, sort=False) -> List[str]:
+        ret = [datetime.datetime.strptime(d, DATE_FORMAT) for d in self.columns.keys()]
+        ret = sorted(ret) if sort else ret
+        return [r.strftime(DATE_FORMAT) for r in ret]
+
+    def persist(self):
+        print(
+            f"Updating database with {len(self.dirty_dates)} of total {len(self.columns)} records",
+            flush=True,
+        )
+        os.makedirs(self.dir_name, exist_ok=True)
+        for date in self.dirty_dates:
+            tmp_file = self._date_file(date) + ".tmp"
+            with profiling.phase("download_db.persist"), open(tmp_file, "wb") as filep:
+                np.save(filep, np.ascontiguousarray(self.columns[date]))
+                profiling.count("download_db.bytes_written", filep.tell())
+            os.replace(tmp_file, self._date_file(date))
+            # Reopen with mmap to release the in-memory copy.
+            self.columns[date] = None
+        self.dirty_dates = set()
+
+        if self.dirty_models:
+            model_table = os.path.join(self.dir_name, MODEL_TABLE_FILE)
+            with open(model_table + ".tmp", "w") as filep:
+                json.dump(self.model_ids, filep)
+            os.replace(model_table + ".tmp", model_table)
+        self.dirty_models = False
+
+        date_order = os.path.join(self.dir_name, DATE_ORDER_FILE)
+        with open(date_order + ".tmp", "w") as filep:
+            json.dump(list(self.columns), filep)
+        os.replace(date_order + ".tmp", date_order)
+
+    def compact(self):
+        print("Skip compacting because the columnar DB has no segments", flush=True)
+
+    def update(self, all_models, args, append_only=False):
+        # Each date is already an individual file in this backend, so an update only writes
+        # the arrays of today no matter whether append_only is set.
+        today = datetime.datetime.today().strftime(DATE_FORMAT)
+        records = self[today] if today in self.columns else []
+        for model in all_models[args.start : min(args.end, len(all_models))]:
+            if not hasattr(model, "downloads"):
+                continue
+            records.append(ModelNDownload(model.modelId, model.downloads))
+        self[today] = records
+
+        self.persist()
+        return today
+
+    def prune(self, max_records=10):
+        dates = self.dates(sort=True)
+        if max_records >= len(dates):
+            print(f"Skip pruning because {max_records} >= {len(dates)}", flush=True)
+            return
+        tbd = len(dates) - max_records
+        for date in dates[:tbd]:
+            del self.columns[date]
+            self.dirty_dates.discard(date)
+            if os.path.exists(self._date_file(date)):
+                os.remove(self._date_file(date))
+        self.persist()
@@ -0,0 +1,169 @@
+"""Local content-addressed store of model configs and a concurrent bulk prefetcher.
+
+Configs are stored as ``objects/<sha256>.json`` blobs, so identical configs (e.g., fine-tunes
+of the same base model) are stored once, and ``refs/<model ID>`` files point models to blobs.
+
+Configs are fetched with blocking requests on a thread pool, which keeps the requests of a
+bulk fetch in flight with one shared connection pool.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import os
+import threading
+import time
+
+import json
+
+from . import profiling
+
+
+class ConfigStore:
+    def __init__(self, root):
+        self.root = root
+
+    def _ref_file(self, model_id):
+        return os.path.join(self.root, "refs", model_id)
+
+    def _object_file(self, digest):
+        return os.path.join(self.root, "objects", f"{digest}.json")
+
+    def __contains__(self, model_id):
+        return os.path.exists(self._ref_file(model_id))
+
+    def get(self, model_id):
+        """Get the config dict of the model, or None if it is not in the store."""
+        if model_id not in self:
+            return None
+        with open(self._ref_file(model_id), "r") as filep:
+            digest = filep.read().strip()
+        with open(self._object_file(digest), "r") as filep:
+            return json.load(filep)
+
+    def put(self, model_id, content):
+        """Store the raw content (bytes) of config.json of the model and return its digest."""
+        digest = hashlib.sha256(content).hexdigest()
+        for path, data in [
+            (self._object_file(digest), content),
+            (self._ref_file(model_id), digest.encode()),
+        ]:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as filep:
+                filep.write(data)
+            os.replace(path + ".tmp", path)
+        return digest
+
+
+class TokenBucket:
+    """Allow `rate` requests per second on average with bursts up to `capacity`, shared by
+    threads."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = max(1, rate) if capacity is None else capacity
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Waiting threads queue on the lock, so requests are admitted in order.
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                time.sleep((1 - self.tokens) / self.rate)
+
+
+# HTTP status codes worth retrying.
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def _fetch_config(session, bucket, url, retries, backoff, timeout):
+    """Fetch a config. Return the content, or None if the config does not exist."""
+    import requests
+
+    for attempt in range(retries + 1):
+        bucket.acquire()
+        try:
+            resp = session.get(url, timeout=timeout, allow_redirects=True)
+        except requests.RequestException:
+            if attempt == retries:
+                raise
+            delay = backoff * 2**attempt
+        else:
+            if resp.status_code == 200:
+                return resp.content
+            if resp.status_code not in RETRY_STATUS:
+                # E.g., 404 if the model has no config.json, or 401 for gated models.
+                return None
+            if attempt == retries:
+                resp.raise_for_status()
+            retry_after = resp.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2**attempt
+        time.sleep(delay)
+
+
+def prefetch_configs(
+    model_ids, store, concurrency=16, rate=10.0, retries=3, backoff=1.0, timeout=30
+):
+    """Fetch config.json of the models that are not in the store with at most `concurrency`
+    requests in flight and `rate` requests per second. Requests failed with network errors,
+    rate limits or server errors are retried with exponential backoff.
+    """
+    import requests
+
+    model_ids = [model_id for model_id in dict.fromkeys(model_ids) if model_id not in store]
+    stats = {"fetched": 0, "missing": 0, "failed": 0}
+    if not model_ids:
+        return stats
+
+    print(f"Prefetching configs of {len(model_ids)} models", flush=True)
+    endpoint = os.environ.get("HF_ENDPOINT", "https://huggingface.co")
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if os.environ.get("HF_TOKEN"):
+        session.headers["Authorization"] = f"Bearer {os.environ['HF_TOKEN']}"
+    bucket = TokenBucket(rate)
+
+    try:
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = {
+                executor.submit(
+                    _fetch_config,
+                    session,
+                    bucket,
+                    f"{endpoint}/{model_id}/resolve/main/config.json",
+                    retries,
+                    backoff,
+                    timeout,
+                ): model_id
+                for model_id in model_ids
+            }
+            # Results are stored in this thread as they complete.
+            for future in as_completed(futures):
+                model_id = futures[future]
+                try:
+                    content = future.result()
+                except Exception as err:
+                    print(f"Failed to fetch the config of {model_id}: {err}", flush=True)
+                    stats["failed"] += 1
+                    continue
+                if content is None:
+                    stats["missing"] += 1
+                else:
+                    profiling.count("config_fetch.bytes", len(content))
+                    store.put(model_id, content)
+                    stats["fetched"] += 1
+    finally:
+        session.close()
+    print(
+        f"Prefetched {stats['fetched']} configs, {stats['missing']} missing, "
+        f"{stats['failed']} failed",
+        flush=True,
+    )
+    return stats
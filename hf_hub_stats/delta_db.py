@@ -0,0 +1,375 @@
+"""Delta-encoded storage backend of the model download trend database.
+
+The database is a directory (``*.delta``) with an interned model ID table (``models.json``),
+a date index (``dates.json``) of the dates in chronological order with the size of the
+model table and the files of each date, and one ``<date>.<generation>.bin`` file per date.
+Re-encoded dates are written to the files of a new generation, which the date index switches
+to at once, so an interrupted update leaves the previous DB intact. Each date is the downloads
+of all models in the model table as a dense vector (-1 for models absent at the date),
+stored as zigzag varint deltas against the vector of the previous date. The first date is
+the base snapshot, which is delta-encoded against an all-absent vector.
+
+Successive 30-day totals of most models change little and absent models do not change, so
+most deltas take one byte. The whole history is decoded in one vectorized pass into a
+(date, model) matrix, which also serves trend analytics such as query_growth.
+
+Records of a date are reconstructed in their original order, so that the backends return the
+same records in the same order. Dates whose records are not in the order of downloads
+(descending) and then model indices also have a ``<date>.<generation>.order`` file with the
+positions of the records in that order as compressed varint gaps. A model appears at most
+once per date (the last record wins, at the position of the first one).
+"""
+from typing import List
+import datetime
+import os
+import zlib
+
+import json
+import numpy as np
+
+from . import profiling
+from .download_db import DATE_FORMAT, ModelNDownload
+
+MODEL_TABLE_FILE = "models.json"
+DATE_INDEX_FILE = "dates.json"
+
+# The downloads of models absent at a date.
+ABSENT = -1
+
+# The max number of bytes of a 64-bit varint.
+MAX_VARINT_BYTES = 10
+
+
+def encode_varints(values):
+    """Encode an int64 array to zigzag varint bytes."""
+    values = np.asarray(values, dtype=np.int64)
+    zigzag = (values.astype(np.uint64) << np.uint64(1)) ^ (values >> 63).astype(np.uint64)
+
+    # The number of 7-bit groups of each value.
+    n_bytes = np.ones(len(zigzag), dtype=np.int64)
+    for k in range(1, MAX_VARINT_BYTES):
+        n_bytes += zigzag >= (np.uint64(1) << np.uint64(7 * k))
+    offsets = np.cumsum(n_bytes) - n_bytes
+
+    out = np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    for k in range(MAX_VARINT_BYTES):
+        idx = np.nonzero(n_bytes > k)[0]
+        if len(idx) == 0:
+            break
+        group = (zigzag[idx] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[idx] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[idx] + k] = (group | more).astype(np.uint8)
+    return out.tobytes()
+
+
+def decode_varints(data):
+    """Decode zigzag varint bytes to an int64 array."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # Each value ends at a byte without the continuation bit.
+    ends = np.nonzero(data < 0x80)[0]
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    group_of_byte = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(data)) - starts[group_of_byte]) * 7
+    terms = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    zigzag = np.bitwise_or.reduceat(terms, starts)
+    return (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+
+
+def _canonical_order(vec):
+    """The indices of the models present in the vector in the order of downloads (descending)
+    and then model indices."""
+    present = np.nonzero(vec != ABSENT)[0]
+    return present[np.argsort(-vec[present], kind="stable")]
+
+
+def encode_order(order, canonical):
+    """Encode a record order of model indices as the gaps between the positions of the records
+    in the canonical order, which are all zero and compress away if the orders mostly agree."""
+    rank = np.zeros(int(canonical.max()) + 1 if len(canonical) else 0, dtype=np.int64)
+    rank[canonical] = np.arange(len(canonical))
+    gaps = np.diff(rank[order], prepend=-1) - 1
+    return zlib.compress(encode_varints(gaps))
+
+
+def decode_order(data, canonical):
+    """Decode a record order of model indices encoded by encode_order."""
+    gaps = decode_varints(zlib.decompress(data))
+    return canonical[np.cumsum(gaps + 1) - 1]
+
+
+def _generation(file_name):
+    """The generation of a `<date>.<generation>.bin` or `<date>.<generation>.order` file,
+    which is 0 for `<date>.bin`."""
+    parts = file_name.split(".")
+    return int(parts[1]) if len(parts) == 3 else 0
+
+
+def _align(vec, length):
+    """Truncate the vector or pad it with ABSENT to the length."""
+    ret = np.full(length, ABSENT, dtype=np.int64)
+    n = min(length, len(vec))
+    ret[:n] = vec[:n]
+    return ret
+
+
+class DeltaDownloadTrendDB:
+    def __init__(self, dir_name):
+        self.dir_name = dir_name
+        self.model_ids = []
+        self.model_index = {}
+
+        # Dates in chronological order, the size of the model table at each date, and the
+        # files of each date in the date index. Dates without an order file have records in
+        # the canonical order.
+        self.date_list = []
+        self.n_models = {}
+        self.files = {}
+        self.order_files = {}
+        self.generation = 0
+
+        # The dense download vectors of all dates, which are decoded on the first access.
+        self.vectors = None
+
+        # The record orders of dates, which are decoded on the first access of each date,
+        # and None for dates in the canonical order.
+        self.orders = {}
+
+        # Dates after (and including) this position have to be re-encoded on persisting.
+        self.dirty_from = None
+        self.dirty_models = False
+
+        date_index = os.path.join(dir_name, DATE_INDEX_FILE)
+        if os.path.exists(date_index):
+            with open(os.path.join(dir_name, MODEL_TABLE_FILE), "r") as filep:
+                self.model_ids = json.load(filep)
+            self.model_index = {model_id: idx for idx, model_id in enumerate(self.model_ids)}
+            with open(date_index, "r") as filep:
+                for entry in json.load(filep):
+                    date, n_models = entry[:2]
+                    self.date_list.append(date)
+                    self.n_models[date] = n_models
+                    # Date indices written before generations have <date>.bin files.
+                    self.files[date] = entry[2] if len(entry) > 2 else f"{date}.bin"
+                    self.order_files[date] = entry[3] if len(entry) > 3 else None
+            self.generation = max([_generation(f) for f in self.files.values()] + [0])
+            print(f"{len(self.date_list)} records loaded from the download trend DB", flush=True)
+
+    def _date_file(self, date):
+        return os.path.join(self.dir_name, self.files[date])
+
+    def _decode_all(self):
+        """Decode the deltas of all dates in one pass."""
+        if self.vectors is not None:
+            return
+        self.vectors = {}
+        prev = np.empty(0, dtype=np.int64)
+        for date in self.date_list:
+            with profiling.phase("download_db.read"), open(self._date_file(date), "rb") as filep:
+                data = filep.read()
+                delta = decode_varints(data)
+            profiling.count("download_db.bytes_read", len(data))
+            prev = self.vectors[date] = _align(prev, len(delta)) + delta
+
+    def date_signature(self, date):
+        """The signature of the persisted deltas of the date, which changes when they are
+        re-encoded, or None if the date has unpersisted modifications."""
+        if self.dirty_from is not None and self.date_list.index(date) >= self.dirty_from:
+            return None
+        stat = os.stat(self._date_file(date))
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def intern(self, model_id):
+        if model_id not in self.model_index:
+            self.model_index[model_id] = len(self.model_ids)
+            self.model_ids.append(model_id)
+            self.dirty_models = True
+        return self.model_index[model_id]
+
+    def vector(self, date):
+        """The downloads of all models at the date, with ABSENT for absent models."""
+        if date not in self.n_models:
+            raise KeyError(date)
+        self._decode_all()
+        # Models interned after the date are absent.
+        return _align(self.vectors[date], len(self.model_ids))
+
+    def matrix(self, dates=None):
+        """The (date, model) matrix of downloads of the dates (default all in chronological
+        order), with ABSENT for absent models."""
+        dates = self.date_list if dates is None else dates
+        matrix = np.full((len(dates), len(self.model_ids)), ABSENT, dtype=np.int64)
+        for row, date in enumerate(dates):
+            matrix[row] = self.vector(date)
+        return matrix
+
+    def record_order(self, date):
+        """The model indices of the records of the date in their original order, or None if
+        the records are in the canonical order."""
+        if date not in self.orders:
+            order = None
+            if self.order_files.get(date) is not None:
+                file_name = os.path.join(self.dir_name, self.order_files[date])
+                with profiling.phase("download_db.read"), open(file_name, "rb") as filep:
+                    data = filep.read()
+                    order = decode_order(data, _canonical_order(self.vector(date)))
+                profiling.count("download_db.bytes_read", len(data))
+            self.orders[date] = order
+        return self.orders[date]
+
+    def get_columns(self, date):
+        """Get the (model index, download) columns of the given date."""
+        vec = self.vector(date)
+        order = self.record_order(date)
+        if order is None:
+            order = _canonical_order(vec)
+        return order, vec[order]
+
+    def __getitem__(self, key):
+        model_indices, downloads = self.get_columns(key)
+        return [
+            ModelNDownload(self.model_ids[idx], download)
+            for idx, download in zip(model_indices.tolist(), downloads.tolist())
+        ]
+
+    def __setitem__(self, key, val):
+        self._decode_all()
+        indices = np.array([self.intern(m.model_id) for m in val], dtype=np.int64)
+        vec = np.full(len(self.model_ids), ABSENT, dtype=np.int64)
+        vec[indices] = [m.download for m in val]
+        self.vectors[key] = vec
+
+        # Repeated models keep the position of their first record.
+        _, first = np.unique(indices, return_index=True)
+        order = indices[np.sort(first)]
+        self.orders[key] = None if np.array_equal(order, _canonical_order(vec)) else order
+
+        if key not in self.n_models:
+            self.date_list.append(key)
+            self.date_list.sort(key=lambda d: datetime.datetime.strptime(d, DATE_FORMAT))
+        self.n_models[key] = len(vec)
+        self._mark_dirty(key)
+
+    def _mark_dirty(self, date):
+        pos = self.date_list.index(date)
+        self.dirty_from = pos if self.dirty_from is None else min(self.dirty_from, pos)
+
+    def __contains__(self, key):
+        return key in self.n_models
+
+    def __len__(self):
+        return len(self.date_list)
+
+    def latest(self) -> str:
+        return self[self.date_list[-1]]
+
+    def dates(self, sort=False) -> List[str]:
+        # Dates are always in chronological order.
+        return list(self.date_list)
+
+    def persist(self):
+        n_dirty = 0 if self.dirty_from is None else len(self.date_list) - self.dirty_from
+        print(
+            f"Updating database with {n_dirty} of total {len(self.date_list)} records",
+            flush=True,
+        )
+        os.makedirs(self.dir_name, exist_ok=True)
+        if self.dirty_from is not None:
+            # The deltas of later dates depend on re-encoded dates, so the files of the
+            # current generation are not overwritten until the date index switches.
+            self.generation += 1
+            prev = np.empty(0, dtype=np.int64)
+            if self.dirty_from > 0:
+                prev = self.vectors[self.date_list[self.dirty_from - 1]]
+            for date in self.date_list[self.dirty_from :]:
+                vec = self.vectors[date]
+                self._persist_order(date)
+                self.files[date] = f"{date}.{self.generation}.bin"
+                tmp_file = self._date_file(date) + ".tmp"
+                with profiling.phase("download_db.persist"), open(tmp_file, "wb") as filep:
+                    data = encode_varints(vec - _align(prev, len(vec)))
+                    filep.write(data)
+                profiling.count("download_db.bytes_written", len(data))
+                os.replace(tmp_file, self._date_file(date))
+                prev = vec
+        self.dirty_from = None
+
+        # Write the model table before the date index that refers to it.
+        if self.dirty_models:
+            model_table = os.path.join(self.dir_name, MODEL_TABLE_FILE)
+            with open(model_table + ".tmp", "w") as filep:
+                json.dump(self.model_ids, filep)
+            os.replace(model_table + ".tmp", model_table)
+        self.dirty_models = False
+
+        date_index = os.path.join(self.dir_name, DATE_INDEX_FILE)
+        entries = []
+        for date in self.date_list:
+            entry = [date, self.n_models[date], self.files[date]]
+            if self.order_files.get(date) is not None:
+                entry.append(self.order_files[date])
+            entries.append(entry)
+        with open(date_index + ".tmp", "w") as filep:
+            json.dump(entries, filep)
+        os.replace(date_index + ".tmp", date_index)
+
+        # Remove the files of previous generations and pruned dates, and files left by
+        # interrupted updates.
+        files = set(self.files.values()) | set(self.order_files.values())
+        suffixes = (".bin", ".bin.tmp", ".order", ".order.tmp")
+        for file_name in os.listdir(self.dir_name):
+            if file_name.endswith(suffixes) and file_name not in files:
+                os.remove(os.path.join(self.dir_name, file_name))
+
+    def _persist_order(self, date):
+        """Write the record order of a re-encoded date to the order file of the current
+        generation if it is not the canonical order."""
+        order = self.record_order(date)
+        self.order_files[date] = None
+        if order is None:
+            return
+        self.order_files[date] = f"{date}.{self.generation}.order"
+        file_name = os.path.join(self.dir_name, self.order_files[date])
+        with profiling.phase("download_db.persist"), open(file_name + ".tmp", "wb") as filep:
+            data = encode_order(order, _canonical_order(self.vectors[date]))
+            filep.write(data)
+        profiling.count("download_db.bytes_written", len(data))
+        os.replace(file_name + ".tmp", file_name)
+
+    def compact(self):
+        print("Skip compacting because the delta DB has no segments", flush=True)
+
+    def update(self, all_models, args, append_only=False):
+        # Only the deltas of today are written if today is the latest date.
+        today = datetime.datetime.today().strftime(DATE_FORMAT)
+        records = self[today] if today in self else []
+        for model in all_models[args.start : min(args.end, len(all_models))]:
+            if not hasattr(model, "downloads"):
+                continue
+            records.append(ModelNDownload(model.modelId, model.downloads))
+        self[today] = records
+
+        self.persist()
+        return today
+
+    def prune(self, max_records=10):
+        dates = self.dates(sort=True)
+        if max_records >= len(dates):
+            print(f"Skip pruning because {max_records} >= {len(dates)}", flush=True)
+            return
+        self._decode_all()
+        tbd = len(dates) - max_records
+        for date in dates[:tbd]:
+            del self.vectors[date]
+            del self.n_models[date]
+            del self.files[date]
+            self.order_files.pop(date, None)
+            self.orders.pop(date, None)
+        self.date_list = dates[tbd:]
+
+        # The first remaining date becomes the base snapshot. Files of the pruned dates are
+        # removed on persisting.
+        self.dirty_from = 0
+        self.persist()
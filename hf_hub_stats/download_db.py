@@ -1,71 +1,367 @@
 """The database of model download trends."""
+from collections import OrderedDict
 from typing import List
 import datetime
 import os
+import zlib
 
 import json
-from dataclasses import asdict, dataclass
+from dataclasses import field
 
+from . import profiling, serialization
+from .utils import slotted_dataclass
 
-@dataclass
+DATE_FORMAT = "%m-%d-%y"
+
+
+@slotted_dataclass
 class ModelNDownload:
     """The dataclass of download count in the past 30 days of a model."""
 
     model_id: str
     download: int
 
+    # The model size in billions attached by queries. It is not stored in the DB.
+    size: float = field(default=0, repr=False, compare=False)
+
+    def to_dict(self):
+        """The record in the JSON schema of the DB."""
+        return {"model_id": self.model_id, "download": self.download}
+
+
+# The max number of unmodified dates whose records are kept in memory after loading.
+MAX_RESIDENT_DATES = 32
+
 
 class DownloadTrendDB:
-    def __init__(self, file_name):
+    """The download trend DB in a JSON file of {date: records}. Only the date index is loaded
+    on opening, which is the byte offsets of the records of each date in the file, cached in
+    `<file_name>.index`. Records of a date are deserialized on the first access, and at most
+    `max_resident_dates` unmodified dates are kept in memory. Modify records with
+    `__setitem__` instead of mutating the returned lists. The DB file is written in compact
+    JSON unless `pretty` is set.
+    """
+
+    def __init__(self, file_name, max_resident_dates=MAX_RESIDENT_DATES, pretty=False):
         self.file_name = file_name
-        self.db = {}
+        self.max_resident_dates = max_resident_dates
+        self.pretty = pretty
+
+        # Whether the current DB file is pretty JSON.
+        self.file_pretty = None
+
+        # All dates in the file order (an ordered set) and their sorted order.
+        self.keys = {}
+        self.sorted_dates = None
+
+        # Map from dates to the (start, end) byte offsets of their records in the DB file.
+        self.offsets = {}
+
+        # Loaded records of unmodified dates in the LRU order, and records of modified dates.
+        self.resident = OrderedDict()
+        self.modified = {}
+
         if os.path.exists(file_name):
-            with open(file_name, "r") as filep:
-                for key, val in json.load(filep).items():
-                    self.db[key] = [ModelNDownload(**v) for v in val]
-            print(f"{len(self.db)} records loaded from the download trend DB", flush=True)
+            with profiling.phase("download_db.load_index"):
+                self.offsets = self._load_date_index()
+            self.keys = dict.fromkeys(self.offsets)
+            print(f"{len(self.keys)} records loaded from the download trend DB", flush=True)
+
+        # Immutable segments written by append-only updates but not yet compacted.
+        self.segment_dir = f"{file_name}.segments"
+        self.segments = []
+        self.segment_records = {}
+        self._finish_merge()
+        if os.path.exists(self.segment_dir):
+            for segment in sorted(os.listdir(self.segment_dir)):
+                if not segment.endswith(".json"):
+                    continue
+                segment = os.path.join(self.segment_dir, segment)
+                with open(segment, "rb") as filep:
+                    for key, val in serialization.loads(filep.read()).items():
+                        self.segment_records.setdefault(key, []).extend(
+                            ModelNDownload(**v) for v in val
+                        )
+                        self.keys[key] = None
+                self.segments.append(segment)
+            print(f"{len(self.segments)} segments loaded from the download trend DB", flush=True)
+
+    @property
+    def index_file(self):
+        return f"{self.file_name}.index"
+
+    @property
+    def merge_file(self):
+        return f"{self.file_name}.merged"
+
+    def _finish_merge(self):
+        # The segments merged into the DB file by a persist that stopped before removing them,
+        # which would otherwise be loaded again on top of the merged records. The merge file
+        # is written before the DB file is replaced, and names the new DB file by its size and
+        # mtime, so the segments are kept if the DB file was not replaced.
+        if not os.path.exists(self.merge_file):
+            return
+        with open(self.merge_file, "r") as filep:
+            merge = json.load(filep)
+        stat = os.stat(self.file_name) if os.path.exists(self.file_name) else None
+        if stat is not None and (stat.st_size, stat.st_mtime_ns) == (
+            merge["size"],
+            merge["mtime_ns"],
+        ):
+            for segment in merge["segments"]:
+                segment = os.path.join(self.segment_dir, segment)
+                if os.path.exists(segment):
+                    print(f"Removing merged segment {segment}", flush=True)
+                    os.remove(segment)
+        os.remove(self.merge_file)
+
+    def _load_date_index(self):
+        stat = os.stat(self.file_name)
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, "r") as filep:
+                    index = json.load(filep)
+                if index["size"] == stat.st_size and index["mtime_ns"] == stat.st_mtime_ns:
+                    self.file_pretty = index["pretty"]
+                    return {date: (start, end) for date, start, end in index["dates"]}
+            except (OSError, ValueError, KeyError):
+                pass
+
+        # The index is missing or stale (e.g., the DB file was written by other tools).
+        # Scan the file incrementally so that only one date is in memory at a time.
+        with open(self.file_name, "rb") as filep:
+            self.file_pretty = filep.read(2) == b"{\n"
+            filep.seek(0)
+            offsets = {
+                date: (start, end) for date, _, start, end in serialization.iter_items(filep)
+            }
+        self._write_date_index(offsets)
+        return offsets
+
+    def _write_date_index(self, offsets):
+        stat = os.stat(self.file_name)
+        index = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "pretty": self.file_pretty,
+            "dates": [[date, start, end] for date, (start, end) in offsets.items()],
+        }
+        # The index is only a cache, so the DB is usable if it cannot be written, e.g., in a
+        # read-only directory.
+        try:
+            with open(self.index_file + ".tmp", "w") as filep:
+                json.dump(index, filep)
+            os.replace(self.index_file + ".tmp", self.index_file)
+        except OSError as err:
+            print(f"Failed to write the date index {self.index_file}: {err}", flush=True)
+            if os.path.isfile(self.index_file + ".tmp"):
+                os.remove(self.index_file + ".tmp")
+
+    def date_signature(self, key):
+        """The signature of the persisted records of the date, which changes when they are
+        rewritten, or None if the date has unpersisted modifications."""
+        if key in self.modified:
+            return None
+        crc = 0
+        if key in self.offsets:
+            start, end = self.offsets[key]
+            with open(self.file_name, "rb") as filep:
+                filep.seek(start)
+                crc = zlib.crc32(filep.read(end - start))
+        return f"{crc:08x}:{len(self.segment_records.get(key, []))}"
+
+    def _read_records(self, key):
+        records = []
+        if key in self.offsets:
+            start, end = self.offsets[key]
+            with profiling.phase("download_db.read"), open(self.file_name, "rb") as filep:
+                filep.seek(start)
+                data = serialization.loads(filep.read(end - start))
+                records = [ModelNDownload(**v) for v in data]
+            profiling.count("download_db.bytes_read", end - start)
+        records.extend(self.segment_records.get(key, []))
+        return records
 
     def __getitem__(self, key):
-        return self.db[key]
+        if key in self.modified:
+            return self.modified[key]
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            return self.resident[key]
+        if key not in self.keys:
+            raise KeyError(key)
+
+        records = self._read_records(key)
+        self.resident[key] = records
+        while len(self.resident) > self.max_resident_dates:
+            self.resident.popitem(last=False)
+        return records
+
+    def __setitem__(self, key, val):
+        self.resident.pop(key, None)
+        self.modified[key] = val
+        if key not in self.keys:
+            self.keys[key] = None
+            self.sorted_dates = None
 
     def __contains__(self, key):
-        return key in self.db
+        return key in self.keys
 
     def __len__(self):
-        return len(self.db)
+        return len(self.keys)
 
     def latest(self) -> str:
-        dates = sorted([datetime.datetime.strptime(d, "%m-%d-%y") for d in self.db.keys()])
-        return self.db[dates[-1].strftime("%m-%d-%y")]
+        return self[self.dates(sort=True)[-1]]
 
     def dates(self, sort=False) -> List[str]:
-        ret = [datetime.datetime.strptime(d, "%m-%d-%y") for d in self.db.keys()]
-        ret = sorted(ret) if sort else ret
-        return [r.strftime("%m-%d-%y") for r in ret]
+        if not sort:
+            return list(self.keys)
+        if self.sorted_dates is None:
+            self.sorted_dates = sorted(
+                self.keys, key=lambda d: datetime.datetime.strptime(d, DATE_FORMAT)
+            )
+        return list(self.sorted_dates)
+
+    def _items_to_persist(self, src):
+        for date in self.keys:
+            if (
+                date in self.offsets
+                and date not in self.modified
+                and date not in self.segment_records
+                and self.file_pretty == self.pretty
+            ):
+                # Copy unmodified records in the same format without deserialization.
+                start, end = self.offsets[date]
+                src.seek(start)
+                yield date, serialization.RawJSON(src.read(end - start))
+            else:
+                yield date, [r.to_dict() for r in self[date]]
 
     def persist(self):
-        print(f"Updating database with total {len(self.db)} records", flush=True)
-        with open(self.file_name, "w") as filep:
-            data = {k: [asdict(vv) for vv in v] for k, v in self.db.items()}
-            json.dump(data, filep, indent=2)
-
-    def update(self, all_models, args):
-        today = datetime.datetime.today().strftime("%m-%d-%y")
-        if today not in self.db:
-            self.db[today] = []
+        """Write all records to the DB file. Pretty JSON is the same as json.dump(indent=2)."""
+        print(f"Updating database with total {len(self.keys)} records", flush=True)
+        src = open(self.file_name, "rb") if self.offsets else None
+        tmp_file = self.file_name + ".tmp"
+        try:
+            with profiling.phase("download_db.persist"), open(tmp_file, "wb") as filep:
+                offsets = serialization.dump_object(
+                    filep, self._items_to_persist(src), pretty=self.pretty
+                )
+                profiling.count("download_db.bytes_written", filep.tell())
+        finally:
+            if src is not None:
+                src.close()
+        if self.segments:
+            stat = os.stat(tmp_file)
+            merge = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "segments": [os.path.basename(segment) for segment in self.segments],
+            }
+            with open(self.merge_file + ".tmp", "w") as filep:
+                json.dump(merge, filep)
+            os.replace(self.merge_file + ".tmp", self.merge_file)
+        os.replace(tmp_file, self.file_name)
+        self.offsets = offsets
+        self.file_pretty = self.pretty
+        self._write_date_index(offsets)
+
+        # All records are in the DB file now, so modified dates can be evicted as well.
+        for date, records in self.modified.items():
+            self.resident[date] = records
+        self.modified = {}
+        while len(self.resident) > self.max_resident_dates:
+            self.resident.popitem(last=False)
+
+        # All segments are merged into the DB file now.
+        for segment in self.segments:
+            os.remove(segment)
+        if self.segments:
+            os.remove(self.merge_file)
+        self.segments = []
+        self.segment_records = {}
+
+    def compact(self):
+        """Merge all append-only segments into the DB file."""
+        print(f"Compacting {len(self.segments)} segments", flush=True)
+        self.persist()
+
+    def append_segment(self, date, records):
+        """Write the records of a date to a new immutable segment file."""
+        os.makedirs(self.segment_dir, exist_ok=True)
+        seq = 1 + max([int(s.split("_")[0]) for s in os.listdir(self.segment_dir)] + [0])
+        segment = os.path.join(self.segment_dir, f"{seq:06d}_{date}.json")
+        print(f"Writing {len(records)} records to segment {segment}", flush=True)
+        with open(segment + ".tmp", "wb") as filep:
+            filep.write(serialization.dumps({date: [r.to_dict() for r in records]}))
+        os.replace(segment + ".tmp", segment)
+        self.segments.append(segment)
+
+        self.segment_records.setdefault(date, []).extend(records)
+        self.resident.pop(date, None)
+        if date in self.modified:
+            self.modified[date] = self.modified[date] + records
+        if date not in self.keys:
+            self.keys[date] = None
+            self.sorted_dates = None
+
+    def update(self, all_models, args, append_only=False):
+        today = datetime.datetime.today().strftime(DATE_FORMAT)
+        records = []
         for model in all_models[args.start : min(args.end, len(all_models))]:
             if not hasattr(model, "downloads"):
                 continue
-            self.db[today].append(ModelNDownload(model.modelId, model.downloads))
+            records.append(ModelNDownload(model.modelId, model.downloads))
 
-        self.persist()
+        if append_only:
+            self.append_segment(today, records)
+        else:
+            self[today] = (self[today] if today in self else []) + records
+            self.persist()
+        return today
 
     def prune(self, max_records=10):
-        dates = sorted([datetime.datetime.strptime(d, "%m-%d-%y") for d in self.db.keys()])
+        dates = self.dates(sort=True)
         if max_records >= len(dates):
             print(f"Skip pruning because {max_records} >= {len(dates)}", flush=True)
             return
         tbd = len(dates) - max_records
         for date in dates[:tbd]:
-            del self.db[date.strftime("%m-%d-%y")]
+            del self.keys[date]
+            self.resident.pop(date, None)
+            self.modified.pop(date, None)
+            self.segment_records.pop(date, None)
+        self.sorted_dates = None
         self.persist()
+
+
+def open_download_db(file_name, pretty=False):
+    """Open a download trend DB. SQLite files (.sqlite or .db) use SQLiteDownloadTrendDB,
+    JSON files use DownloadTrendDB, directories ending with .delta use the delta-encoded
+    backend, and other paths are treated as a directory of the columnar backend. `pretty`
+    only applies to JSON files."""
+    from .sqlite_db import SQLiteDownloadTrendDB, is_sqlite_file
+
+    if is_sqlite_file(file_name):
+        return SQLiteDownloadTrendDB(file_name)
+    if file_name.rstrip("/").endswith(".delta"):
+        from .delta_db import DeltaDownloadTrendDB
+
+        return DeltaDownloadTrendDB(file_name)
+    if file_name.endswith(".json") or os.path.isfile(file_name):
+        return DownloadTrendDB(file_name, pretty=pretty)
+
+    from .columnar_db import ColumnarDownloadTrendDB
+
+    return ColumnarDownloadTrendDB(file_name)
+
+
+def convert_download_db(src, dst, pretty=False):
+    """Copy all records from one download trend DB to another, e.g., JSON <-> columnar.
+    Dates are copied in the order of the source, so converting a JSON DB back and forth
+    gives the same file (the delta backend keeps dates in chronological order)."""
+    src_db = open_download_db(src)
+    dst_db = open_download_db(dst, pretty=pretty)
+    for date in src_db.dates():
+        dst_db[date] = src_db[date]
+    dst_db.persist()
@@ -0,0 +1,143 @@
+"""Versioned compact cache of the model list of the Hub.
+
+Each cache file is keyed by the schema version and the listing filters, and has the layout:
+
+    MAGIC | version (u32) | header length (u32) | JSON header | model IDs | downloads
+
+The header records the filters, the fetch timestamp, top_k and the model count. Model IDs are
+a newline-separated UTF-8 blob and downloads are an int64 array in the same order, so loading
+is a single read without unpickling any objects.
+"""
+from array import array
+import datetime
+import hashlib
+import os
+import struct
+import time
+
+import json
+
+MAGIC = b"HFHS"
+SCHEMA_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache/query_hf_hub/")
+
+# Cache files of previous formats.
+LEGACY_CACHE_FILES = ("all_models.pkl", "top_models.json")
+
+
+class ModelListCache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = DEFAULT_CACHE_DIR if cache_dir is None else cache_dir
+
+    def path(self, filters):
+        key = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"models-v{SCHEMA_VERSION}-{key}.bin")
+
+    @staticmethod
+    def read(path, with_models=True):
+        """Read the header and (optionally) the (model IDs, downloads) of a cache file.
+        Return (None, None) if the file is not a cache file of the current version, or it is
+        corrupted (e.g., truncated)."""
+        with open(path, "rb") as filep:
+            data = filep.read() if with_models else filep.read(64 * 1024)
+        if data[:4] != MAGIC or len(data) < 12:
+            return None, None
+        version, header_len = struct.unpack("<II", data[4:12])
+        if version != SCHEMA_VERSION:
+            return None, None
+        try:
+            header = json.loads(data[12 : 12 + header_len])
+            if not with_models:
+                return header, None
+
+            offset = 12 + header_len
+            ids = data[offset : offset + header["id_bytes"]].decode("utf-8")
+            model_ids = ids.split("\n") if header["count"] > 0 else []
+            downloads = array("q")
+            downloads.frombytes(data[offset + header["id_bytes"] :])
+        except (ValueError, KeyError):
+            return None, None
+        if len(model_ids) != header["count"] or len(downloads) != header["count"]:
+            return None, None
+        return header, (model_ids, downloads.tolist())
+
+    def load(self, filters, ttl_days, top_k=None):
+        """Load the cached (model IDs, downloads) sorted by downloads, or None if the cache is
+        missing, expired, or has fewer than top_k models."""
+        path = self.path(filters)
+        if not os.path.exists(path):
+            print(f"Querying model list", flush=True)
+            return None
+
+        header, models = self.read(path)
+        if header is None:
+            print(f"Updating cached model list (incompatible or corrupted cache)", flush=True)
+            return None
+
+        days = (time.time() - header["fetched_at"]) / 86400
+        if days > ttl_days:
+            print(f"Updating cached model list (queried in {days:.0f} days)", flush=True)
+            return None
+        cached_top_k = header["top_k"]
+        if cached_top_k is not None and (top_k is None or top_k > cached_top_k):
+            print(f"Updating cached model list (only top-{cached_top_k} cached)", flush=True)
+            return None
+
+        print(f"Using cached model list (queried in {days:.0f} days)", flush=True)
+        model_ids, downloads = models
+        return model_ids[:top_k], downloads[:top_k]
+
+    def save(self, filters, model_ids, downloads, top_k=None):
+        ids = "\n".join(model_ids).encode("utf-8")
+        header = json.dumps(
+            {
+                "filters": filters,
+                "fetched_at": time.time(),
+                "top_k": top_k,
+                "count": len(model_ids),
+                "id_bytes": len(ids),
+            }
+        ).encode()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(filters)
+        with open(path + ".tmp", "wb") as filep:
+            filep.write(MAGIC)
+            filep.write(struct.pack("<II", SCHEMA_VERSION, len(header)))
+            filep.write(header)
+            filep.write(ids)
+            filep.write(array("q", downloads).tobytes())
+        os.replace(path + ".tmp", path)
+
+    def files(self):
+        if not os.path.exists(self.cache_dir):
+            return []
+        return sorted(
+            os.path.join(self.cache_dir, file_name)
+            for file_name in os.listdir(self.cache_dir)
+            if file_name.startswith("models-v") or file_name in LEGACY_CACHE_FILES
+        )
+
+    def info(self):
+        """Print the information of cache files."""
+        print(f"Cache directory: {self.cache_dir}")
+        for path in self.files():
+            size = os.path.getsize(path)
+            header = None
+            if path.endswith(".bin"):
+                header, _ = self.read(path, with_models=False)
+            if header is None:
+                print(f"{os.path.basename(path)}: {size} bytes, legacy or incompatible format")
+                continue
+            fetched_at = datetime.datetime.fromtimestamp(header["fetched_at"])
+            print(
+                f"{os.path.basename(path)}: {size} bytes, filters {header['filters']}, "
+                f"{header['count']} models (top_k={header['top_k']}), "
+                f"fetched at {fetched_at:%Y-%m-%d %H:%M:%S}"
+            )
+
+    def clear(self):
+        files = self.files()
+        for path in files:
+            os.remove(path)
+        print(f"Removed {len(files)} cache files from {self.cache_dir}")
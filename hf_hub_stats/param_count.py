@@ -0,0 +1,299 @@
+"""Count model parameters analytically from model configs.
+
+The counts are the number of parameters of ``transformers.AutoModel.from_config(cfg)``,
+i.e., the base model without task heads, so that they are identical to the ones
+estimated with empty weights.
+"""
+import hashlib
+
+import json
+
+_REQUIRED = object()
+
+
+def _get(cfg, *names, default=_REQUIRED):
+    """Get the first available config field in names. The config can be a
+    transformers config object or a dict loaded from config.json."""
+    for name in names:
+        val = cfg.get(name) if isinstance(cfg, dict) else getattr(cfg, name, None)
+        if val is not None:
+            return val
+    if default is _REQUIRED:
+        raise KeyError(names[0])
+    return default
+
+
+def _linear(in_features, out_features, bias=True):
+    return in_features * out_features + (out_features if bias else 0)
+
+
+def _count_bert(cfg):
+    """BERT, RoBERTa and their variants (BertModel with the pooler)."""
+    if _get(cfg, "position_embedding_type", default="absolute") != "absolute":
+        return None
+    if _get(cfg, "add_cross_attention", default=False):
+        return None
+    hidden = _get(cfg, "hidden_size")
+    inter = _get(cfg, "intermediate_size")
+    n_layer = _get(cfg, "num_hidden_layers")
+
+    embeddings = (
+        _get(cfg, "vocab_size") * hidden
+        + _get(cfg, "max_position_embeddings") * hidden
+        + _get(cfg, "type_vocab_size") * hidden
+        + 2 * hidden
+    )
+    layer = (
+        4 * _linear(hidden, hidden)
+        + 2 * hidden
+        + _linear(hidden, inter)
+        + _linear(inter, hidden)
+        + 2 * hidden
+    )
+    pooler = _linear(hidden, hidden)
+    return embeddings + n_layer * layer + pooler
+
+
+def _count_gpt2(cfg):
+    if _get(cfg, "add_cross_attention", default=False):
+        return None
+    hidden = _get(cfg, "n_embd", "hidden_size")
+    inter = _get(cfg, "n_inner", default=4 * hidden)
+    n_layer = _get(cfg, "n_layer", "num_hidden_layers")
+
+    embeddings = (_get(cfg, "vocab_size") + _get(cfg, "n_positions")) * hidden
+    layer = (
+        2 * hidden
+        + _linear(hidden, 3 * hidden)
+        + _linear(hidden, hidden)
+        + 2 * hidden
+        + _linear(hidden, inter)
+        + _linear(inter, hidden)
+    )
+    return embeddings + n_layer * layer + 2 * hidden
+
+
+def _count_gptj(cfg):
+    hidden = _get(cfg, "n_embd", "hidden_size")
+    inter = _get(cfg, "n_inner", default=4 * hidden)
+    n_layer = _get(cfg, "n_layer", "num_hidden_layers")
+
+    # Attention and MLP are computed in parallel after one layer norm.
+    layer = (
+        2 * hidden
+        + 4 * _linear(hidden, hidden, bias=False)
+        + _linear(hidden, inter)
+        + _linear(inter, hidden)
+    )
+    return _get(cfg, "vocab_size") * hidden + n_layer * layer + 2 * hidden
+
+
+def _count_gpt_neox(cfg):
+    hidden = _get(cfg, "hidden_size")
+    inter = _get(cfg, "intermediate_size")
+    n_layer = _get(cfg, "num_hidden_layers")
+    bias = _get(cfg, "attention_bias", default=True)
+
+    layer = (
+        4 * hidden
+        + _linear(hidden, 3 * hidden, bias)
+        + _linear(hidden, hidden, bias)
+        + _linear(hidden, inter)
+        + _linear(inter, hidden)
+    )
+    return _get(cfg, "vocab_size") * hidden + n_layer * layer + 2 * hidden
+
+
+def _count_t5(cfg):
+    d_model = _get(cfg, "d_model")
+    d_ff = _get(cfg, "d_ff")
+    n_head = _get(cfg, "num_heads")
+    n_layer = _get(cfg, "num_layers")
+    n_decoder_layer = _get(cfg, "num_decoder_layers", default=n_layer)
+    gated = _get(cfg, "feed_forward_proj", default="relu").startswith("gated-")
+
+    inner = n_head * _get(cfg, "d_kv")
+    attn = 4 * d_model * inner
+    ffn = (2 if gated else 1) * d_model * d_ff + d_ff * d_model
+
+    # Only the first layer of encoder and decoder has the relative attention bias.
+    rel_bias = _get(cfg, "relative_attention_num_buckets", default=32) * n_head
+
+    # Layer norms in T5 have no bias.
+    encoder = n_layer * (attn + d_model + ffn + d_model) + rel_bias + d_model
+    decoder = n_decoder_layer * (2 * attn + 2 * d_model + ffn + d_model) + rel_bias + d_model
+    return _get(cfg, "vocab_size") * d_model + encoder + decoder
+
+
+def _count_opt(cfg):
+    if not _get(cfg, "layer_norm_elementwise_affine", default=True):
+        return None
+    hidden = _get(cfg, "hidden_size")
+    ffn_dim = _get(cfg, "ffn_dim")
+    n_layer = _get(cfg, "num_hidden_layers")
+    proj_dim = _get(cfg, "word_embed_proj_dim", default=hidden)
+    bias = _get(cfg, "enable_bias", default=True)
+
+    # OPT offsets the learned positional embeddings by 2.
+    embeddings = _get(cfg, "vocab_size") * proj_dim
+    embeddings += (_get(cfg, "max_position_embeddings") + 2) * hidden
+    if proj_dim != hidden:
+        embeddings += 2 * proj_dim * hidden
+
+    final_layer_norm = 0
+    if _get(cfg, "do_layer_norm_before", default=True) and not _get(
+        cfg, "_remove_final_layer_norm", default=False
+    ):
+        final_layer_norm = 2 * hidden
+
+    layer = (
+        4 * _linear(hidden, hidden, bias)
+        + 2 * hidden
+        + _linear(hidden, ffn_dim, bias)
+        + _linear(ffn_dim, hidden, bias)
+        + 2 * hidden
+    )
+    return embeddings + n_layer * layer + final_layer_norm
+
+
+def _count_bloom(cfg):
+    hidden = _get(cfg, "hidden_size", "n_embed")
+    n_layer = _get(cfg, "n_layer", "num_hidden_layers")
+
+    layer = (
+        2 * hidden
+        + _linear(hidden, 3 * hidden)
+        + _linear(hidden, hidden)
+        + 2 * hidden
+        + _linear(hidden, 4 * hidden)
+        + _linear(4 * hidden, hidden)
+    )
+    # The embeddings are followed by a layer norm.
+    return _get(cfg, "vocab_size") * hidden + 2 * hidden + n_layer * layer + 2 * hidden
+
+
+def _count_llama(cfg):
+    """LLaMA-style decoders with grouped-query attention, gated MLP and RMSNorm."""
+    hidden = _get(cfg, "hidden_size")
+    inter = _get(cfg, "intermediate_size")
+    n_layer = _get(cfg, "num_hidden_layers")
+    n_head = _get(cfg, "num_attention_heads")
+    n_kv_head = _get(cfg, "num_key_value_heads", default=n_head)
+    head_dim = _get(cfg, "head_dim", default=hidden // n_head)
+    attn_bias = _get(cfg, "attention_bias", default=False)
+    mlp_bias = _get(cfg, "mlp_bias", default=False)
+
+    layer = (
+        _linear(hidden, n_head * head_dim, attn_bias)
+        + 2 * _linear(hidden, n_kv_head * head_dim, attn_bias)
+        + _linear(n_head * head_dim, hidden, attn_bias)
+        + 2 * _linear(hidden, inter, mlp_bias)
+        + _linear(inter, hidden, mlp_bias)
+        + 2 * hidden
+    )
+    return _get(cfg, "vocab_size") * hidden + n_layer * layer + hidden
+
+
+PARAM_COUNTERS = {
+    "bert": _count_bert,
+    "roberta": _count_bert,
+    "xlm-roberta": _count_bert,
+    "camembert": _count_bert,
+    "gpt2": _count_gpt2,
+    "gptj": _count_gptj,
+    "gpt_neox": _count_gpt_neox,
+    "t5": _count_t5,
+    "mt5": _count_t5,
+    "opt": _count_opt,
+    "bloom": _count_bloom,
+    "llama": _count_llama,
+    "mistral": _count_llama,
+}
+
+
+def count_parameters(cfg):
+    """Count the parameters of the base model of the config without building it.
+    Return None if the model type (or a variant of it) is not supported.
+    """
+    auto_map = _get(cfg, "auto_map", default={})
+    if "AutoModel" in auto_map:
+        # The model implementation is in the model repo.
+        return None
+
+    counter = PARAM_COUNTERS.get(_get(cfg, "model_type", default=None))
+    if counter is None:
+        return None
+    try:
+        return counter(cfg)
+    except KeyError:
+        # Missing required fields.
+        return None
+
+
+# Config fields that do not affect the number of parameters, such as metadata, token IDs,
+# labels of task heads (not in the base model), generation and training hyper-parameters.
+SIZE_IRRELEVANT_FIELDS = {
+    "_name_or_path",
+    "_commit_hash",
+    "name_or_path",
+    "architectures",
+    "transformers_version",
+    "torch_dtype",
+    "dtype",
+    "id2label",
+    "label2id",
+    "num_labels",
+    "finetuning_task",
+    "problem_type",
+    "task_specific_params",
+    "tokenizer_class",
+    "prefix",
+    "use_cache",
+    "output_attentions",
+    "output_hidden_states",
+    "output_scores",
+    "return_dict",
+    "return_dict_in_generate",
+    "torchscript",
+    "gradient_checkpointing",
+    "initializer_range",
+    "initializer_factor",
+    "max_length",
+    "min_length",
+    "do_sample",
+    "early_stopping",
+    "num_beams",
+    "num_beam_groups",
+    "num_return_sequences",
+    "temperature",
+    "top_k",
+    "top_p",
+    "typical_p",
+    "repetition_penalty",
+    "length_penalty",
+    "no_repeat_ngram_size",
+    "encoder_no_repeat_ngram_size",
+    "bad_words_ids",
+    "diversity_penalty",
+    "remove_invalid_values",
+    "exponential_decay_length_penalty",
+    "suppress_tokens",
+    "begin_suppress_tokens",
+}
+
+
+def _is_size_relevant(name):
+    if name in SIZE_IRRELEVANT_FIELDS or name.startswith("_attn_implementation"):
+        return False
+    return not (name.endswith("token_id") or name.endswith("token_ids") or "dropout" in name)
+
+
+def config_hash(cfg):
+    """The canonical hash of the size-relevant fields of a config, so that models with the
+    same hash (e.g., fine-tunes of a base model) have the same number of parameters.
+    The config can be a transformers config object or a dict.
+    """
+    cfg_dict = cfg if isinstance(cfg, dict) else cfg.to_dict()
+    fields = {k: v for k, v in cfg_dict.items() if _is_size_relevant(k)}
+    data = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
@@ -0,0 +1,145 @@
+"""Phase timers and counters of the CLI.
+
+Instrumentation is disabled by default, where phase() returns a shared no-op context
+manager and count() returns right away, so instrumented code paths cost a function call.
+Once enabled, the total time and the number of calls of each phase and the value of each
+counter are collected in this process, with optional cProfile and tracemalloc capture.
+Phases may be nested, and the time of a phase includes its nested phases. Note that the
+work in worker processes (e.g., update_size_db --workers) is not collected.
+"""
+from contextlib import nullcontext
+import json
+import sys
+import time
+
+# The number of top functions and allocation sites in the summary.
+SUMMARY_TOP_N = 20
+
+_metrics = None
+_NULL_PHASE = nullcontext()
+
+
+class Metrics:
+    def __init__(self, cpu_profile=None, trace_memory=False):
+        # Phase name -> [calls, seconds].
+        self.phases = {}
+        self.counters = {}
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+
+        self.cpu_profile = cpu_profile
+        self.profiler = None
+        if cpu_profile is not None:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.trace_memory = trace_memory
+        if trace_memory:
+            import tracemalloc
+
+            tracemalloc.start()
+
+
+class _Phase:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stat = _metrics.phases.setdefault(self.name, [0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        return False
+
+
+def enable(cpu_profile=None, trace_memory=False):
+    """Start collecting metrics. `cpu_profile` is the file to dump cProfile stats to."""
+    global _metrics
+    _metrics = Metrics(cpu_profile, trace_memory)
+
+
+def enabled():
+    return _metrics is not None
+
+
+def phase(name):
+    """A context manager that adds the time of the block to the phase."""
+    if _metrics is None:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def count(name, value=1):
+    """Add the value to the counter."""
+    if _metrics is None:
+        return
+    _metrics.counters[name] = _metrics.counters.get(name, 0) + value
+
+
+def report(mode, metrics_out=None, print_summary=True):
+    """Stop collecting metrics, print the summary, and append the metrics to the JSON-lines
+    file `metrics_out` with one line per phase and counter and a line of the run."""
+    global _metrics
+    metrics, _metrics = _metrics, None
+    if metrics is None:
+        return
+
+    run = {"type": "run", "mode": mode, "started_at": metrics.started_at}
+    run["seconds"] = time.perf_counter() - metrics.start
+    try:
+        import resource
+
+        # ru_maxrss is in KB on Linux.
+        run["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+
+    stats = None
+    if metrics.profiler is not None:
+        import pstats
+
+        metrics.profiler.disable()
+        metrics.profiler.dump_stats(metrics.cpu_profile)
+        stats = pstats.Stats(metrics.profiler, stream=sys.stdout)
+
+    top_allocs = []
+    if metrics.trace_memory:
+        import tracemalloc
+
+        run["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        top_allocs = tracemalloc.take_snapshot().statistics("lineno")[:SUMMARY_TOP_N]
+        tracemalloc.stop()
+
+    lines = [run]
+    for name, (calls, seconds) in metrics.phases.items():
+        lines.append({"type": "phase", "mode": mode, "name": name, "calls": calls})
+        lines[-1]["seconds"] = seconds
+    for name, value in metrics.counters.items():
+        lines.append({"type": "counter", "mode": mode, "name": name, "value": value})
+
+    if metrics_out is not None:
+        with open(metrics_out, "a") as filep:
+            for line in lines:
+                filep.write(json.dumps(line) + "\n")
+
+    if print_summary:
+        print(f"Profile of {mode}: {run['seconds']:.3f}s", flush=True)
+        for key in ("peak_rss_mb", "peak_traced_mb"):
+            if key in run:
+                print(f"  {key}: {run[key]:.1f}", flush=True)
+        for name, (calls, seconds) in sorted(metrics.phases.items(), key=lambda kv: -kv[1][1]):
+            print(f"  {name}: {seconds:.3f}s in {calls} calls", flush=True)
+        for name, value in sorted(metrics.counters.items()):
+            print(f"  {name}: {value}", flush=True)
+        for stat in top_allocs:
+            print(f"  {stat}", flush=True)
+        if stats is not None:
+            stats.sort_stats("cumulative").print_stats(SUMMARY_TOP_N)
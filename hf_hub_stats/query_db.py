@@ -1,203 +1,395 @@
-"""Query database for useful insights."""
-from .download_db import DownloadTrendDB
-from .size_db import SizeDB, get_model_size_in_b_with_empty_weights
-from .utils import draw_rank_chart, draw_trend_chart, print_model_in_md
-
-
-def query_top_models(args, print_markdown=False):
+"""Query database for useful insights.
+
+The numpy-based query engine and rank index are imported by the queries that use them, so
+that query_size does not import numpy.
+"""
+import datetime
+import os
+
+from .download_db import DATE_FORMAT, ModelNDownload, open_download_db
+from .size_db import LookaheadResolver, get_model_size_in_b_with_empty_weights, open_size_db
+from .utils import (
+    draw_rank_chart,
+    draw_trend_chart,
+    print_growth_in_md,
+    print_model_in_md,
+    print_size_stats_in_md,
+    render_charts,
+)
+
+
+def query_top_models(args, print_markdown=False, size_db=None, download_db=None, snapshots=None):
+    """Query top downloaded models in the size range. The databases are opened from the paths
+    in `args` unless given, and `snapshots` caches the snapshot of each date across queries
+    (e.g., in the query server)."""
     # Load database.
-    size_db = SizeDB(args.size_db)
-    download_db = DownloadTrendDB(args.download_db)
-
-    # Take the latest download counts and sort.
-    all_models = sorted(
-        download_db.latest() if args.date is None else download_db[args.date],
-        key=lambda x: x.download,
-        reverse=True,
-    )
-
-    # Whether to skip size checking.
-    skip_size = args.min_size == 0 and args.max_size == float("inf")
+    if size_db is None:
+        size_db = open_size_db(args.size_db, pretty=args.pretty)
+    if download_db is None:
+        download_db = open_download_db(args.download_db)
+
+    config_store = None
+    if getattr(args, "config_store", None) is not None:
+        from .config_store import ConfigStore
+
+        config_store = ConfigStore(args.config_store)
+
+    # Estimate the sizes of the next cache misses in the rank order in the background.
+    resolver = None
+    lookahead = getattr(args, "lookahead", 0)
+    if lookahead > 0 and (args.min_size != 0 or args.max_size != float("inf")):
+        resolver = LookaheadResolver(lookahead, config_store=config_store)
+
+    # The cache misses in the rank order, whose configs are fetched in batches as they are
+    # resolved, since the misses after the limit are never resolved.
+    hinted = []
+    hinted_pos = {}
+
+    def prefetch(model_ids):
+        hinted[:] = model_ids
+        hinted_pos.clear()
+        hinted_pos.update((model_id, pos) for pos, model_id in enumerate(model_ids))
+        if resolver is not None:
+            resolver.prefetch(model_ids)
+
+    def resolve(model_id):
+        if config_store is not None and model_id not in config_store:
+            from .config_store import prefetch_configs
+
+            pos = hinted_pos.get(model_id)
+            batch = [model_id] if pos is None else hinted[pos : pos + args.fetch_concurrency]
+            prefetch_configs(batch, config_store, args.fetch_concurrency, args.fetch_rate)
+        results = query_model_size(
+            [model_id], size_db, config_store=config_store, estimate=resolver
+        )
+        return results[0]
 
     # Take top models in the given size range.
+    kwargs = dict(
+        start=args.start,
+        end=args.end,
+        limit=args.limit,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        include_unsupported=args.include_unsupported,
+        prefetch=None if resolver is None and config_store is None else prefetch,
+    )
+    try:
+        if _in_same_sqlite_file(download_db, size_db):
+            # Rank and filter by sizes with a join in SQLite.
+            date = download_db.dates(sort=True)[-1] if args.date is None else args.date
+            selected = download_db.select_top(date, resolve, **kwargs)
+        else:
+            # Take the latest download counts as arrays.
+            snapshot = get_snapshot(download_db, args.date, snapshots)
+            selected = [
+                (snapshot.model_id(pos), int(snapshot.downloads[pos]), result)
+                for pos, result in snapshot.select_top(size_db.lookup, resolve, **kwargs)
+            ]
+    finally:
+        if resolver is not None:
+            # Keep the speculative results of models after the limit for later queries.
+            for result in resolver.close():
+                if size_db.lookup(result.model_id) is None:
+                    size_db[result.model_id] = result
+
     models = []
     list_extra = 0
-    start, end = args.start, min(args.end, len(all_models))
-    for model in all_models[start:end]:
-        model_id = model.model_id
-        if skip_size:
-            model.size = 0
-        else:
-            if model_id in size_db:
-                result = size_db[model_id]
-            else:
-                result = get_model_size_in_b_with_empty_weights(model_id, fallback=True)
-
-            if result.code != 0:
-                if args.include_unsupported:
-                    # Still include unsupported models.
-                    list_extra += 1
-                else:
-                    continue
-            elif result.size < args.min_size:
-                # Ignore small models.
-                continue
-            elif result.size > args.max_size:
-                # Ignore large models.
-                continue
-
-            model.size = result.size
+    for model_id, download, result in selected:
+        model = ModelNDownload(model_id, download, 0 if result is None else result.size)
+        if result is not None and not result.valid:
+            # Still include unsupported models.
+            list_extra += 1
         models.append(model)
         print(
-            f"Appended {model_id}: {model.size}B params, now {len(models)} models,",
+            f"Appended {model.model_id}: {model.size}B params, now {len(models)} models,",
             f"target {args.limit + list_extra} models",
             flush=True,
         )
 
-        # Stop when we have collected the target number of top models.
-        if len(models) == args.limit + list_extra:
-            break
+    # Persist the new results and the failures for the negative cache.
+    size_db.persist()
 
     if print_markdown:
         print_model_in_md(models)
     return models
 
 
-def query_model_size(model_ids, size_db, print_result=False):
+def _in_same_sqlite_file(download_db, size_db):
+    download_file = getattr(download_db, "conn", None) and download_db.file_name
+    size_file = getattr(size_db, "conn", None) and size_db.file_name
+    return bool(download_file and size_file) and os.path.samefile(download_file, size_file)
+
+
+def query_model_size(model_ids, size_db, print_result=False, config_store=None, estimate=None):
+    """Query the sizes of models, and estimate the ones missing in the size DB with
+    `estimate(model_id)` (default with empty weights). New results are written back to the
+    size DB, including failures so that later queries skip the models until retry."""
     results = []
     for model_id in model_ids:
-        if model_id in size_db:
-            results.append(size_db[model_id])
-        else:
-            results.append(get_model_size_in_b_with_empty_weights(model_id, fallback=True))
+        result = size_db.lookup(model_id)
+        if result is None:
+            if estimate is None:
+                result = get_model_size_in_b_with_empty_weights(
+                    model_id, fallback=True, config_store=config_store
+                )
+            else:
+                result = estimate(model_id)
+            size_db[model_id] = result
+        results.append(result)
 
         if print_result:
             print(results[-1])
     return results
 
 
-def query_model_download(model_ids, date, download_db, print_result=False):
-    model_id_set = set(model_ids)
-    data = download_db.latest() if date is None else download_db[date]
+def query_model_download(model_ids, date, download_db, print_result=False, snapshots=None):
+    if hasattr(download_db, "find"):
+        # Point lookups with the index of the SQLite DB.
+        date = download_db.dates(sort=True)[-1] if date is None else date
+        records = download_db.find(date, model_ids)
+    else:
+        snapshot = get_snapshot(download_db, date, snapshots)
+        records = [
+            ModelNDownload(snapshot.model_id(pos), int(snapshot.downloads[pos]))
+            for pos in snapshot.find(model_ids).tolist()
+        ]
 
     results = []
-    for model_n_download in data:
-        model_id = model_n_download.model_id
-        if model_id in model_id_set:
-            results.append(model_n_download)
-            if print_result:
-                print(model_n_download)
+    for model_n_download in records:
+        results.append(model_n_download)
+        if print_result:
+            print(model_n_download)
     return results
 
 
-def draw_download_trend(args):
-    import pandas as pd
+def get_snapshot(download_db, date=None, snapshots=None):
+    """The snapshot of the date (default latest), which is cached in the dict `snapshots` if
+    given. The cache has to be cleared when the download DB changes."""
+    from .query_engine import Snapshot
 
-    def size_in_range(size_db, model_id, min_size, max_size):
-        result = query_model_size([model_id], size_db)[0]
-        return result.code == 0 and result.size >= min_size and result.size <= max_size
+    if snapshots is None:
+        return Snapshot.from_download_db(download_db, date)
+    date = download_db.dates(sort=True)[-1] if date is None else date
+    if date not in snapshots:
+        snapshots[date] = Snapshot.from_download_db(download_db, date)
+    return snapshots[date]
 
-    # Load database.
-    size_db = SizeDB(args.size_db)
-    download_db = DownloadTrendDB(args.download_db)
 
-    # Whether to skip size checking.
-    skip_size = args.min_size == 0 and args.max_size == float("inf")
+def query_growth(args, print_markdown=False):
+    """Rank models by the change of downloads against the date `args.window` days before,
+    at `args.date` (default latest) or at their best date in the whole history."""
+    import numpy as np
 
-    dates = download_db.dates(sort=True)
+    from .query_engine import download_matrix, period_over_period
 
-    # Get top models in the latest download counts.
-    all_models = sorted(download_db[dates[-1]], key=lambda x: x.download, reverse=True)
-    if skip_size:
-        target_models = all_models[: args.limit]
+    download_db = open_download_db(args.download_db)
+    dates = download_db.dates(sort=True)
+    matrix, model_ids = download_matrix(download_db, dates)
+    ordinals = [datetime.datetime.strptime(d, DATE_FORMAT).toordinal() for d in dates]
+    prev_rows, change, growth = period_over_period(matrix, ordinals, args.window)
+
+    # Rank by the absolute change or the growth ratio of models with enough downloads.
+    score = change if args.by == "change" else growth
+    prev = np.where(prev_rows[:, None] >= 0, matrix[np.maximum(prev_rows, 0)], -1)
+    score = np.where(prev >= args.min_downloads, score, np.nan)
+
+    if args.all_dates:
+        # The best date of each model in the whole history.
+        valid = ~np.isnan(score).all(axis=0)
+        cols = np.nonzero(valid)[0]
+        rows = np.nanargmax(score[:, cols], axis=0)
     else:
-        target_models = []
-        for model in all_models:
-            if not size_in_range(size_db, model.model_id, args.min_size, args.max_size):
-                continue
+        row = len(dates) - 1 if args.date is None else dates.index(args.date)
+        cols = np.nonzero(~np.isnan(score[row]))[0]
+        rows = np.full(len(cols), row, dtype=np.int64)
+
+    # Sort by scores in descending order, and break ties by model IDs.
+    names = np.array([model_ids[col] for col in cols.tolist()], dtype=object)
+    order = np.lexsort((names, -score[rows, cols]))[: args.limit]
+    movers = [
+        (
+            model_ids[col],
+            dates[row],
+            int(matrix[row, col]),
+            int(prev[row, col]),
+            int(change[row, col]),
+            float(growth[row, col]),
+        )
+        for row, col in zip(rows[order].tolist(), cols[order].tolist())
+    ]
+
+    if print_markdown:
+        print_growth_in_md(movers)
+    return movers
 
-            target_models.append(model)
-            if len(target_models) == args.limit:
-                break
-    target_models = [m.model_id for m in target_models]
 
-    # Take top models in the given size range.
-    data = {}
+def draw_download_trend(args):
+    import numpy as np
+    import pandas as pd
+
+    from .rank_index import open_rank_index
+
+    # Load database.
+    size_db = open_size_db(args.size_db, pretty=args.pretty)
+    download_db = open_download_db(args.download_db)
+
+    # The size ranges of charts. Each range is rendered to its own file in the batch mode.
+    batch = bool(args.size_ranges)
+    size_ranges = [(args.min_size, args.max_size)]
+    if batch:
+        size_ranges = [parse_size_range(size_range) for size_range in args.size_ranges]
+
+    dates = download_db.dates(sort=True)
     start_date = 0
     if args.max_history > 0 and args.max_history < len(dates):
         start_date = len(dates) - args.max_history
-    for date in dates[start_date:]:
-        data[date] = []
-
-        # Find the rank of the target models.
-        model_to_rank = {}
-        sorted_model_n_download = sorted(download_db[date], key=lambda x: x.download, reverse=True)
-
-        rank = 1
-        for model_n_download in sorted_model_n_download:
-            model_id = model_n_download.model_id
-            if not (skip_size or size_in_range(size_db, model_id, args.min_size, args.max_size)):
-                continue
-            model_to_rank[model_id] = rank
-            rank += 1
-
-        for model in target_models:
-            if model in model_to_rank:
-                data[date].append(model_to_rank[model])
-            else:
-                data[date].append(float("inf"))
 
-    draw_rank_chart(
-        pd.DataFrame.from_dict(data, orient="index", columns=target_models),
-        file_name=args.output,
+    # Sorted models of each date are read from the rank index, which only sorts new dates.
+    rank_index = open_rank_index(download_db, args.download_db)
+    rank_index.build(dates[start_date:])
+
+    # The sizes of models in the index, where -1 means unknown. Each model is checked only
+    # once for all size ranges, and size checking is skipped if no range needs it.
+    sizes = None
+    if any(rng != (0, float("inf")) for rng in size_ranges):
+        sizes = np.full(len(rank_index.model_ids), -1, dtype=np.float64)
+        orders = [rank_index.order(date) for date in dates[start_date:]]
+        for idx in np.unique(np.concatenate(orders)).tolist():
+            result = query_model_size([rank_index.model_ids[idx]], size_db)[0]
+            if result.valid:
+                sizes[idx] = result.size
+
+    # Persist the new results and the failures for the negative cache.
+    size_db.persist()
+
+    charts = []
+    for min_size, max_size in size_ranges:
+        # Whether each model in the index is in the size range.
+        mask = None
+        if (min_size, max_size) != (0, float("inf")):
+            mask = (sizes >= 0) & (sizes >= min_size) & (sizes <= max_size)
+
+        # Get top models in the latest download counts.
+        latest_order = rank_index.order(dates[-1])
+        if mask is not None:
+            latest_order = latest_order[mask[latest_order]]
+        target_indices = np.array(latest_order[: args.limit])
+        target_models = [rank_index.model_ids[idx] for idx in target_indices.tolist()]
+
+        # Take the ranks of the target models in the given size range.
+        data = {}
+        for date in dates[start_date:]:
+            ranks = rank_index.ranks(date, mask)[target_indices]
+            data[date] = [rank if rank > 0 else float("inf") for rank in ranks.tolist()]
+        df = pd.DataFrame.from_dict(data, orient="index", columns=target_models)
+
+        file_name = args.output
+        if batch:
+            root, ext = os.path.splitext(args.output or "trend.pdf")
+            file_name = f"{root}-{min_size:g}-{max_size:g}B{ext}"
+        charts.append((df, file_name))
+
+    kwargs = dict(
         ylim=args.limit,
         line_args={"linewidth": 2, "alpha": 0.5},
         scatter_args={"s": 70, "alpha": 0.8},
     )
+    if args.output is None and not batch:
+        # Show the chart interactively.
+        draw_rank_chart(charts[0][0], file_name=None, **kwargs)
+        return
+    render_charts(draw_rank_chart, charts, workers=args.workers, force=args.force, **kwargs)
 
 
-def draw_size_trend(args):
-    import pandas as pd
+def parse_size_range(size_range):
+    """Parse a size range in billions in the format of "min:max", where both are optional."""
+    min_size, _, max_size = size_range.partition(":")
+    return float(min_size or 0), float(max_size or "inf")
+
+
+def query_size_stats(args, print_markdown=False):
+    """The size statistics of the top `args.limit` downloaded models in the size range of
+    each date, which are computed for the dates missing in the stats cache.
+
+    Return a dict from dates in chronological order to stats, skipping dates without models
+    in the size range.
+    """
+    from .size_stats import SizeJoin, open_size_stats, size_stats, top_in_range
 
     # Load database.
-    size_db = SizeDB(args.size_db)
-    download_db = DownloadTrendDB(args.download_db)
+    size_db = open_size_db(args.size_db, pretty=args.pretty)
+    download_db = open_download_db(args.download_db)
 
     dates = download_db.dates(sort=True)
     start_date = 0
     if args.max_history > 0 and args.max_history < len(dates):
         start_date = len(dates) - args.max_history
 
+    cache = open_size_stats(args.download_db)
+    if args.refresh:
+        cache.clear()
+    key = cache.key(args.limit, args.min_size, args.max_size, args.percentiles)
+
+    def resolve(model_id):
+        return query_model_size([model_id], size_db)[0]
+
     data = {}
+    join = None
+    n_computed = 0
     for date in dates[start_date:]:
-        # Get top models in the this date.
-        all_models = sorted(download_db[date], key=lambda x: x.download, reverse=True)
-        sizes = []
-        for model in all_models:
-            model_size = query_model_size([model.model_id], size_db)[0]
-            if (
-                model_size.code != 0
-                or model_size.size < args.min_size
-                or model_size.size > args.max_size
-            ):
-                continue
-
-            sizes.append(model_size.size)
-            if len(sizes) == args.limit:
-                break
-
-        # Calculate the model size statistics.
-        data[date] = (max(sizes), sum(sizes) / len(sizes), min(sizes))
+        try:
+            stats = cache.get(key, date)
+        except KeyError:
+            if join is None:
+                join = SizeJoin(size_db)
+            snapshot = get_snapshot(download_db, date)
+            sizes, downloads = top_in_range(
+                join,
+                join.slots(snapshot.model_ids)[snapshot.model_indices],
+                snapshot.downloads,
+                resolve,
+                limit=args.limit,
+                min_size=args.min_size,
+                max_size=args.max_size,
+            )
+            stats = size_stats(sizes, downloads, args.percentiles)
+            cache.put(key, date, stats)
+            n_computed += 1
+        if stats is not None:
+            data[date] = stats
+    print(f"Computed size stats of {n_computed} of {len(dates) - start_date} dates", flush=True)
+
+    # Persist the new results and the failures for the negative cache.
+    size_db.persist()
+    cache.persist()
+
+    if print_markdown:
+        print_size_stats_in_md(data)
+    return data
+
+
+def draw_size_trend(args):
+    import pandas as pd
+
+    data = {
+        date: (stats["max"], stats["mean"], stats["weighted_mean"], stats["min"])
+        for date, stats in query_size_stats(args).items()
+    }
 
     # Determine the display unit (B or M).
     unit = "B"
     if all([stat[1] <= 1 for stat in data.values()]):
         unit = "M"
         for date in data:
-            data[date] = (val * 1e3 for val in data[date])
+            data[date] = tuple(val * 1e3 for val in data[date])
 
     draw_trend_chart(
-        pd.DataFrame.from_dict(data, orient="index", columns=["max-size", "avg-size", "min-size"]),
+        pd.DataFrame.from_dict(
+            data,
+            orient="index",
+            columns=["max-size", "avg-size", "weighted-avg-size", "min-size"],
+        ),
         file_name=args.output,
         ylabel=f"Model Size ({unit})",
         line_args={"linewidth": 2, "alpha": 0.5},
@@ -0,0 +1,187 @@
+"""Vectorized queries of a download snapshot (the records of one date in the download DB)."""
+import numpy as np
+
+# The initial number of top models to sort when the number of models to scan is unknown,
+# e.g., with size filters. It is doubled until enough models are found.
+TOP_K_WINDOW = 1024
+
+
+class Snapshot:
+    """The records of a date as aligned arrays of model indices (into the model table
+    model_ids) and downloads, in the same order as the records in the download DB."""
+
+    def __init__(self, model_ids, model_indices, downloads, model_index=None):
+        self.model_ids = model_ids
+        self.model_indices = model_indices
+        self.downloads = downloads
+        if model_index is None:
+            model_index = {model_id: idx for idx, model_id in enumerate(model_ids)}
+        self.model_index = model_index
+
+    @staticmethod
+    def from_download_db(download_db, date=None):
+        date = download_db.dates(sort=True)[-1] if date is None else date
+        if hasattr(download_db, "get_columns"):
+            # Columnar DB: use the (memory-mapped) columns directly.
+            model_indices, downloads = download_db.get_columns(date)
+            return Snapshot(
+                download_db.model_ids, model_indices, downloads, download_db.model_index
+            )
+
+        records = download_db[date]
+        model_ids = []
+        model_index = {}
+        model_indices = np.empty(len(records), dtype=np.int64)
+        for pos, record in enumerate(records):
+            if record.model_id not in model_index:
+                model_index[record.model_id] = len(model_ids)
+                model_ids.append(record.model_id)
+            model_indices[pos] = model_index[record.model_id]
+        downloads = np.array([record.download for record in records], dtype=np.int64)
+        return Snapshot(model_ids, model_indices, downloads, model_index)
+
+    def __len__(self):
+        return len(self.downloads)
+
+    def model_id(self, pos):
+        return self.model_ids[self.model_indices[pos]]
+
+    def find(self, model_ids):
+        """The positions of records of the given model IDs, in the record order."""
+        wanted = [self.model_index[m] for m in model_ids if m in self.model_index]
+        return np.nonzero(np.isin(self.model_indices, wanted))[0]
+
+    def sorted_positions(self, k):
+        """The positions of the top-k records sorted by downloads in descending order.
+        Ties are in the record order, which is the same as a stable sort."""
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Unique keys to break ties by positions.
+        keys = -np.asarray(self.downloads, dtype=np.int64) * len(self) + np.arange(len(self))
+        if k < len(self):
+            top = np.argpartition(keys, k - 1)[:k]
+            return top[np.argsort(keys[top])]
+        return np.argsort(keys)
+
+    def select_top(
+        self,
+        lookup,
+        resolve,
+        start=0,
+        end=float("inf"),
+        limit=20,
+        min_size=0,
+        max_size=float("inf"),
+        include_unsupported=False,
+        prefetch=None,
+    ):
+        """Select top downloaded models in the size range, which is the same as walking
+        records in [start, end) of the sorted order until `limit` models in the size range
+        are collected. `lookup(model_id)` returns the cached size result or None, and
+        `resolve(model_id)` estimates the size of a model that misses the cache. Models are
+        resolved in the rank order and only until the limit is met. `prefetch(model_ids)`
+        is called with the cache misses in the rank order before they are resolved.
+
+        Return a list of (position, size result or None if sizes are not checked).
+        """
+        end = min(end, len(self))
+        if min_size == 0 and max_size == float("inf"):
+            # Note that a limit of 0 means no limit.
+            stop = end if limit <= 0 else min(end, start + limit)
+            return [(pos, None) for pos in self.sorted_positions(stop)[start:].tolist()]
+
+        resolved = {}
+        k = min(end, start + max(TOP_K_WINDOW, 4 * limit))
+        while True:
+            order = self.sorted_positions(k)[start:]
+            results = []
+            for pos in order.tolist():
+                model_id = self.model_id(pos)
+                results.append(resolved[model_id] if model_id in resolved else lookup(model_id))
+
+            known = np.array([r is not None for r in results], dtype=bool)
+            valid = np.array([r is not None and r.valid for r in results], dtype=bool)
+            sizes = np.array([r.size if r is not None else 0 for r in results], dtype=np.float64)
+            in_range = valid & (sizes >= min_size) & (sizes <= max_size)
+
+            # Resolve cache misses in the rank order until the limit is met.
+            n_before = np.cumsum(in_range) - in_range
+            n_resolved_in_range = 0
+            missing = np.nonzero(~known)[0].tolist()
+            if prefetch is not None and missing:
+                prefetch(list(dict.fromkeys(self.model_id(order[idx]) for idx in missing)))
+            for idx in missing:
+                if limit > 0 and n_before[idx] + n_resolved_in_range >= limit:
+                    break
+                model_id = self.model_id(order[idx])
+                result = resolve(model_id)
+                resolved[model_id] = results[idx] = result
+                known[idx] = True
+                valid[idx] = result.valid
+                in_range[idx] = result.valid and min_size <= result.size <= max_size
+                n_resolved_in_range += int(in_range[idx])
+
+            kept = in_range | (known & ~valid & include_unsupported)
+            in_range_idx = np.nonzero(in_range)[0]
+            if limit > 0 and len(in_range_idx) >= limit:
+                kept[in_range_idx[limit - 1] + 1 :] = False
+            elif k < end:
+                # Not enough models in the window.
+                k = min(end, 2 * k)
+                continue
+            order = order.tolist()
+            return [(order[idx], results[idx]) for idx in np.nonzero(kept)[0].tolist()]
+
+
+def download_matrix(download_db, dates=None):
+    """The (date, model) matrix of downloads of the dates (default all in chronological
+    order) and the model table of its columns. Models absent at a date are -1."""
+    dates = download_db.dates(sort=True) if dates is None else dates
+    if hasattr(download_db, "matrix"):
+        # Delta DB: the whole history is decoded in one pass.
+        return download_db.matrix(dates), download_db.model_ids
+
+    columns = []
+    model_ids = []
+    model_index = {}
+    for date in dates:
+        if hasattr(download_db, "get_columns"):
+            model_indices, downloads = download_db.get_columns(date)
+            model_ids, model_index = download_db.model_ids, download_db.model_index
+        else:
+            records = download_db[date]
+            for record in records:
+                if record.model_id not in model_index:
+                    model_index[record.model_id] = len(model_ids)
+                    model_ids.append(record.model_id)
+            model_indices = np.array([model_index[r.model_id] for r in records], dtype=np.int64)
+            downloads = np.array([r.download for r in records], dtype=np.int64)
+        columns.append((model_indices, downloads))
+
+    matrix = np.full((len(dates), len(model_ids)), -1, dtype=np.int64)
+    for row, (model_indices, downloads) in enumerate(columns):
+        matrix[row, model_indices] = downloads
+    return matrix, model_ids
+
+
+def period_over_period(matrix, ordinals, window=7):
+    """Compare each date with the latest date at least `window` days before it.
+
+    `ordinals` are the day numbers of the rows of the download matrix. Return the row of
+    the previous date of each row (-1 if none), and the (date, model) matrices of download
+    changes and growth ratios, which are NaN unless the model is present at both dates.
+    """
+    ordinals = np.asarray(ordinals, dtype=np.int64)
+    prev_rows = np.searchsorted(ordinals, ordinals - window, side="right") - 1
+
+    prev = np.full(matrix.shape, -1, dtype=np.int64)
+    has_prev = prev_rows >= 0
+    prev[has_prev] = matrix[prev_rows[has_prev]]
+    comparable = (matrix >= 0) & (prev >= 0)
+
+    change = np.where(comparable, matrix - prev, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(comparable & (prev > 0), change / prev, np.nan)
+    return prev_rows, change, growth
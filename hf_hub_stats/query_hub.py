@@ -1,47 +1,66 @@
 """Query Hugging Face hub."""
-import datetime
+from collections import namedtuple
+import heapq
 
-import os
-import pickle
+from . import profiling
+from .model_list_cache import ModelListCache
 
-from huggingface_hub import HfApi, ModelFilter
+# The compact record of a model. The field names are the same as ModelInfo
+# so that callers can use both.
+ModelRecord = namedtuple("ModelRecord", ["modelId", "downloads"])
 
+# The filters of listing models.
+MODEL_FILTERS = {"library": "pytorch"}
 
-def query_hf_hub(cache_expire=7):
-    """Query Huggingface Hub with filter."""
-    cache_folder = os.path.join(os.path.expanduser("~"), ".cache/query_hf_hub/")
-    cache_file = os.path.join(cache_folder, "all_models.pkl")
 
-    # Directly use local cached model list if available and
-    # not expired (7 days).
-    if os.path.exists(cache_file):
-        today = datetime.datetime.today()
-        modified_date = datetime.datetime.fromtimestamp(os.path.getmtime(cache_file))
-        duration = today - modified_date
-        if duration.days <= cache_expire:
-            print(f"Using cached model list (queried in {duration.days} days)", flush=True)
-            with open(cache_file, "rb") as filep:
-                return pickle.load(filep)
-        else:
-            print(f"Updating cached model list (queried in {duration.days} days)", flush=True)
-    else:
-        print(f"Querying model list", flush=True)
-        os.makedirs(cache_folder, exist_ok=True)
+def query_hf_hub(cache_expire=7, stream=False, top_k=None, cache_dir=None):
+    """Query Huggingface Hub with filter. The model list is cached in cache_dir for
+    cache_expire days. In the streaming mode, only the top_k (or all if None) models are kept.
+    """
+    # Directly use local cached model list if available and not expired.
+    cache = ModelListCache(cache_dir)
+    cached = cache.load(MODEL_FILTERS, cache_expire, top_k if stream else None)
+    if cached is not None:
+        profiling.count("model_list_cache.hit")
+        return [ModelRecord(*m) for m in zip(*cached)]
+    profiling.count("model_list_cache.miss")
+
+    from huggingface_hub import HfApi, ModelFilter
 
     api = HfApi()
-    custom_filter = ModelFilter(library="pytorch")
+    custom_filter = ModelFilter(**MODEL_FILTERS)
 
     # sort="downloads" doesn't work so we sort by ourselves.
     all_models = api.list_models(filter=custom_filter)
 
-    # Remove the models with downloads=0.
-    all_models = [m for m in all_models if hasattr(m, "downloads")]
+    if stream:
+        # Consume the listing lazily and only keep the compact records of the models
+        # with downloads, so the memory is proportional to top_k instead of the Hub size.
+        records = (
+            ModelRecord(m.modelId, m.downloads)
+            for m in all_models
+            if getattr(m, "downloads", None) is not None
+        )
+
+        # Sort models by downloads. Note that nlargest is equivalent to a stable sort.
+        if top_k is None:
+            all_models = sorted(records, key=lambda m: m.downloads, reverse=True)
+        else:
+            all_models = heapq.nlargest(top_k, records, key=lambda m: m.downloads)
+    else:
+        # Remove the models with downloads=0.
+        all_models = [m for m in all_models if hasattr(m, "downloads")]
 
-    # Sort models by downloads.
-    all_models = sorted(all_models, key=lambda m: m.downloads, reverse=True)
+        # Sort models by downloads.
+        all_models = sorted(all_models, key=lambda m: m.downloads, reverse=True)
+        top_k = None
 
     # Cache results.
-    with open(cache_file, "wb") as filep:
-        pickle.dump(all_models, filep)
+    cache.save(
+        MODEL_FILTERS,
+        [m.modelId for m in all_models],
+        [m.downloads for m in all_models],
+        top_k=top_k,
+    )
 
     return all_models
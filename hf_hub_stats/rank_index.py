@@ -0,0 +1,129 @@
+"""Precomputed download rank index of the download trend database.
+
+The index is a directory next to the download trend DB (``<download_db>.ranks``) with an
+interned model ID table (``models.json``) and one ``<date>.npy`` file per date, which is the
+model indices sorted by downloads in descending order. It is built incrementally, so only
+the dates that are new to the index are sorted. The signature of the records of each date in
+the download DB is kept in ``signatures.json``, and dates whose records have been rewritten
+since they were indexed (e.g., by a second update on the same day) are sorted again.
+"""
+import os
+
+import json
+import numpy as np
+
+MODEL_TABLE_FILE = "models.json"
+SIGNATURE_FILE = "signatures.json"
+
+
+class RankIndex:
+    def __init__(self, download_db, dir_name):
+        self.download_db = download_db
+        self.dir_name = dir_name
+        self.model_ids = []
+        self.model_index = {}
+        self.orders = {}
+        self.dirty_models = False
+
+        # The signatures of the records of indexed dates in the download DB.
+        self.signatures = {}
+
+        model_table = os.path.join(dir_name, MODEL_TABLE_FILE)
+        if os.path.exists(model_table):
+            with open(model_table, "r") as filep:
+                self.model_ids = json.load(filep)
+            self.model_index = {model_id: idx for idx, model_id in enumerate(self.model_ids)}
+            signature_file = os.path.join(dir_name, SIGNATURE_FILE)
+            if os.path.exists(signature_file):
+                with open(signature_file, "r") as filep:
+                    self.signatures = json.load(filep)
+            for file_name in os.listdir(dir_name):
+                if file_name.endswith(".npy"):
+                    # Orders are loaded lazily on the first access.
+                    self.orders[file_name[: -len(".npy")]] = None
+
+    def _date_file(self, date):
+        return os.path.join(self.dir_name, f"{date}.npy")
+
+    def intern(self, model_id):
+        if model_id not in self.model_index:
+            self.model_index[model_id] = len(self.model_ids)
+            self.model_ids.append(model_id)
+            self.dirty_models = True
+        return self.model_index[model_id]
+
+    def add_date(self, date):
+        """(Re)build the index of the date and persist it."""
+        signature = date_signature(self.download_db, date)
+        records = self.download_db[date]
+        model_indices = np.array([self.intern(m.model_id) for m in records], dtype=np.int64)
+        downloads = np.array([m.download for m in records], dtype=np.int64)
+
+        # Use a stable sort so that ties are in the same order as sorted().
+        self.orders[date] = model_indices[np.argsort(-downloads, kind="stable")]
+
+        os.makedirs(self.dir_name, exist_ok=True)
+        with open(self._date_file(date) + ".tmp", "wb") as filep:
+            np.save(filep, self.orders[date])
+        os.replace(self._date_file(date) + ".tmp", self._date_file(date))
+        self.persist_model_table()
+
+        # Record the signature after the order it describes is written.
+        self.signatures[date] = signature
+        signature_file = os.path.join(self.dir_name, SIGNATURE_FILE)
+        with open(signature_file + ".tmp", "w") as filep:
+            json.dump(self.signatures, filep)
+        os.replace(signature_file + ".tmp", signature_file)
+
+    def persist_model_table(self):
+        if self.dirty_models:
+            model_table = os.path.join(self.dir_name, MODEL_TABLE_FILE)
+            with open(model_table + ".tmp", "w") as filep:
+                json.dump(self.model_ids, filep)
+            os.replace(model_table + ".tmp", model_table)
+        self.dirty_models = False
+
+    def build(self, dates=None):
+        """Add the given dates (all dates in the download DB by default) that are not indexed
+        or whose records have changed since they were indexed."""
+        dates = self.download_db.dates(sort=True) if dates is None else dates
+        missing = [date for date in dates if not self._is_fresh(date)]
+        if missing:
+            print(f"Indexing ranks of {len(missing)} dates", flush=True)
+        for date in missing:
+            self.add_date(date)
+
+    def _is_fresh(self, date):
+        if date not in self.orders:
+            return False
+        signature = date_signature(self.download_db, date)
+        return signature is not None and self.signatures.get(date) == signature
+
+    def order(self, date):
+        """The model indices of the date sorted by downloads in descending order."""
+        if self.orders[date] is None:
+            self.orders[date] = np.load(self._date_file(date), mmap_mode="r")
+        return self.orders[date]
+
+    def ranks(self, date, mask=None):
+        """The 1-based rank of each model in the model table on the date, or 0 if absent.
+        If mask (a boolean array over the model table, e.g., models in a size bucket) is
+        given, models are ranked only among the ones in the mask.
+        """
+        order = self.order(date)
+        if mask is not None:
+            order = order[mask[order]]
+        ranks = np.zeros(len(self.model_ids), dtype=np.int64)
+        ranks[order] = np.arange(1, len(order) + 1)
+        return ranks
+
+
+def date_signature(download_db, date):
+    """The signature of the records of the date in the download DB, or None if unknown."""
+    if not hasattr(download_db, "date_signature"):
+        return None
+    return download_db.date_signature(date)
+
+
+def open_rank_index(download_db, download_db_path):
+    return RankIndex(download_db, download_db_path.rstrip("/") + ".ranks")
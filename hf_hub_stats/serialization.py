@@ -0,0 +1,153 @@
+"""JSON serialization of the databases.
+
+orjson is used to parse and write compact JSON if it is installed, and the standard json
+module is used otherwise. Pretty JSON is always written by the standard json module with
+indent=2, so that it is byte-compatible with json.dump(indent=2) for publishing.
+Large files can be parsed incrementally with iter_items, which only keeps one top-level
+value in memory at a time.
+"""
+import re
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The chunk size in bytes of incremental parsing.
+CHUNK_SIZE = 1 << 20
+
+# JSON whitespace between tokens.
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, pretty=False):
+    """Serialize obj to JSON bytes. Pretty JSON is the same as json.dumps(obj, indent=2)."""
+    if pretty:
+        return json.dumps(obj, indent=2).encode()
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def dump_object(filep, items, pretty=False):
+    """Write a JSON object of (key, value) items to a binary file, and return the map from
+    keys to the (start, end) byte offsets of their values in the file. A value can also be
+    raw JSON bytes wrapped by RawJSON, which is written as it is. The output is the same as
+    dumps(dict(items), pretty).
+    """
+    offsets = {}
+    base = filep.tell()
+    filep.write(b"{")
+    first = True
+    for key, val in items:
+        if pretty:
+            filep.write(b"\n  " if first else b",\n  ")
+            filep.write(json.dumps(key).encode() + b": ")
+        else:
+            filep.write(b"" if first else b",")
+            filep.write(dumps(key) + b":")
+        first = False
+        start = filep.tell() - base
+        if isinstance(val, RawJSON):
+            filep.write(val.data)
+        elif pretty:
+            # Nested values are indented by one more level.
+            filep.write(dumps(val, pretty=True).replace(b"\n", b"\n  "))
+        else:
+            filep.write(dumps(val))
+        offsets[key] = (start, filep.tell() - base)
+    filep.write(b"\n}" if pretty and not first else b"}")
+    return offsets
+
+
+class RawJSON:
+    """Serialized JSON bytes to be written as they are by dump_object."""
+
+    def __init__(self, data):
+        self.data = data
+
+
+def iter_items(filep, chunk_size=CHUNK_SIZE):
+    """Incrementally parse the top-level JSON object of a binary file, and yield
+    (key, value, start, end) of each item, where [start, end) is the byte range of the value
+    in the file. The memory is bounded by the largest value instead of the file size.
+    """
+    decoder = json.JSONDecoder()
+    # Latin-1 maps bytes to characters one-to-one, so string offsets are byte offsets.
+    buf = ""
+    base = 0  # The file offset of buf.
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, base, pos, eof
+        # Grow the reads geometrically, so a large value is parsed a few times at most.
+        chunk = filep.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        # Drop the consumed part of the buffer.
+        base += pos
+        buf = buf[pos:] + chunk.decode("latin-1")
+        pos = 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def expect(char):
+        nonlocal pos
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] != char:
+            raise ValueError(f"Expecting '{char}' at byte {base + pos}")
+        pos += 1
+
+    def decode():
+        """Decode the value at pos, and return (value, start, end) in buf."""
+        while True:
+            try:
+                val, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                fill()
+                continue
+            if end == len(buf) and not eof and not isinstance(val, (str, dict, list)):
+                # A number may continue in the next chunk.
+                fill()
+                continue
+            raw = buf[pos:end]
+            if not raw.isascii():
+                # Strings with non-ASCII characters are UTF-8 encoded.
+                val = loads(raw.encode("latin-1"))
+            return val, pos, end
+
+    expect("{")
+    skip_whitespace()
+    if pos < len(buf) and buf[pos] == "}":
+        return
+    while True:
+        skip_whitespace()
+        key, _, pos = decode()
+        expect(":")
+        skip_whitespace()
+        val, start, pos = decode()
+        yield key, val, base + start, base + pos
+
+        skip_whitespace()
+        if pos < len(buf) and buf[pos] == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
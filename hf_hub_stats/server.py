@@ -0,0 +1,383 @@
+"""The query server that keeps the databases in memory, and its thin client.
+
+`serve` loads the model size DB and the download trend DB once and answers query_top,
+query_download and query_size over localhost HTTP with JSON responses:
+
+    POST /query_top       {"size_db", "download_db", "date", "start", "end", "limit",
+                           "min_size", "max_size", "include_unsupported", "lookahead"}
+    POST /query_download  {"download_db", "model_ids", "date"}
+    POST /query_size      {"size_db", "model_ids"}
+    GET  /health
+
+Requests carry the DB paths of the query, and the server only answers queries of the DBs
+it serves. A watcher thread polls the DB files and reloads a DB when it changes. Results
+appended to the journal of the size DB by an update in progress are applied without
+reloading the DB, and the download trend DB only reloads its date index, while the cached
+snapshots of dates are dropped. SQLite DBs are read live and not watched.
+
+The CLI forwards the query subcommands to the server with `--server URL` (or the
+environment variable HF_HUB_STATS_SERVER), and runs them locally if the server is not
+running, does not serve the DBs of the query, or fails to answer it.
+"""
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import http.client
+import os
+import threading
+import urllib.error
+import urllib.request
+
+import json
+
+from .download_db import ModelNDownload
+from .size_db import CalcModelSizeResult
+
+# The seconds to wait for the response of a query, which may estimate model sizes.
+CLIENT_TIMEOUT = 600
+
+# The subcommands answered by the server, and the DBs the server needs for them.
+FORWARDED_MODES = ("query_top", "query_download", "query_size")
+REQUIRED_DBS = {
+    "query_top": ("download_db",),
+    "query_download": ("download_db",),
+    "query_size": ("size_db",),
+}
+
+
+def file_signature(path):
+    """The (path, mtime, size) of the file, or of all files in the directory. Missing files
+    are skipped, so a removed or a created file also changes the signature."""
+    if path is None:
+        return []
+    paths = [path]
+    if os.path.isdir(path):
+        paths = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+    signature = []
+    for file_name in paths:
+        try:
+            stat = os.stat(file_name)
+        except FileNotFoundError:
+            continue
+        signature.append((file_name, stat.st_mtime_ns, stat.st_size))
+    return signature
+
+
+def _same_path(path, served):
+    if path is None or served is None:
+        return path is None and served is None
+    if os.path.exists(path) and os.path.exists(served):
+        return os.path.samefile(path, served)
+    return os.path.abspath(path) == os.path.abspath(served)
+
+
+class QueryServer:
+    """The resident databases and the queries on them. Queries and reloads are serialized
+    with a lock, as queries also write failures to the size DB."""
+
+    def __init__(
+        self,
+        size_db_file=None,
+        download_db_file=None,
+        config_store=None,
+        fetch_concurrency=16,
+        fetch_rate=10,
+        pretty=False,
+    ):
+        self.size_db_file = size_db_file
+        self.download_db_file = download_db_file
+        self.config_store = config_store
+        self.fetch_concurrency = fetch_concurrency
+        self.fetch_rate = fetch_rate
+        self.pretty = pretty
+        self.lock = threading.Lock()
+
+        self.size_db = None
+        self.size_signature = None
+        self.journal_offset = 0
+        self.download_db = None
+        self.download_signature = None
+
+        # The snapshot of each queried date of the download DB.
+        self.snapshots = {}
+
+        with self.lock:
+            if size_db_file is not None:
+                self._load_size_db()
+            if download_db_file is not None:
+                self._load_download_db()
+
+    def _load_size_db(self):
+        from .size_db import open_size_db
+
+        self.size_signature = file_signature(self.size_db_file)
+        self.size_db = open_size_db(self.size_db_file, pretty=self.pretty, recover=False)
+        self.journal_offset = 0
+        self._tail_journal()
+
+    def _tail_journal(self):
+        if hasattr(self.size_db, "conn"):
+            return
+        if not os.path.exists(self.size_db.journal_file):
+            # The update was persisted, or a new update has not started.
+            self.journal_offset = 0
+            return
+        if os.path.getsize(self.size_db.journal_file) < self.journal_offset:
+            # A new journal of the next update.
+            self.journal_offset = 0
+        self.journal_offset = self.size_db.tail_journal(self.journal_offset)
+
+    def _load_download_db(self):
+        from .download_db import open_download_db
+
+        self.download_signature = self._download_db_signature()
+        self.download_db = open_download_db(self.download_db_file)
+        self.snapshots = {}
+
+    def _download_db_signature(self):
+        # Including the segments of append-only updates of the JSON DB.
+        path = self.download_db_file
+        return file_signature(path) + file_signature(f"{path}.segments")
+
+    def reload(self):
+        """Reload the DBs whose files have changed."""
+        with self.lock:
+            if self.size_db is not None and not hasattr(self.size_db, "conn"):
+                if file_signature(self.size_db_file) != self.size_signature:
+                    print(f"Reloading {self.size_db_file}", flush=True)
+                    self._load_size_db()
+                else:
+                    self._tail_journal()
+            if self.download_db is not None and not hasattr(self.download_db, "conn"):
+                if self._download_db_signature() != self.download_signature:
+                    print(f"Reloading {self.download_db_file}", flush=True)
+                    self._load_download_db()
+
+    def _persisted(self):
+        # Queries persist the failures for the negative cache. The file is written by this
+        # server, so it does not have to be reloaded.
+        if not hasattr(self.size_db, "conn"):
+            self.size_signature = file_signature(self.size_db_file)
+
+    def serves(self, mode, request):
+        """Whether the DBs of the request are the DBs of this server, and the server has the
+        DBs of the query."""
+        for key, served in (("size_db", self.size_db_file), ("download_db", self.download_db_file)):
+            if key in request and not _same_path(request[key], served):
+                return False
+        return all(getattr(self, key) is not None for key in REQUIRED_DBS[mode])
+
+    def query_top(self, request):
+        import argparse
+
+        from .query_db import query_top_models
+
+        # Infinite bounds are sent as null in JSON.
+        end, max_size = request.get("end"), request.get("max_size")
+        args = argparse.Namespace(
+            date=request.get("date"),
+            start=request.get("start", 0),
+            end=float("inf") if end is None else end,
+            limit=request.get("limit", 20),
+            min_size=request.get("min_size", 0),
+            max_size=float("inf") if max_size is None else max_size,
+            include_unsupported=request.get("include_unsupported", False),
+            lookahead=request.get("lookahead", 0),
+            # An in-memory size DB is used if the server has no size DB.
+            size_db=None,
+            pretty=False,
+            config_store=self.config_store,
+            fetch_concurrency=self.fetch_concurrency,
+            fetch_rate=self.fetch_rate,
+        )
+        with self.lock:
+            models = query_top_models(
+                args, size_db=self.size_db, download_db=self.download_db, snapshots=self.snapshots
+            )
+            self._persisted()
+        return {"models": [dict(model.to_dict(), size=model.size) for model in models]}
+
+    def query_download(self, request):
+        from .query_db import query_model_download
+
+        with self.lock:
+            records = query_model_download(
+                request["model_ids"],
+                request.get("date"),
+                self.download_db,
+                snapshots=self.snapshots,
+            )
+        return {"results": [record.to_dict() for record in records]}
+
+    def query_size(self, request):
+        from .query_db import query_model_size
+
+        model_ids = request["model_ids"]
+        with self.lock:
+            config_store = None
+            if self.config_store is not None:
+                from .config_store import ConfigStore, prefetch_configs
+
+                config_store = ConfigStore(self.config_store)
+                missing = [m for m in model_ids if self.size_db.lookup(m) is None]
+                prefetch_configs(missing, config_store, self.fetch_concurrency, self.fetch_rate)
+            results = query_model_size(model_ids, self.size_db, config_store=config_store)
+            self.size_db.persist()
+            self._persisted()
+        return {"results": [asdict(result) for result in results]}
+
+    def health(self):
+        with self.lock:
+            return {
+                "size_db": self.size_db_file,
+                "download_db": self.download_db_file,
+                "n_models": None if self.size_db is None else len(self.size_db),
+                "n_dates": None if self.download_db is None else len(self.download_db),
+            }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """The HTTP handler of the query server, which is set as `server.query_server`."""
+
+    def _respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._respond(404, {"error": f"Unknown path {self.path}"})
+            return
+        self._respond(200, self.server.query_server.health())
+
+    def do_POST(self):
+        mode = self.path.lstrip("/")
+        if mode not in FORWARDED_MODES:
+            self._respond(404, {"error": f"Unknown path {self.path}"})
+            return
+        query_server = self.server.query_server
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if not query_server.serves(mode, request):
+                # The client runs the query locally.
+                self._respond(409, {"error": "The DBs of the query are not served"})
+                return
+            self._respond(200, getattr(query_server, mode)(request))
+        except (KeyError, ValueError) as err:
+            self._respond(400, {"error": f"{type(err).__name__}: {err}"})
+        except Exception as err:
+            # Respond instead of dropping the connection, e.g., if the DB was being written.
+            print(f"Failed to answer {mode}: {type(err).__name__}: {err}", flush=True)
+            self._respond(500, {"error": f"{type(err).__name__}: {err}"})
+
+
+def watch(query_server, interval, stop):
+    """Reload the changed DBs of the server every `interval` seconds until `stop` is set."""
+    while not stop.wait(interval):
+        try:
+            query_server.reload()
+        except Exception as err:
+            # The DB may be in the middle of being written. Retry next time.
+            print(f"Failed to reload: {err}", flush=True)
+
+
+def serve(args):
+    if args.size_db is None and args.download_db is None:
+        raise ValueError("At least one of --size-db and --download-db is required")
+    query_server = QueryServer(
+        args.size_db,
+        args.download_db,
+        config_store=args.config_store,
+        fetch_concurrency=args.fetch_concurrency,
+        fetch_rate=args.fetch_rate,
+        pretty=args.pretty,
+    )
+    httpd = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    httpd.query_server = query_server
+
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, args=(query_server, args.poll_interval, stop))
+    watcher.daemon = True
+    watcher.start()
+
+    print(f"Serving queries at http://{args.host}:{httpd.server_port}", flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        httpd.server_close()
+        print("Query server stopped", flush=True)
+
+
+def _absolute(path):
+    return None if path is None else os.path.abspath(path)
+
+
+def forward(args):
+    """Forward the query subcommand to the server at `args.server` and print the results
+    in the same format as the local query. Return False if the server is not running, does
+    not serve the DBs of the query, or fails to answer it, so the caller runs it locally."""
+    if args.mode == "query_top":
+        request = {
+            "size_db": _absolute(args.size_db),
+            "download_db": _absolute(args.download_db),
+            "date": args.date,
+            "start": args.start,
+            "end": None if args.end == float("inf") else args.end,
+            "limit": args.limit,
+            "min_size": args.min_size,
+            "max_size": None if args.max_size == float("inf") else args.max_size,
+            "include_unsupported": args.include_unsupported,
+            "lookahead": args.lookahead,
+        }
+    elif args.mode == "query_download":
+        request = {
+            "download_db": _absolute(args.download_db),
+            "model_ids": args.model_ids,
+            "date": args.date,
+        }
+    else:
+        request = {"size_db": _absolute(args.size_db), "model_ids": args.model_ids}
+
+    url = f"{args.server.rstrip('/')}/{args.mode}"
+    req = urllib.request.Request(
+        url, data=json.dumps(request).encode(), headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=CLIENT_TIMEOUT) as resp:
+            response = json.loads(resp.read())
+    except urllib.error.HTTPError as err:
+        if err.code == 409:
+            print(f"{args.server} does not serve the DBs of the query, query locally", flush=True)
+            return False
+        error = json.loads(err.read()).get("error", str(err))
+        if err.code >= 500:
+            print(f"Query server {args.server} failed ({error}), query locally", flush=True)
+            return False
+        raise ValueError(error) from err
+    except urllib.error.URLError as err:
+        print(
+            f"Query server {args.server} is not running ({err.reason}), query locally", flush=True
+        )
+        return False
+    except (http.client.RemoteDisconnected, ConnectionError) as err:
+        # The server closed the connection, e.g., it was stopped during the query.
+        print(f"Query server {args.server} disconnected ({err}), query locally", flush=True)
+        return False
+
+    if args.mode == "query_top":
+        from .utils import print_model_in_md
+
+        print_model_in_md([ModelNDownload(**model) for model in response["models"]])
+    elif args.mode == "query_download":
+        for record in response["results"]:
+            print(ModelNDownload(**record))
+    else:
+        for result in response["results"]:
+            print(CalcModelSizeResult(**result))
+    return True
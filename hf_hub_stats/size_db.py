@@ -1,17 +1,83 @@
-"""Model Size Database."""
+"""Model Size Database.
+
+transformers and accelerate are only imported when a model size is estimated, so that
+queries served by the DB do not pay for importing them.
+"""
+from collections import OrderedDict, deque
 import os
+import re
 import tempfile
+import time
 
 import json
-from dataclasses import asdict, dataclass
+from dataclasses import asdict
 
-import transformers
-from accelerate import init_empty_weights
+from . import profiling, serialization
+from .param_count import config_hash, count_parameters
+from .utils import slotted_dataclass
 
 MISS_CONFIG_MSG = "does not appear to have a file named config.json"
 
-
-@dataclass
+# The file extensions of model weights on the Hub.
+WEIGHT_FILE_EXTS = (".safetensors", ".bin")
+
+# Loading a pretrained model may upcast weights (e.g., fp16 to fp32), so we reserve
+# this factor of weight file size when scheduling pretrained fallbacks.
+FALLBACK_MEM_FACTOR = 2
+
+# The base time in seconds to retry failed estimations of each error class. The time is
+# doubled on every consecutive failure of a model, up to MAX_RETRY_AFTER.
+RETRY_AFTER = {"transient": 24 * 3600, "permanent": 30 * 24 * 3600}
+MAX_RETRY_AFTER = 180 * 24 * 3600
+
+# Exception types of transient failures, such as network errors or the offline mode, in
+# requests, urllib3, and huggingface_hub. They are matched by names to avoid importing the
+# libraries. Builtin ConnectionError and TimeoutError are transient as well.
+TRANSIENT_ERROR_TYPES = (
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+    "NewConnectionError",
+    "MaxRetryError",
+    "ProtocolError",
+    "LocalEntryNotFoundError",
+    "OfflineModeIsEnabled",
+    # A worker crashed, e.g., killed by OOM, which may pass on a retry with less load.
+    "BrokenProcessPool",
+)
+
+# Error messages (in lower case) that indicate transient failures, which are only used when
+# the exception is unavailable, e.g., for results of crashed workers.
+TRANSIENT_ERROR_MSGS = (
+    "timed out",
+    "timeout",
+    "connection",
+    "couldn't connect",
+    "max retries exceeded",
+    "temporary failure",
+    "too many requests",
+    "internal server error",
+    "bad gateway",
+    "service unavailable",
+)
+
+# HTTP errors of rate limits and server errors in messages, e.g., "503 Server Error: ...".
+TRANSIENT_STATUS_PATTERN = re.compile(r"\b(429|5\d\d) (client|server) error\b", re.IGNORECASE)
+
+# Persist the size DB every this number of estimated models. Results in between are
+# recorded in the journal, so they survive interruptions as well.
+PERSIST_EVERY = 32
+
+# The memo of the models that were being estimated when an update was interrupted, e.g.,
+# the process was killed by OOM while loading pretrained weights.
+INTERRUPTED_MSG = "Interrupted during the estimation"
+
+# The max number of architectures in the in-process cache of model sizes by config hashes.
+ARCH_CACHE_ENTRIES = 4096
+
+
+@slotted_dataclass
 class CalcModelSizeResult:
     """The dataclass of the result of calculating model size."""
 
@@ -22,21 +88,223 @@ class CalcModelSizeResult:
     # 0: valid
     # 1: the model is not supported
     # 2: the model size cannot be estimated without weights
+    # 3: valid, estimated from the metadata of weight files (memo is the file used)
     code: int
 
     memo: str = None
 
+    # For invalid results: when the last failure happened (seconds since epoch),
+    # the error class ("transient" or "permanent"), and the number of consecutive failures.
+    failed_at: float = None
+    error_class: str = None
+    n_failures: int = 0
+
+    # For results estimated from configs: the hash of the size-relevant config fields.
+    config_hash: str = None
+
+    @property
+    def valid(self):
+        return self.code in (0, 3)
+
+    @property
+    def retry_after(self):
+        """The time (seconds since epoch) after which a failed estimation should be retried."""
+        if self.failed_at is None:
+            # Failures recorded before the retry policy are not retried by queries and
+            # updates, but only by --retry-failed.
+            return float("inf")
+        backoff = RETRY_AFTER[self.error_class] * 2 ** max(self.n_failures - 1, 0)
+        return self.failed_at + min(backoff, MAX_RETRY_AFTER)
+
+
+def classify_exception(err):
+    """The error class of an exception by its type or HTTP status, following the chain of
+    exceptions it was raised from (e.g., the OSError of transformers for network errors).
+    Return None if unknown."""
+    seen = set()
+    while err is not None and id(err) not in seen:
+        seen.add(id(err))
+        status = getattr(getattr(err, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return "transient" if status == 429 or status >= 500 else "permanent"
+        if isinstance(err, (ConnectionError, TimeoutError)):
+            return "transient"
+        if type(err).__name__ in TRANSIENT_ERROR_TYPES:
+            return "transient"
+        err = err.__cause__ or err.__context__
+    return None
+
+
+def classify_error(result):
+    """The error class of a failed result by its memo, for failures without exceptions."""
+    if result.memo is None:
+        return "permanent"
+    memo = result.memo.lower()
+    if any(msg in memo for msg in TRANSIENT_ERROR_MSGS) or TRANSIENT_STATUS_PATTERN.search(memo):
+        return "transient"
+    return "permanent"
+
+
+def failed_result(model_id, err):
+    """The failed result of an exception, classified where the exception is caught."""
+    return CalcModelSizeResult(model_id, 0, 1, str(err), error_class=classify_exception(err))
+
+
+class ArchSizeCache:
+    """Model sizes keyed by config hashes, so that models of the same architecture (e.g.,
+    fine-tunes of a base model) resolve without building models. This is an LRU of at most
+    `max_entries` architectures with hit/miss counters. Entries are persisted with the
+    results in SizeDB, which warms up the cache on loading.
+    """
+
+    def __init__(self, max_entries=ARCH_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Get the model size (in billions) of the config hash, or None on cache miss."""
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, size):
+        self.entries[key] = size
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def add(self, result):
+        """Cache the result if it is estimated from the config."""
+        if result.code == 0 and result.config_hash is not None:
+            self.put(result.config_hash, result.size)
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self)} architectures"
+
+
+# The architecture cache shared by all estimations in this process.
+ARCH_SIZE_CACHE = ArchSizeCache()
+
 
 class SizeDB:
-    def __init__(self, file_name):
+    """The model size DB in a JSON file. Estimation results that are not persisted yet are
+    appended to the journal file `<file_name>.journal`, which is replayed on loading if
+    the last update was interrupted, and removed once the DB is persisted. The DB file is
+    written in compact JSON unless `pretty` is set.
+
+    Readers of a DB that is being updated by another process (e.g., the query server) open
+    it with `recover=False`, which neither replays nor removes the journal, and pick up new
+    results with `tail_journal()`.
+    """
+
+    def __init__(self, file_name, fsync=False, pretty=False, recover=True):
         self.dirty = False
         self.file_name = file_name
-        self.db = {}
-        if file_name is not None and os.path.exists(file_name):
-            with open(file_name, "r") as filep:
-                for key, val in json.load(filep).items():
-                    self.db[key] = CalcModelSizeResult(**val)
-            print(f"{len(self.db)} record loaded from the model size DB", flush=True)
+        self.fsync = fsync
+        self.pretty = pretty
+        self.journal = None
+
+        # Whether the journal was replayed, so it is removed once the DB is persisted.
+        self.recovered = False
+        self.db = self._load()
+        if recover and file_name is not None and os.path.exists(self.journal_file):
+            self._replay_journal()
+            self.recovered = True
+
+    def _load(self):
+        db = {}
+        if self.file_name is not None and os.path.exists(self.file_name):
+            with profiling.phase("size_db.load"), open(self.file_name, "rb") as filep:
+                data = filep.read()
+                profiling.count("size_db.bytes_read", len(data))
+                for key, val in serialization.loads(data).items():
+                    db[key] = CalcModelSizeResult(**val)
+                    ARCH_SIZE_CACHE.add(db[key])
+            print(f"{len(db)} record loaded from the model size DB", flush=True)
+        return db
+
+    @property
+    def journal_file(self):
+        return f"{self.file_name}.journal"
+
+    def _replay_journal(self):
+        """Recover the results of an interrupted update from the journal."""
+        started = set()
+        n_results = 0
+        with open(self.journal_file, "r") as filep:
+            for line in filep:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be partially written.
+                    continue
+                if "start" in entry:
+                    started.add(entry["start"])
+                else:
+                    result = CalcModelSizeResult(**entry["result"])
+                    started.discard(result.model_id)
+                    self[result.model_id] = result
+                    n_results += 1
+
+        # The models being estimated when the update was interrupted may crash it again,
+        # so record them as failures and leave them to the retry policy.
+        for model_id in sorted(started):
+            print(f"{model_id} was being estimated when the update was interrupted", flush=True)
+            self[model_id] = CalcModelSizeResult(model_id, 0, 1, INTERRUPTED_MSG)
+        print(
+            f"Recovered {n_results} results and {len(started)} interrupted models "
+            "from the journal",
+            flush=True,
+        )
+
+    def tail_journal(self, offset=0):
+        """Apply the results appended to the journal after the byte offset by the update of
+        another process, and return the offset of the end of the journal. The results are
+        only kept in memory, as the updating process persists them."""
+        if self.file_name is None or not os.path.exists(self.journal_file):
+            return 0
+        with open(self.journal_file, "rb") as filep:
+            filep.seek(offset)
+            for line in filep:
+                if not line.endswith(b"\n"):
+                    # The last line may be partially written. Read it again next time.
+                    break
+                offset += len(line)
+                entry = json.loads(line)
+                if "result" in entry:
+                    result = CalcModelSizeResult(**entry["result"])
+                    self.db[result.model_id] = result
+                    ARCH_SIZE_CACHE.add(result)
+        return offset
+
+    def _write_journal(self, entry):
+        if self.file_name is None:
+            return
+        if self.journal is None:
+            self.journal = open(self.journal_file, "a")
+        self.journal.write(json.dumps(entry) + "\n")
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def _close_journal(self):
+        # Only remove the journal written or replayed by this DB, but not the journal of an
+        # update in another process.
+        owned = self.journal is not None or self.recovered
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if owned and self.file_name is not None and os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self.recovered = False
 
     def __getitem__(self, key):
         return self.db[key]
@@ -47,13 +315,34 @@ class SizeDB:
     def __len__(self):
         return len(self.db)
 
+    def lookup(self, model_id, now=None):
+        """Get the cached result of the model. Failed results are also returned (i.e.,
+        negative cache) until they should be retried. Return None on cache miss."""
+        if model_id not in self.db:
+            profiling.count("size_db.miss")
+            return None
+        result = self.db[model_id]
+        if not result.valid and result.retry_after <= (time.time() if now is None else now):
+            profiling.count("size_db.miss")
+            return None
+        profiling.count("size_db.hit")
+        return result
+
     def __setitem__(self, key, result):
         model_id = result.model_id
         assert key == model_id
 
+        if not result.valid and result.failed_at is None:
+            # Record the failure for the retry policy.
+            prev = self.db.get(model_id)
+            result.failed_at = time.time()
+            result.error_class = result.error_class or classify_error(result)
+            result.n_failures = 1 if prev is None or prev.valid else prev.n_failures + 1
+        ARCH_SIZE_CACHE.add(result)
+
         if model_id in self.db:
             if self.db[model_id] != result:
-                print("Update {model_id}")
+                print(f"Update {model_id}")
                 self.db[model_id] = result
                 self.dirty = True
         else:
@@ -61,22 +350,36 @@ class SizeDB:
             self.dirty = True
 
     def persist(self):
+        if not self.dirty:
+            self._close_journal()
+            return
+
         if self.file_name is None:
             print("Skip dumping DB because no file path is provided", flush=True)
             return
 
-        if self.dirty:
-            print(f"Updating database with total {len(self.db)} records", flush=True)
-            with open(self.file_name, "w") as filep:
-                data = {k: asdict(v) for k, v in self.db.items()}
-                json.dump(data, filep, indent=2)
+        # Write to a temporary file and rename it, so the DB is never truncated even if
+        # the process is killed in the middle.
+        print(f"Updating database with total {len(self.db)} records", flush=True)
+        with profiling.phase("size_db.persist"), open(self.file_name + ".tmp", "wb") as filep:
+            data = {k: asdict(v) for k, v in self.db.items()}
+            payload = serialization.dumps(data, pretty=self.pretty)
+            filep.write(payload)
+            profiling.count("size_db.bytes_written", len(payload))
+            if self.fsync:
+                filep.flush()
+                os.fsync(filep.fileno())
+        os.replace(self.file_name + ".tmp", self.file_name)
         self.dirty = False
 
+        # All results in the journal are persisted now.
+        self._close_journal()
+
     def remove_errors(self):
         new_db = {}
         removed = 0
         for model_id, result in self.db.items():
-            if result.code == 0:
+            if result.valid:
                 new_db[model_id] = result
             else:
                 print(f"Remove {model_id} with result: {result}", flush=True)
@@ -86,26 +389,80 @@ class SizeDB:
         self.db = new_db
 
     def update(self, all_models, args):
-        PERSIST_EVERY = 32
-
-        changed = 0
-        for model in all_models[args.start : min(args.end, len(all_models))]:
+        model_ids = []
+        models = all_models[args.start : min(args.end, len(all_models))]
+        for model in models:
             model_id = model.modelId
 
-            # Cache hit.
-            if model_id in self:
+            # Cache hit, including failures that should not be retried yet. This also skips
+            # the models done by an interrupted update, so it resumes where it left off.
+            if self.lookup(model_id) is not None:
                 continue
+            model_ids.append(model_id)
+
+        print(f"{len(models) - len(model_ids)} of {len(models)} models are in the DB", flush=True)
+        self._estimate(model_ids, args)
+
+    def retry_failed(self, args):
+        """Re-estimate failed models whose retry time has come, including the failures
+        recorded before the retry policy."""
+        now = time.time()
+        model_ids = [
+            model_id
+            for model_id, result in self.db.items()
+            if not result.valid and (result.failed_at is None or result.retry_after <= now)
+        ]
+        print(f"Retrying {len(model_ids)} failed models", flush=True)
+        self._estimate(model_ids, args)
+
+    def _estimate(self, model_ids, args):
+        # Bulk fetch the configs so that the estimation does not block on network.
+        config_store = None
+        if getattr(args, "config_store", None) is not None:
+            from .config_store import ConfigStore, prefetch_configs
+
+            config_store = ConfigStore(args.config_store)
+            with profiling.phase("config_fetch"):
+                prefetch_configs(
+                    model_ids,
+                    config_store,
+                    concurrency=args.fetch_concurrency,
+                    rate=args.fetch_rate,
+                )
 
-            # Cacht miss. Estimate the model size with empty weights.
-            result = get_model_size_in_b_with_empty_weights(model_id, fallback=True)
-            self[model_id] = result
-            changed += 1
+        # Cacht miss. Estimate the model size with empty weights.
+        workers = getattr(args, "workers", 1)
+        if workers > 1:
+            results = get_model_sizes_in_parallel(
+                model_ids,
+                workers,
+                fallback_mem_gb=getattr(args, "fallback_mem_gb", 0),
+                config_store=config_store,
+            )
+        else:
+            results = self._estimate_sequentially(model_ids, config_store)
 
-            if changed == PERSIST_EVERY:
+        changed = 0
+        try:
+            for result in results:
+                self[result.model_id] = result
+                self._write_journal({"result": asdict(result)})
+                changed += 1
+
+                if changed % PERSIST_EVERY == 0:
+                    self.persist()
+        finally:
+            if changed > 0:
                 self.persist()
-
-        if changed > 0:
-            self.persist()
+        print(f"Architecture cache: {ARCH_SIZE_CACHE.stats()}", flush=True)
+
+    def _estimate_sequentially(self, model_ids, config_store):
+        for model_id in model_ids:
+            # Mark the start, so the model is not retried right away if it crashes the process.
+            self._write_journal({"start": model_id})
+            yield get_model_size_in_b_with_empty_weights(
+                model_id, fallback=True, config_store=config_store
+            )
 
     def draw_markdown(self, max_memo_len=float("inf")):
         import pandas
@@ -113,7 +470,7 @@ class SizeDB:
         tbl = []
         for key, val in sorted(self.db.items(), key=lambda kv: kv[1].size, reverse=True):
             memo = ""
-            if val.code != 0:
+            if not val.valid:
                 size = "N/A"
                 memo = val.memo[: min(max_memo_len, len(val.memo))]
             else:
@@ -133,47 +490,494 @@ class SizeDB:
         print(df.to_markdown(index=False))
 
 
-def get_model_size_in_b_with_empty_weights(model_id, fallback=True):
-    def _get_size_with_empty_weights(model_id):
-        try:
-            cfg = transformers.AutoConfig.from_pretrained(
-                model_id, trust_remote_code=True, revision="main"
-            )
-        except Exception as err:
-            # Fail to get the model config.
-            return CalcModelSizeResult(model_id, 0, 1, str(err))
+def open_size_db(file_name, fsync=False, pretty=False, recover=True):
+    """Open a model size DB. SQLite files (.sqlite or .db) use SQLiteSizeDB, and other
+    paths use the JSON SizeDB. `pretty` and `recover` only apply to JSON files."""
+    from .sqlite_db import SQLiteSizeDB, is_sqlite_file
+
+    if file_name is not None and is_sqlite_file(file_name):
+        return SQLiteSizeDB(file_name, fsync=fsync)
+    return SizeDB(file_name, fsync=fsync, pretty=pretty, recover=recover)
+
+
+def _load_config_from_store(model_id, config_store):
+    """Load the model config from the local config store, or None if unavailable."""
+    import transformers
+
+    cfg_dict = config_store.get(model_id)
+    if (
+        cfg_dict is not None
+        and "AutoConfig" not in cfg_dict.get("auto_map", {})
+        and cfg_dict.get("model_type") in transformers.CONFIG_MAPPING
+    ):
+        return transformers.CONFIG_MAPPING[cfg_dict["model_type"]].from_dict(cfg_dict)
+    return None
+
+
+def _load_config(model_id, config_store=None):
+    """Load the model config from the local config store if available, or from the Hub."""
+    import transformers
+
+    if config_store is not None:
+        with profiling.phase("config_load.store"):
+            cfg = _load_config_from_store(model_id, config_store)
+        if cfg is not None:
+            profiling.count("config_store.hit")
+            return cfg
+        profiling.count("config_store.miss")
+    with profiling.phase("config_load.hub"):
+        return transformers.AutoConfig.from_pretrained(
+            model_id, trust_remote_code=True, revision="main"
+        )
 
-        try:
-            with init_empty_weights():
-                model = transformers.AutoModel.from_config(cfg)
+
+def _get_size_from_arch_cache(model_id, config_store):
+    """Resolve the model size with the architecture cache and the local config store
+    without network access. Return None if unavailable."""
+    try:
+        cfg = _load_config_from_store(model_id, config_store)
+    except Exception:
+        return None
+    if cfg is None:
+        return None
+    key = config_hash(cfg)
+    size = ARCH_SIZE_CACHE.get(key)
+    if size is None:
+        profiling.count("arch_cache.miss")
+        return None
+    profiling.count("arch_cache.hit")
+    return CalcModelSizeResult(model_id, size, 0, config_hash=key)
+
+
+def _get_size_with_empty_weights(model_id, config_store=None):
+    try:
+        cfg = _load_config(model_id, config_store)
+    except Exception as err:
+        # Fail to get the model config.
+        return failed_result(model_id, err)
+
+    # Models of the same architecture have the same size.
+    key = config_hash(cfg)
+    size = ARCH_SIZE_CACHE.get(key)
+    if size is not None:
+        profiling.count("arch_cache.hit")
+        return CalcModelSizeResult(model_id, size, 0, config_hash=key)
+    profiling.count("arch_cache.miss")
+
+    # Fast path: count parameters from the config for common architectures.
+    with profiling.phase("param_count"):
+        n_params = count_parameters(cfg)
+    if n_params is not None:
+        profiling.count("param_count.analytic")
+        result = CalcModelSizeResult(model_id, n_params / 1e9, 0)
+    else:
+        with profiling.phase("empty_weights"):
+            result = _build_empty_model(model_id, cfg)
+    if result.code == 0:
+        result.config_hash = key
+        ARCH_SIZE_CACHE.add(result)
+    return result
+
+
+def _build_empty_model(model_id, cfg):
+    import transformers
+    from accelerate import init_empty_weights
+
+    try:
+        with init_empty_weights():
+            model = transformers.AutoModel.from_config(cfg)
+        return CalcModelSizeResult(model_id, model.num_parameters() / 1e9, 0)
+    except Exception as err:
+        if MISS_CONFIG_MSG in str(err):
+            return failed_result(model_id, err)
+
+    # Failed to estimate without weights. This may due to the fact that
+    # the model implementation is not in the official transformers but the model repo.
+    return CalcModelSizeResult(model_id, 0, 2)
+
+
+def _get_size_from_weight_headers(model_id, root=None):
+    """Estimate the model size from weight file metadata. Return None if unavailable. The
+    files are read from the Hub, or from `root` if it is a local copy of the model repo."""
+    from .weight_headers import WeightFileReader, count_params_from_weight_headers
+
+    profiling.count("fallback.weight_headers")
+    try:
+        with profiling.phase("weight_headers"):
+            reader = WeightFileReader(model_id, root)
+            n_params, file_name = count_params_from_weight_headers(reader)
+    except Exception as err:
+        print(f"Failed to read weight file metadata of {model_id}: {err}", flush=True)
+        return None
+    if n_params is None:
+        return None
+    return CalcModelSizeResult(model_id, n_params / 1e9, 3, file_name)
+
+
+def _get_size(model_id):
+    import transformers
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="hf_hub_stats_model_") as tmpdir:
+            model = transformers.AutoModel.from_pretrained(
+                model_id, trust_remote_code=True, cache_dir=tmpdir
+            )
             return CalcModelSizeResult(model_id, model.num_parameters() / 1e9, 0)
-        except Exception as err:
-            if MISS_CONFIG_MSG in str(err):
-                return CalcModelSizeResult(model_id, 0, 1, str(err))
+    except Exception as err:
+        # Failed to estimate anyways.
+        return failed_result(model_id, err)
 
-        # Failed to estimate without weights. This may due to the fact that
-        # the model implementation is not in the official transformers but the model repo.
-        return CalcModelSizeResult(model_id, 0, 2)
 
-    def _get_size(model_id):
-        try:
-            with tempfile.TemporaryDirectory(prefix="hf_hub_stats_model_") as tmpdir:
-                model = transformers.AutoModel.from_pretrained(
-                    model_id, trust_remote_code=True, cache_dir=tmpdir
-                )
-                return CalcModelSizeResult(model_id, model.num_parameters() / 1e9, 0)
-        except Exception as err:
-            # Failed to estimate anyways.
-            return CalcModelSizeResult(model_id, 0, 1, str(err))
+def _get_weight_bytes(model_id):
+    """Get the size of weight files of the model on the Hub, or None if unavailable."""
+    from huggingface_hub import HfApi
+
+    try:
+        info = HfApi().model_info(model_id, files_metadata=True)
+    except Exception:
+        return None
+
+    # Only one weight format will be loaded, so take the largest one.
+    sizes = {}
+    for sibling in info.siblings or []:
+        for ext in WEIGHT_FILE_EXTS:
+            if sibling.rfilename.endswith(ext) and sibling.size is not None:
+                sizes[ext] = sizes.get(ext, 0) + sibling.size
+    return max(sizes.values()) if sizes else None
+
 
-    result = _get_size_with_empty_weights(model_id)
+def _get_size_with_empty_weights_and_footprint(model_id, config_store=None):
+    """Run in a worker. Also estimate the memory footprint of the pretrained fallback
+    if the model size cannot be estimated with empty weights."""
+    result = _get_size_with_empty_weights(model_id, config_store)
+    if result.code != 2:
+        return result, None
+
+    header_result = _get_size_from_weight_headers(model_id)
+    if header_result is not None:
+        return header_result, None
+
+    weight_bytes = _get_weight_bytes(model_id)
+    if weight_bytes is None:
+        # Unknown footprint, so the fallback has to run alone.
+        return result, float("inf")
+    return result, weight_bytes * FALLBACK_MEM_FACTOR
+
+
+def get_model_size_in_b_with_empty_weights(model_id, fallback=True, config_store=None):
+    result = _get_size_with_empty_weights(model_id, config_store)
     if fallback and result.code == 2:
-        # Failed to estimate with empty weights. Try again with model on CPU.
+        # Failed to estimate with empty weights. Try the metadata of weight files first.
+        header_result = _get_size_from_weight_headers(model_id)
+        if header_result is not None:
+            return header_result
+
+        # Try again with model on CPU.
         # Note that here we run them sequentially to avoid OOM.
         print(
             f"Getting the size of {model_id} with a pretrained model",
             flush=True,
         )
-        result = _get_size(model_id)
+        profiling.count("fallback.pretrained")
+        with profiling.phase("pretrained_fallback"):
+            result = _get_size(model_id)
         print(f"Result: {result}", flush=True)
     return result
+
+
+class FallbackBudget:
+    """The memory budget in bytes of concurrent pretrained fallbacks. A job starts if the
+    footprints of all running jobs fit in the budget, or if no other job is running. Jobs of
+    unknown (infinite) footprints are counted separately and always run alone, so they are
+    never added to the reserved memory."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.reserved = 0
+        self.n_known = 0
+        self.n_unknown = 0
+
+    def __len__(self):
+        return self.n_known + self.n_unknown
+
+    def can_start(self, footprint):
+        if len(self) == 0:
+            return True
+        if self.n_unknown > 0 or footprint == float("inf"):
+            return False
+        return self.reserved + footprint <= self.budget
+
+    def start(self, footprint):
+        if footprint == float("inf"):
+            self.n_unknown += 1
+        else:
+            self.n_known += 1
+            self.reserved += footprint
+
+    def finish(self, footprint):
+        if footprint == float("inf"):
+            self.n_unknown -= 1
+        else:
+            self.n_known -= 1
+            self.reserved -= footprint
+
+
+def get_model_sizes_in_parallel(model_ids, workers, fallback_mem_gb=0, config_store=None):
+    """Estimate the sizes of models with process pools, and yield the results in the order
+    of completion. Estimations with empty weights run in a pool of `workers` processes.
+    Models that need the pretrained fallback go to a separate queue, which starts a job only
+    if the memory footprints of all running fallback jobs fit in `fallback_mem_gb`. A job
+    always starts when no other fallback job is running, so the default budget 0 runs
+    fallbacks sequentially to avoid OOM. Jobs of unknown footprints always run alone.
+
+    Estimations are submitted as workers become available, so models whose architectures
+    are resolved by earlier results in the run are served by the architecture cache
+    without running a job, if their configs are in the local config store.
+
+    If a worker crashes (e.g., killed by OOM), all jobs running in its pool are broken, so
+    the pool is recreated and the jobs are run again one at a time, and only the job that
+    crashes alone fails.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    budget = FallbackBudget(fallback_mem_gb * 1e9)
+    pending = deque(model_ids)
+    fallback_queue = deque()
+
+    # Models of the config pool that were running when a worker crashed, which run alone,
+    # and the future of the running one.
+    suspects = deque()
+    suspect_future = None
+
+    # Map from running futures to (model ID, reserved memory footprint). The footprint
+    # is None for the estimations with empty weights.
+    running = {}
+
+    config_pool = ProcessPoolExecutor(workers)
+    fallback_pool = ProcessPoolExecutor(workers)
+    try:
+        while pending or running or fallback_queue or suspects:
+            # Keep the config pool busy with a bounded number of jobs in flight.
+            n_config = sum([footprint is None for _, footprint in running.values()])
+            if suspects and n_config == 0:
+                model_id = suspects.popleft()
+                suspect_future = config_pool.submit(
+                    _get_size_with_empty_weights_and_footprint, model_id, config_store
+                )
+                running[suspect_future] = (model_id, None)
+                n_config += 1
+            while pending and suspect_future not in running and n_config < 2 * workers:
+                model_id = pending.popleft()
+                if config_store is not None:
+                    result = _get_size_from_arch_cache(model_id, config_store)
+                    if result is not None:
+                        yield result
+                        continue
+                future = config_pool.submit(
+                    _get_size_with_empty_weights_and_footprint, model_id, config_store
+                )
+                running[future] = (model_id, None)
+                n_config += 1
+            if not running and not fallback_queue:
+                break
+
+            # Start fallback jobs within the memory budget.
+            while fallback_queue:
+                model_id, footprint = fallback_queue[0]
+                if not budget.can_start(footprint):
+                    break
+                fallback_queue.popleft()
+                print(f"Getting the size of {model_id} with a pretrained model", flush=True)
+                profiling.count("fallback.pretrained")
+                running[fallback_pool.submit(_get_size, model_id)] = (model_id, footprint)
+                budget.start(footprint)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in running:
+                    # A job of a broken pool, which is handled with the job that broke it.
+                    continue
+                model_id, footprint = running.pop(future)
+                if footprint is not None:
+                    budget.finish(footprint)
+
+                try:
+                    result = future.result()
+                except BrokenProcessPool as err:
+                    # A worker crashed (e.g., killed by OOM), which broke all jobs of its
+                    # pool. Recreate the pool, and run the jobs again one at a time, so only
+                    # the job that crashes alone fails.
+                    is_config = footprint is None
+                    broken = [model_id]
+                    for other in [f for f, (_, fp) in running.items() if (fp is None) == is_config]:
+                        other_id, other_footprint = running.pop(other)
+                        if other_footprint is not None:
+                            budget.finish(other_footprint)
+                        broken.append(other_id)
+                    if is_config:
+                        config_pool.shutdown(wait=False)
+                        config_pool = ProcessPoolExecutor(workers)
+                    else:
+                        fallback_pool.shutdown(wait=False)
+                        fallback_pool = ProcessPoolExecutor(workers)
+                    if len(broken) == 1:
+                        yield failed_result(model_id, err)
+                        continue
+                    print(f"A worker crashed, retrying {len(broken)} models alone", flush=True)
+                    for broken_id in reversed(broken):
+                        if is_config:
+                            suspects.appendleft(broken_id)
+                        else:
+                            # Jobs of unknown footprints run alone.
+                            fallback_queue.appendleft((broken_id, float("inf")))
+                    continue
+                except Exception as err:
+                    yield failed_result(model_id, err)
+                    continue
+
+                if footprint is None:
+                    result, fallback_footprint = result
+                    ARCH_SIZE_CACHE.add(result)
+                    if result.code == 2:
+                        fallback_queue.append((model_id, fallback_footprint))
+                        continue
+                else:
+                    print(f"Result: {result}", flush=True)
+                yield result
+    finally:
+        config_pool.shutdown()
+        fallback_pool.shutdown()
+
+
+class LookaheadResolver:
+    """Resolve the sizes of models in the order of requests, while the next `lookahead`
+    models hinted by `prefetch()` (e.g., the cache misses in the rank order) are estimated
+    with empty weights in a pool of `lookahead` processes. The pretrained fallback only runs
+    in this process when its model is requested, so it is never speculative.
+
+    `close()` stops the speculative estimations that have not started, and returns the
+    results of the finished ones that were not requested, so they can be written back to
+    the size DB.
+    """
+
+    def __init__(self, lookahead, config_store=None):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.lookahead = lookahead
+        self.config_store = config_store
+        self.pool = ProcessPoolExecutor(lookahead)
+
+        # Hinted models that are not submitted yet, and the submitted ones not requested yet.
+        self.pending = deque()
+        self.futures = OrderedDict()
+        self.requested = set()
+
+    def prefetch(self, model_ids):
+        """Hint the models to be requested next in order, which replaces the previous hint."""
+        self.pending = deque(m for m in model_ids if m not in self.requested)
+        self._fill()
+
+    def _submit(self, model_id):
+        self.futures[model_id] = self.pool.submit(
+            _get_size_with_empty_weights_and_footprint, model_id, self.config_store
+        )
+
+    def _fill(self):
+        while self.pending and len(self.futures) < self.lookahead:
+            model_id = self.pending.popleft()
+            if model_id not in self.futures and model_id not in self.requested:
+                self._submit(model_id)
+
+    def __call__(self, model_id):
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+
+        self.requested.add(model_id)
+        if model_id in self.futures:
+            profiling.count("lookahead.hit")
+        else:
+            profiling.count("lookahead.miss")
+            self._submit(model_id)
+        future = self.futures.pop(model_id)
+
+        # Keep the pool busy with the next models while waiting.
+        self._fill()
+        try:
+            with profiling.phase("lookahead.wait"):
+                result, _ = future.result()
+        except Exception as err:
+            if isinstance(err, BrokenProcessPool):
+                # The worker crashed (e.g., killed by OOM), so resubmit the other models to
+                # a new pool.
+                self.pool.shutdown(wait=False)
+                self.pool = ProcessPoolExecutor(self.lookahead)
+                self.pending.extendleft(reversed(list(self.futures)))
+                self.futures.clear()
+                self._fill()
+            return failed_result(model_id, err)
+
+        ARCH_SIZE_CACHE.add(result)
+        if result.code == 2:
+            # Failed to estimate with empty weights or the metadata of weight files.
+            print(f"Getting the size of {model_id} with a pretrained model", flush=True)
+            profiling.count("fallback.pretrained")
+            with profiling.phase("pretrained_fallback"):
+                result = _get_size(model_id)
+            print(f"Result: {result}", flush=True)
+        return result
+
+    def close(self):
+        for future in self.futures.values():
+            future.cancel()
+        self.pool.shutdown(wait=True)
+
+        results = []
+        for future in self.futures.values():
+            if future.cancelled() or future.exception() is not None:
+                continue
+            result, _ = future.result()
+            if result.code != 2:
+                ARCH_SIZE_CACHE.add(result)
+                results.append(result)
+        profiling.count("lookahead.unrequested", len(results))
+        self.futures.clear()
+        self.pending.clear()
+        return results
+
+
+def verify_param_count(model_ids):
+    """Cross-check the analytic parameter counts with the ones of empty-weight models.
+    Return the list of (model ID, analytic count, empty-weight count) of mismatches.
+    """
+    import transformers
+
+    mismatches = []
+    n_checked = 0
+    for model_id in model_ids:
+        try:
+            cfg = transformers.AutoConfig.from_pretrained(
+                model_id, trust_remote_code=True, revision="main"
+            )
+        except Exception as err:
+            print(f"Skip {model_id} because the config is unavailable: {err}", flush=True)
+            continue
+
+        n_params = count_parameters(cfg)
+        if n_params is None:
+            # Not supported by the analytic counter.
+            continue
+
+        result = _build_empty_model(model_id, cfg)
+        if result.code != 0:
+            print(f"Skip {model_id} because the empty-weight model fails: {result}", flush=True)
+            continue
+
+        n_checked += 1
+        expected = round(result.size * 1e9)
+        if n_params != expected:
+            print(f"Mismatch {model_id} ({cfg.model_type}): {n_params} vs. {expected}", flush=True)
+            mismatches.append((model_id, n_params, expected))
+
+    print(f"Checked {n_checked} models with {len(mismatches)} mismatches", flush=True)
+    return mismatches
@@ -0,0 +1,163 @@
+"""Model size statistics of the download trend database.
+
+The statistics of a date are computed over the top downloaded models of the date whose sizes
+are in a range, by joining the snapshot of the date with the sizes of all models as arrays.
+They are cached per date in a JSON file next to the download trend DB
+(``<download_db>.size_stats.json``), keyed by the query parameters, so only the dates that
+are new to the cache are computed. Cached dates are not recomputed when sizes of their models
+are estimated later, unless the cache is refreshed.
+"""
+import os
+
+import json
+import numpy as np
+
+
+class SizeJoin:
+    """The sizes of models in an interned model table, which are looked up from the size DB
+    once per model. Sizes of invalid results are NaN, and `known` is False for models that
+    miss the size DB."""
+
+    def __init__(self, size_db):
+        self.size_db = size_db
+        self.model_ids = []
+        self.model_index = {}
+        self.sizes = np.empty(0, dtype=np.float64)
+        self.known = np.empty(0, dtype=bool)
+
+        # The slots of the last model table, which is shared by snapshots of columnar DBs.
+        self.table = None
+        self.table_slots = np.empty(0, dtype=np.int64)
+
+    def _intern(self, model_ids):
+        new_ids = [m for m in dict.fromkeys(model_ids) if m not in self.model_index]
+        if not new_ids:
+            return
+        sizes = np.full(len(new_ids), np.nan, dtype=np.float64)
+        known = np.zeros(len(new_ids), dtype=bool)
+        for pos, model_id in enumerate(new_ids):
+            self.model_index[model_id] = len(self.model_ids) + pos
+            result = self.size_db.lookup(model_id)
+            if result is not None:
+                known[pos] = True
+                sizes[pos] = result.size if result.valid else np.nan
+        self.model_ids.extend(new_ids)
+        self.sizes = np.concatenate([self.sizes, sizes])
+        self.known = np.concatenate([self.known, known])
+
+    def slots(self, model_ids):
+        """The slots of the model table in the joined sizes."""
+        if model_ids is not self.table:
+            self.table = model_ids
+            self.table_slots = np.empty(0, dtype=np.int64)
+        if len(self.table_slots) < len(model_ids):
+            # Only new models of the (append-only) model table are interned.
+            new_ids = model_ids[len(self.table_slots) :]
+            self._intern(new_ids)
+            new_slots = np.array([self.model_index[m] for m in new_ids], dtype=np.int64)
+            self.table_slots = np.concatenate([self.table_slots, new_slots])
+        return self.table_slots
+
+    def set(self, slot, result):
+        self.known[slot] = True
+        self.sizes[slot] = result.size if result.valid else np.nan
+
+
+def top_in_range(join, slots, downloads, resolve, limit=20, min_size=0, max_size=float("inf")):
+    """Select the top `limit` (0 for all) downloaded models in the size range among the models
+    of the slots, which is the same as walking models in the order of downloads (descending,
+    ties in the given order) until the limit is met. Models that miss the size DB are
+    resolved with `resolve(model_id)` only if they may be ranked above the limit, in the
+    order of downloads and at most as many at a time as the models still to be selected.
+
+    Return the (sizes, downloads) of the selected models in the order of downloads.
+    """
+    order = np.argsort(-np.asarray(downloads, dtype=np.int64), kind="stable")
+    slots = slots[order]
+    downloads = np.asarray(downloads)[order]
+    while True:
+        sizes = join.sizes[slots]
+        known = join.known[slots]
+        in_range = known & (sizes >= min_size) & (sizes <= max_size)
+        n_before = np.cumsum(in_range) - in_range
+        missing = ~known if limit <= 0 else ~known & (n_before < limit)
+        if not missing.any():
+            break
+        missing_slots = list(dict.fromkeys(slots[missing].tolist()))
+        if limit > 0:
+            # The models above the first missing one are selected, and each resolved model
+            # fills at most one of the remaining places, so lower ones may not be needed.
+            n_found = int(n_before[np.argmax(missing)])
+            missing_slots = missing_slots[: limit - n_found]
+        for slot in missing_slots:
+            join.set(slot, resolve(join.model_ids[slot]))
+
+    selected = in_range if limit <= 0 else in_range & (n_before < limit)
+    return sizes[selected], downloads[selected]
+
+
+def size_stats(sizes, downloads, percentiles=(10, 50, 90)):
+    """The max/mean/min, percentiles, and download-weighted mean of the sizes, or None if
+    there is no size."""
+    if len(sizes) == 0:
+        return None
+    weights = np.asarray(downloads, dtype=np.float64)
+    stats = {
+        "n_models": int(len(sizes)),
+        "max": float(sizes.max()),
+        "mean": float(sizes.mean()),
+        "min": float(sizes.min()),
+        "weighted_mean": float(
+            np.average(sizes, weights=weights) if weights.sum() > 0 else sizes.mean()
+        ),
+    }
+    for percentile, value in zip(percentiles, np.percentile(sizes, percentiles).tolist()):
+        stats[f"p{percentile:g}"] = value
+    return stats
+
+
+class SizeStatsCache:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.stats = {}
+        self.dirty = False
+        if os.path.exists(file_name):
+            with open(file_name, "r") as filep:
+                self.stats = json.load(filep)
+
+    @staticmethod
+    def key(limit, min_size, max_size, percentiles):
+        return json.dumps([limit, min_size, max_size, list(percentiles)])
+
+    def get(self, key, date):
+        """The cached stats of the date, which are None if the date has no model in the
+        size range. Raise KeyError if the date is not cached."""
+        return self.stats[key][date]
+
+    def put(self, key, date, stats):
+        self.stats.setdefault(key, {})[date] = stats
+        self.dirty = True
+
+    def invalidate(self, date):
+        """Drop the stats of the date, e.g., when the records of the date are updated."""
+        for stats in self.stats.values():
+            if date in stats:
+                del stats[date]
+                self.dirty = True
+        self.persist()
+
+    def clear(self):
+        self.dirty = self.dirty or bool(self.stats)
+        self.stats = {}
+
+    def persist(self):
+        if not self.dirty:
+            return
+        with open(self.file_name + ".tmp", "w") as filep:
+            json.dump(self.stats, filep)
+        os.replace(self.file_name + ".tmp", self.file_name)
+        self.dirty = False
+
+
+def open_size_stats(download_db_path):
+    return SizeStatsCache(download_db_path.rstrip("/") + ".size_stats.json")
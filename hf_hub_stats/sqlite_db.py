@@ -0,0 +1,365 @@
+"""SQLite storage backend of the model size DB and the download trend DB.
+
+Both DBs can live in one SQLite file with the tables:
+
+    sizes(model_id, size, code, memo, failed_at, error_class, n_failures, config_hash,
+          retry_after)
+    downloads(date, pos, model_id, downloads)
+    dates(date)
+
+``downloads`` is indexed on (date, downloads) for ranking and on model_id for point lookups,
+so commands only read the rows they need instead of parsing whole JSON files, and
+size-filtered top-N queries are a join of the two tables.
+"""
+from collections.abc import MutableMapping
+from dataclasses import fields
+from typing import List
+import datetime
+import sqlite3
+import time
+
+from . import profiling
+from .download_db import DATE_FORMAT, ModelNDownload, open_download_db
+from .size_db import ARCH_CACHE_ENTRIES, ARCH_SIZE_CACHE, CalcModelSizeResult, SizeDB
+
+SQLITE_EXTS = (".sqlite", ".db")
+
+# The number of ranked records joined with sizes at a time in select_top.
+PAGE_SIZE = 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sizes (
+    model_id TEXT PRIMARY KEY,
+    size REAL NOT NULL,
+    code INTEGER NOT NULL,
+    memo TEXT,
+    failed_at REAL,
+    error_class TEXT,
+    n_failures INTEGER NOT NULL DEFAULT 0,
+    config_hash TEXT,
+    retry_after REAL
+);
+CREATE TABLE IF NOT EXISTS downloads (
+    date TEXT NOT NULL,
+    pos INTEGER NOT NULL,
+    model_id TEXT NOT NULL,
+    downloads INTEGER NOT NULL,
+    PRIMARY KEY (date, pos)
+);
+CREATE INDEX IF NOT EXISTS downloads_rank ON downloads (date, downloads DESC, pos);
+CREATE INDEX IF NOT EXISTS downloads_model ON downloads (model_id, date);
+CREATE TABLE IF NOT EXISTS dates (date TEXT PRIMARY KEY);
+"""
+
+SIZE_FIELDS = [field.name for field in fields(CalcModelSizeResult)]
+SIZE_COLUMNS = ", ".join(SIZE_FIELDS)
+
+
+def is_sqlite_file(file_name):
+    return file_name.endswith(SQLITE_EXTS)
+
+
+def connect(file_name, fsync=False):
+    conn = sqlite3.connect(file_name)
+    # WAL lets the size DB and the download DB in the same file read while the other writes.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _row_to_result(row):
+    return CalcModelSizeResult(**dict(zip(SIZE_FIELDS, row)))
+
+
+class SizeTable(MutableMapping):
+    """A dict-like view of the sizes table, from model IDs to CalcModelSizeResult."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __getitem__(self, model_id):
+        row = self.conn.execute(
+            f"SELECT {SIZE_COLUMNS} FROM sizes WHERE model_id = ?", (model_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(model_id)
+        return _row_to_result(row)
+
+    def __setitem__(self, model_id, result):
+        values = [getattr(result, name) for name in SIZE_FIELDS]
+        # Persist the retry time of failures so that queries can filter them in SQL.
+        values.append(None if result.valid else result.retry_after)
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO sizes ({SIZE_COLUMNS}, retry_after) "
+            f"VALUES ({', '.join('?' * len(values))})",
+            values,
+        )
+
+    def __delitem__(self, model_id):
+        if self.conn.execute("DELETE FROM sizes WHERE model_id = ?", (model_id,)).rowcount == 0:
+            raise KeyError(model_id)
+
+    def __contains__(self, model_id):
+        row = self.conn.execute("SELECT 1 FROM sizes WHERE model_id = ?", (model_id,))
+        return row.fetchone() is not None
+
+    def __iter__(self):
+        return (row[0] for row in self.conn.execute("SELECT model_id FROM sizes").fetchall())
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM sizes").fetchone()[0]
+
+    def items(self):
+        rows = self.conn.execute(f"SELECT {SIZE_COLUMNS} FROM sizes").fetchall()
+        return [(row[0], _row_to_result(row)) for row in rows]
+
+    def values(self):
+        return [result for _, result in self.items()]
+
+
+class SQLiteSizeDB(SizeDB):
+    """The model size DB in a SQLite file. Results are written to the file as they come,
+    and persist() commits them."""
+
+    def _load(self):
+        self.conn = connect(self.file_name, self.fsync)
+        db = SizeTable(self.conn)
+
+        # Warm up the architecture cache with the most recent architectures.
+        rows = self.conn.execute(
+            "SELECT config_hash, size FROM sizes WHERE code = 0 AND config_hash IS NOT NULL "
+            "ORDER BY rowid DESC LIMIT ?",
+            (ARCH_CACHE_ENTRIES,),
+        ).fetchall()
+        for key, size in reversed(rows):
+            ARCH_SIZE_CACHE.put(key, size)
+        print(f"{len(db)} record in the model size DB", flush=True)
+        return db
+
+    def persist(self):
+        if self.dirty:
+            print(f"Updating database with total {len(self.db)} records", flush=True)
+            with profiling.phase("size_db.persist"):
+                self.conn.commit()
+            self.dirty = False
+        self._close_journal()
+
+    def remove_errors(self):
+        removed = self.conn.execute("DELETE FROM sizes WHERE code NOT IN (0, 3)").rowcount
+        print(f"Removed {removed} models with errors", flush=True)
+        self.dirty = self.dirty or removed > 0
+
+
+class SQLiteDownloadTrendDB:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.conn = connect(file_name)
+        # Dates in the order they were added, which is kept as an ordered set.
+        self.date_set = dict.fromkeys(
+            row[0] for row in self.conn.execute("SELECT date FROM dates ORDER BY rowid")
+        )
+        print(f"{len(self.date_set)} records in the download trend DB", flush=True)
+
+    def __getitem__(self, key):
+        if key not in self.date_set:
+            raise KeyError(key)
+        rows = self.conn.execute(
+            "SELECT model_id, downloads FROM downloads WHERE date = ? ORDER BY pos", (key,)
+        )
+        return [ModelNDownload(model_id, download) for model_id, download in rows]
+
+    def __setitem__(self, key, val):
+        self.conn.execute("DELETE FROM downloads WHERE date = ?", (key,))
+        self._insert(key, 0, val)
+
+    def __contains__(self, key):
+        return key in self.date_set
+
+    def __len__(self):
+        return len(self.date_set)
+
+    def _insert(self, date, start_pos, records):
+        self.conn.executemany(
+            "INSERT INTO downloads (date, pos, model_id, downloads) VALUES (?, ?, ?, ?)",
+            (
+                (date, start_pos + idx, record.model_id, record.download)
+                for idx, record in enumerate(records)
+            ),
+        )
+        self.conn.execute("INSERT OR IGNORE INTO dates (date) VALUES (?)", (date,))
+        self.date_set[date] = None
+
+    def latest(self) -> str:
+        return self[self.dates(sort=True)[-1]]
+
+    def dates(self, sort=False) -> List[str]:
+        ret = [datetime.datetime.strptime(d, DATE_FORMAT) for d in self.date_set]
+        ret = sorted(ret) if sort else ret
+        return [r.strftime(DATE_FORMAT) for r in ret]
+
+    def count(self, date):
+        """The number of records of the date."""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM downloads WHERE date = ?", (date,)
+        ).fetchone()[0]
+
+    def date_signature(self, date):
+        """The signature of the records of the date, which changes when they are rewritten."""
+        row = self.conn.execute(
+            "SELECT COUNT(*), TOTAL(downloads), TOTAL(pos * downloads) FROM downloads "
+            "WHERE date = ?",
+            (date,),
+        ).fetchone()
+        return ":".join(str(val) for val in row)
+
+    def find(self, date, model_ids):
+        """The records of the given model IDs at the date, in the record order."""
+        if date not in self.date_set:
+            raise KeyError(date)
+        model_ids = list(model_ids)
+        rows = self.conn.execute(
+            "SELECT model_id, downloads FROM downloads "
+            f"WHERE date = ? AND model_id IN ({', '.join('?' * len(model_ids))}) ORDER BY pos",
+            [date] + model_ids,
+        )
+        return [ModelNDownload(model_id, download) for model_id, download in rows]
+
+    def select_top(
+        self,
+        date,
+        resolve,
+        start=0,
+        end=float("inf"),
+        limit=20,
+        min_size=0,
+        max_size=float("inf"),
+        include_unsupported=False,
+        prefetch=None,
+    ):
+        """The same as Snapshot.select_top, but the ranking and size filtering are done by
+        joining the sizes table in the same file, which must be committed. Models in the
+        rank window without cached sizes are resolved with `resolve(model_id)` in the rank
+        order until the limit is met, and `prefetch(model_ids)` is called with them in the
+        rank order of each page before they are resolved.
+
+        Return a list of (model ID, downloads, size result or None if sizes are not checked).
+        """
+        if date not in self.date_set:
+            raise KeyError(date)
+        ranked = (
+            "SELECT model_id, downloads, pos FROM downloads WHERE date = ? "
+            "ORDER BY downloads DESC, pos LIMIT ? OFFSET ?"
+        )
+        if min_size == 0 and max_size == float("inf"):
+            # Note that a limit of 0 means no limit, and a negative SQLite limit is unlimited.
+            stop = end if limit <= 0 else min(end, start + limit)
+            n_rows = -1 if stop == float("inf") else max(int(stop) - start, 0)
+            rows = self.conn.execute(ranked, (date, n_rows, start))
+            return [(model_id, download, None) for model_id, download, _ in rows]
+
+        # Records with valid sizes in the range, failures to include or retry, and misses.
+        query = (
+            f"SELECT d.model_id, d.downloads, {', '.join('s.' + f for f in SIZE_FIELDS)} "
+            f"FROM ({ranked}) AS d LEFT JOIN sizes AS s ON s.model_id = d.model_id "
+            "WHERE s.model_id IS NULL "
+            "OR (s.code IN (0, 3) AND s.size BETWEEN ? AND ?) "
+            "OR (s.code NOT IN (0, 3) AND (? OR s.retry_after <= ?)) "
+            "ORDER BY d.downloads DESC, d.pos"
+        )
+        end = min(end, self.count(date))
+        now = time.time()
+        selected = []
+        resolved = {}
+        n_in_range = 0
+        offset = start
+        while offset < end and (limit <= 0 or n_in_range < limit):
+            n_rows = int(min(PAGE_SIZE, end - offset))
+            params = (date, n_rows, offset, min_size, max_size, include_unsupported, now)
+            page = []
+            for row in self.conn.execute(query, params).fetchall():
+                model_id, download = row[:2]
+                if model_id in resolved:
+                    result = resolved[model_id]
+                elif row[2] is None:
+                    result = None
+                else:
+                    result = _row_to_result(row[2:])
+                    if not result.valid and result.retry_after <= now:
+                        # The failure should be retried.
+                        result = None
+                page.append((model_id, download, result))
+            if prefetch is not None:
+                prefetch([model_id for model_id, _, result in page if result is None])
+
+            for model_id, download, result in page:
+                if result is None and model_id in resolved:
+                    # The same model appears more than once in the page.
+                    result = resolved[model_id]
+                if result is None:
+                    result = resolved[model_id] = resolve(model_id)
+
+                if result.valid and min_size <= result.size <= max_size:
+                    selected.append((model_id, download, result))
+                    n_in_range += 1
+                    if limit > 0 and n_in_range >= limit:
+                        break
+                elif not result.valid and include_unsupported:
+                    selected.append((model_id, download, result))
+            offset += n_rows
+        return selected
+
+    def persist(self):
+        print(f"Updating database with total {len(self.date_set)} records", flush=True)
+        with profiling.phase("download_db.persist"):
+            self.conn.commit()
+
+    def compact(self):
+        print("Vacuuming the SQLite DB", flush=True)
+        self.conn.commit()
+        self.conn.execute("VACUUM")
+
+    def update(self, all_models, args, append_only=False):
+        # Rows are inserted in place in this backend no matter whether append_only is set.
+        today = datetime.datetime.today().strftime(DATE_FORMAT)
+        records = []
+        for model in all_models[args.start : min(args.end, len(all_models))]:
+            if not hasattr(model, "downloads"):
+                continue
+            records.append(ModelNDownload(model.modelId, model.downloads))
+        self._insert(today, self.count(today), records)
+
+        self.persist()
+        return today
+
+    def prune(self, max_records=10):
+        dates = self.dates(sort=True)
+        if max_records >= len(dates):
+            print(f"Skip pruning because {max_records} >= {len(dates)}", flush=True)
+            return
+        tbd = len(dates) - max_records
+        for date in dates[:tbd]:
+            self.conn.execute("DELETE FROM downloads WHERE date = ?", (date,))
+            self.conn.execute("DELETE FROM dates WHERE date = ?", (date,))
+            self.date_set.pop(date, None)
+        self.persist()
+
+
+def migrate_to_sqlite(dst, size_db=None, download_db=None):
+    """Copy the JSON model size DB and/or the download trend DB (of any backend) into the
+    SQLite file dst."""
+    if size_db is not None:
+        src_db = SizeDB(size_db)
+        dst_db = SQLiteSizeDB(dst)
+        for model_id, result in src_db.db.items():
+            # Copy results as they are, including the failure times for the retry policy.
+            dst_db.db[model_id] = result
+        dst_db.dirty = True
+        dst_db.persist()
+
+    if download_db is not None:
+        src_db = open_download_db(download_db)
+        dst_db = SQLiteDownloadTrendDB(dst)
+        for date in src_db.dates(sort=True):
+            dst_db[date] = src_db[date]
+        dst_db.persist()
@@ -1,4 +1,28 @@
 """Utilities"""
+from dataclasses import dataclass, fields
+import hashlib
+import os
+
+import json
+
+from . import profiling
+
+# The maximum number of dates labeled on the x-axis of rank charts.
+MAX_DATE_TICKS = 40
+
+
+def slotted_dataclass(cls):
+    """Make a dataclass with __slots__ instead of per-instance __dict__, which is the same as
+    @dataclass(slots=True) of Python 3.10+. Field defaults are kept in the generated __init__.
+    """
+    cls = dataclass(cls)
+    names = tuple(field.name for field in fields(cls))
+    cls_dict = dict(cls.__dict__)
+    cls_dict["__slots__"] = names
+    for name in names + ("__dict__", "__weakref__"):
+        # Slots conflict with class attributes of the same names.
+        cls_dict.pop(name, None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
 
 
 def print_model_in_md(models):
@@ -19,6 +43,33 @@ def print_model_in_md(models):
     print(tabulate(data, headers=["Rank", "Name", "Downloads", "Size"]))
 
 
+def print_growth_in_md(movers):
+    from tabulate import tabulate
+
+    data = []
+    for rank, (model_id, date, download, prev, change, growth) in enumerate(movers):
+        growth = "N/A" if growth != growth else "{:+.1f}%".format(growth * 100)
+        data.append((rank + 1, model_id, date, download, prev, "{:+d}".format(change), growth))
+
+    print(tabulate(data, headers=["Rank", "Name", "Date", "Downloads", "Prev", "Change", "Growth"]))
+
+
+def print_size_stats_in_md(data):
+    from tabulate import tabulate
+
+    headers = ["Date", "Models", "Max", "Mean", "Weighted Mean", "Min"]
+    rows = []
+    for date, stats in data.items():
+        percentiles = [key for key in stats if key.startswith("p")]
+        if not rows:
+            headers += [key.upper() for key in percentiles]
+        row = [date, stats["n_models"], stats["max"], stats["mean"], stats["weighted_mean"]]
+        row += [stats["min"]] + [stats[key] for key in percentiles]
+        rows.append(row)
+
+    print(tabulate(rows, headers=headers, floatfmt=".3f"))
+
+
 def draw_rank_chart(
     df,
     file_name="rank_chart.pdf",
@@ -31,6 +82,8 @@ def draw_rank_chart(
     scatter_args={},
 ):
     import matplotlib.pyplot as plt
+    import numpy as np
+    from matplotlib.collections import LineCollection
 
     plt.figure(figsize=(15, 5))
 
@@ -52,34 +105,58 @@ def draw_rank_chart(
         )
         axes.append(far_right_yaxis)
 
-    for col in df.columns:
-        y = df[col].mask(df[col] > ylim, None)
-        x = df.index.values
-
-        # Plotting blank points on the right axis/axes
-        # so that they line up with the left axis.
-        for axis in axes[1:]:
-            axis.plot(x, y, alpha=0)
+    # Dates are drawn at numeric x positions and labeled by ticks.
+    x = np.arange(len(df.index), dtype=np.float64)
+    values = np.array(df.to_numpy(dtype=np.float64, na_value=np.nan)).T
+    values[~(values <= ylim)] = np.nan
 
-        left_yaxis.plot(x, y, **line_args, solid_capstyle="round")
+    # Draw all lines of a chart as one collection. A line is split at missing ranks.
+    colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    segments = []
+    segment_colors = []
+    for col, y in enumerate(values):
+        valid = ~np.isnan(y)
+        # The runs of consecutive valid points.
+        bounds = np.diff(np.concatenate([[0], valid.astype(np.int8), [0]]))
+        for start, end in zip(np.nonzero(bounds == 1)[0], np.nonzero(bounds == -1)[0]):
+            segments.append(np.column_stack([x[start:end], y[start:end]]))
+            segment_colors.append(colors[col % len(colors)])
+    line_args = dict(line_args)
+    if "linewidth" in line_args:
+        line_args["linewidths"] = line_args.pop("linewidth")
+    left_yaxis.add_collection(
+        LineCollection(segments, colors=segment_colors, capstyle="round", **line_args)
+    )
 
-        # Adding scatter plots
-        if scatter:
-            left_yaxis.scatter(x, y, **scatter_args)
+    # Adding scatter plots
+    if scatter:
+        xs = np.tile(x, len(values))
+        point_colors = np.repeat(np.arange(len(values)) % len(colors), len(x))
+        ys = values.ravel()
+        valid = ~np.isnan(ys)
+        left_yaxis.scatter(
+            xs[valid], ys[valid], c=[colors[c] for c in point_colors[valid]], **scatter_args
+        )
 
     # Number of lines
     lines = len(df.columns)
 
     y_ticks = [*range(1, lines + 1)]
 
-    # Configuring the axes so that they line up well.
+    # Configuring the axes so that they line up well. Axes share the x-axis and are given
+    # the same y range explicitly, so no blank points have to be drawn on the right axes.
+    if ylim != float("inf"):
+        bottom = lines + 0.5
+    else:
+        bottom = max(lines, np.nanmax(values, initial=0)) + 0.5
     for axis in axes:
-        axis.invert_yaxis()
         axis.set_yticks(y_ticks)
-        if ylim != float("inf"):
-            axis.set_ylim((lines + 0.5, 0.5))
-        else:
-            axis.set_ylim((ylim + 0.5, 0.5))
+        axis.set_ylim((bottom, 0.5))
+    left_yaxis.set_xlim((x[0] - 0.5, x[-1] + 0.5) if len(x) else (-0.5, 0.5))
+    # Label every n-th date of long histories, since tick labels dominate the rendering time.
+    stride = max(1, -(-len(x) // MAX_DATE_TICKS))
+    left_yaxis.set_xticks(x[::stride])
+    left_yaxis.set_xticklabels(df.index[::stride])
 
     # Sorting the labels to match the ranks.
     # left_labels = df.iloc[0].sort_values().index
@@ -100,6 +177,7 @@ def draw_rank_chart(
         plt.show()
     else:
         plt.savefig(file_name, bbox_inches="tight")
+        plt.close()
 
 
 def draw_trend_chart(
@@ -140,3 +218,56 @@ def draw_trend_chart(
         plt.show()
     else:
         plt.savefig(file_name, bbox_inches="tight")
+
+
+def chart_digest(df, **kwargs):
+    """The hash of the data and the drawing arguments of a chart."""
+    content = {
+        "index": [str(idx) for idx in df.index],
+        "columns": [str(col) for col in df.columns],
+        "values": df.astype(float).to_numpy().tolist(),
+        "kwargs": kwargs,
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _render_chart(draw, df, file_name, digest, kwargs):
+    with profiling.phase("render"):
+        draw(df, file_name=file_name, **kwargs)
+    # Write the hash after the chart, so an interrupted render is redone.
+    with open(file_name + ".hash", "w") as filep:
+        filep.write(digest)
+    return file_name
+
+
+def render_charts(draw, charts, workers=1, force=False, **kwargs):
+    """Render charts of (df, file_name) with draw(df, file_name=file_name, **kwargs).
+
+    The hash of the data of each chart is kept in a sidecar file (<file_name>.hash), and
+    charts whose hashes are unchanged since the last render are skipped unless `force`.
+    Charts are rendered in a process pool if workers > 1.
+    """
+    jobs = []
+    for df, file_name in charts:
+        digest = chart_digest(df, **kwargs)
+        if not force and os.path.exists(file_name) and os.path.exists(file_name + ".hash"):
+            with open(file_name + ".hash", "r") as filep:
+                if filep.read() == digest:
+                    print(f"Skip rendering {file_name} because the data is unchanged", flush=True)
+                    continue
+        jobs.append((df, file_name, digest))
+
+    if workers <= 1 or len(jobs) <= 1:
+        for df, file_name, digest in jobs:
+            print(f"Rendered {_render_chart(draw, df, file_name, digest, kwargs)}", flush=True)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+        futures = [
+            pool.submit(_render_chart, draw, df, file_name, digest, kwargs)
+            for df, file_name, digest in jobs
+        ]
+        for future in futures:
+            print(f"Rendered {future.result()}", flush=True)
@@ -0,0 +1,131 @@
+"""Estimate model size from the metadata of weight files without downloading weights.
+
+A safetensors file starts with an 8-byte little-endian header length followed by a JSON
+header of tensor dtypes and shapes, so the parameter number can be derived by reading
+only the header with HTTP range requests. Sharded checkpoints are described by index files
+(``model.safetensors.index.json`` or ``pytorch_model.bin.index.json``).
+"""
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import os
+
+import json
+
+# The bytes of each element in torch dtypes, used when only the total size is known.
+DTYPE_BYTES = {
+    "float32": 4,
+    "float16": 2,
+    "bfloat16": 2,
+    "float64": 8,
+    "int8": 1,
+}
+
+# A sanity bound of safetensors header size.
+MAX_HEADER_BYTES = 100 * 1024 * 1024
+
+
+class WeightFileReader:
+    """Read byte ranges of files in a model repo. If root is given, the files are read from
+    a local directory with the same layout as the model repo (e.g., for testing).
+    Otherwise they are read from the Hub with HTTP range requests.
+    """
+
+    def __init__(self, model_id, root=None, revision="main", timeout=30):
+        self.model_id = model_id
+        self.root = root
+        self.revision = revision
+        self.timeout = timeout
+
+    def read(self, filename, start=0, length=None):
+        """Read length bytes from start of the file, or the whole file if length is None.
+        Return None if the file does not exist.
+        """
+        if self.root is not None:
+            path = os.path.join(self.root, filename)
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as filep:
+                filep.seek(start)
+                return filep.read(-1 if length is None else length)
+
+        endpoint = os.environ.get("HF_ENDPOINT", "https://huggingface.co")
+        url = f"{endpoint}/{self.model_id}/resolve/{self.revision}/{filename}"
+        headers = {}
+        if length is not None:
+            headers["Range"] = f"bytes={start}-{start + length - 1}"
+        if os.environ.get("HF_TOKEN"):
+            headers["Authorization"] = f"Bearer {os.environ['HF_TOKEN']}"
+        try:
+            with urlopen(Request(url, headers=headers), timeout=self.timeout) as resp:
+                if length is None:
+                    return resp.read()
+                if resp.status == 200:
+                    # The range is ignored by the server, so skip to start without
+                    # reading the rest of the file.
+                    resp.read(start)
+                return resp.read(length)
+        except HTTPError as err:
+            if err.code in (401, 403, 404):
+                return None
+            raise
+
+    def read_json(self, filename):
+        data = self.read(filename)
+        return None if data is None else json.loads(data)
+
+
+def read_safetensors_header(reader, filename):
+    """Read the JSON header of a safetensors file. Return None if the file does not exist."""
+    data = reader.read(filename, 0, 8)
+    if data is None:
+        return None
+    if len(data) != 8:
+        raise ValueError(f"{filename} is not a valid safetensors file")
+    header_len = int.from_bytes(data, "little")
+    if header_len > MAX_HEADER_BYTES:
+        raise ValueError(f"{filename} has an invalid header length {header_len}")
+    return json.loads(reader.read(filename, 8, header_len))
+
+
+def count_params_in_safetensors_header(header):
+    n_params = 0
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        numel = 1
+        for dim in info["shape"]:
+            numel *= dim
+        n_params += numel
+    return n_params
+
+
+def count_params_from_weight_headers(reader):
+    """Count the parameters of a model from its weight file metadata.
+    Return (the number of parameters, the file used), or (None, None) if unavailable.
+    """
+    # Sharded safetensors checkpoint: read the header of each shard.
+    index = reader.read_json("model.safetensors.index.json")
+    if index is not None:
+        shards = sorted(set(index["weight_map"].values()))
+        n_params = 0
+        for shard in shards:
+            header = read_safetensors_header(reader, shard)
+            if header is None:
+                return None, None
+            n_params += count_params_in_safetensors_header(header)
+        return n_params, "model.safetensors.index.json"
+
+    # Single safetensors file.
+    header = read_safetensors_header(reader, "model.safetensors")
+    if header is not None:
+        return count_params_in_safetensors_header(header), "model.safetensors"
+
+    # Sharded PyTorch checkpoint: the index only has the total size in bytes,
+    # so we derive the parameter number with the dtype in the config.
+    index = reader.read_json("pytorch_model.bin.index.json")
+    if index is not None and "total_size" in index.get("metadata", {}):
+        cfg = reader.read_json("config.json") or {}
+        dtype_bytes = DTYPE_BYTES.get(cfg.get("torch_dtype"), DTYPE_BYTES["float32"])
+        return index["metadata"]["total_size"] // dtype_bytes, "pytorch_model.bin.index.json"
+
+    return None, None
@@ -0,0 +1,140 @@
+"""The config store and the bulk config prefetcher against a local stand-in of the Hub."""
+import argparse
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from hf_hub_stats import config_store as config_store_module
+from hf_hub_stats import query_db
+from hf_hub_stats.config_store import ConfigStore, TokenBucket, prefetch_configs
+from hf_hub_stats.download_db import DownloadTrendDB, ModelNDownload
+from hf_hub_stats.size_db import CalcModelSizeResult
+
+CONFIG = b'{"model_type": "bert"}'
+
+
+class HubHandler(BaseHTTPRequestHandler):
+    """Answer config requests with the scripted statuses of each model, then 200."""
+
+    def do_GET(self):
+        model_id = self.path[1:].split("/resolve/")[0]
+        self.server.requests.append(model_id)
+        statuses = self.server.statuses.get(model_id, [])
+        status = statuses.pop(0) if statuses else 200
+        body = CONFIG if status == 200 else b"error"
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), HubHandler)
+    httpd.requests = []
+    httpd.statuses = {}
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setenv("HF_ENDPOINT", f"http://127.0.0.1:{httpd.server_port}")
+    monkeypatch.delenv("HF_TOKEN", raising=False)
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_store_dedups_identical_configs(tmp_path):
+    store = ConfigStore(str(tmp_path))
+    assert store.put("org/a", CONFIG) == store.put("org/b", CONFIG)
+    assert os.listdir(tmp_path / "objects") == [f"{store.put('org/a', CONFIG)}.json"]
+    assert "org/a" in store and "org/b" in store and "org/c" not in store
+    assert store.get("org/b") == {"model_type": "bert"}
+    assert store.get("org/c") is None
+
+
+def test_retries_rate_limits_and_server_errors(tmp_path, hub):
+    hub.statuses = {"org/limited": [429, 429], "org/flaky": [503, 500], "org/missing": [404]}
+    store = ConfigStore(str(tmp_path))
+    model_ids = ["org/limited", "org/flaky", "org/missing", "org/ok"]
+    stats = prefetch_configs(model_ids, store, concurrency=4, rate=100, backoff=0.01)
+    assert stats == {"fetched": 3, "missing": 1, "failed": 0}
+    assert hub.requests.count("org/limited") == 3
+    assert hub.requests.count("org/flaky") == 3
+    assert hub.requests.count("org/missing") == 1
+    assert store.get("org/flaky") == {"model_type": "bert"}
+    assert "org/missing" not in store
+
+
+def test_gives_up_after_retries(tmp_path, hub):
+    hub.statuses = {"org/down": [502] * 10}
+    store = ConfigStore(str(tmp_path))
+    stats = prefetch_configs(["org/down"], store, rate=100, retries=2, backoff=0.01)
+    assert stats == {"fetched": 0, "missing": 0, "failed": 1}
+    assert hub.requests.count("org/down") == 3
+
+
+def test_skips_stored_configs(tmp_path, hub):
+    store = ConfigStore(str(tmp_path))
+    store.put("org/a", CONFIG)
+    stats = prefetch_configs(["org/a", "org/b", "org/b"], store, rate=100)
+    assert stats["fetched"] == 1
+    assert hub.requests == ["org/b"]
+
+
+def test_token_bucket_rate():
+    bucket = TokenBucket(rate=20, capacity=1)
+    start = time.monotonic()
+    threads = [threading.Thread(target=bucket.acquire) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The first request takes the initial token, and the next 5 wait 1/20 seconds each.
+    assert time.monotonic() - start >= 5 / 20 * 0.9
+
+
+def test_query_top_fetches_configs_of_resolved_models(tmp_path, monkeypatch):
+    download_db = DownloadTrendDB(str(tmp_path / "download_db.json"))
+    download_db["01-01-23"] = [ModelNDownload(f"org/m{i}", 100 - i) for i in range(10)]
+    download_db.persist()
+
+    batches = []
+
+    def prefetch(model_ids, store, concurrency, rate):
+        batches.append(list(model_ids))
+        for model_id in model_ids:
+            store.put(model_id, CONFIG)
+
+    def estimate(model_id, fallback=True, config_store=None):
+        assert model_id in config_store
+        return CalcModelSizeResult(model_id, 1, 0)
+
+    monkeypatch.setattr(config_store_module, "prefetch_configs", prefetch)
+    monkeypatch.setattr(query_db, "get_model_size_in_b_with_empty_weights", estimate)
+    args = argparse.Namespace(
+        size_db=str(tmp_path / "size_db.json"),
+        download_db=str(tmp_path / "download_db.json"),
+        date=None,
+        start=0,
+        end=float("inf"),
+        limit=3,
+        min_size=0.5,
+        max_size=2,
+        include_unsupported=False,
+        lookahead=0,
+        config_store=str(tmp_path / "configs"),
+        fetch_concurrency=2,
+        fetch_rate=10,
+        pretty=False,
+    )
+    models = query_db.query_top_models(args)
+    assert [model.model_id for model in models] == ["org/m0", "org/m1", "org/m2"]
+    assert batches == [["org/m0", "org/m1"], ["org/m2", "org/m3"]]
@@ -0,0 +1,126 @@
+"""Persisting the delta-encoded download trend DB."""
+import json
+import os
+
+import pytest
+
+from hf_hub_stats import query_db
+from hf_hub_stats.delta_db import DeltaDownloadTrendDB
+from hf_hub_stats.download_db import (
+    DownloadTrendDB,
+    ModelNDownload,
+    convert_download_db,
+    open_download_db,
+)
+
+DATES = ["01-01-23", "01-02-23", "01-03-23"]
+
+
+def _records(download_db, date):
+    return [(r.model_id, r.download) for r in download_db[date]]
+
+
+def _make_db(path):
+    download_db = DeltaDownloadTrendDB(path)
+    for n, date in enumerate(DATES):
+        download_db[date] = [ModelNDownload("a", 10 + n), ModelNDownload("b", 5)]
+    download_db.persist()
+    return download_db
+
+
+def test_interrupted_reencode_keeps_the_previous_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.delta")
+    download_db = _make_db(path)
+    expected = {date: _records(download_db, date) for date in DATES}
+
+    # Rewriting the first date re-encodes all dates, and the update stops after the first.
+    download_db[DATES[0]] = [ModelNDownload("a", 1), ModelNDownload("c", 7)]
+    replace = os.replace
+    n_written = []
+
+    def crash(src, dst):
+        if dst.endswith(".bin"):
+            n_written.append(dst)
+            if len(n_written) > 1:
+                raise KeyboardInterrupt
+        return replace(src, dst)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "replace", crash)
+        with pytest.raises(KeyboardInterrupt):
+            download_db.persist()
+
+    download_db = DeltaDownloadTrendDB(path)
+    assert {date: _records(download_db, date) for date in DATES} == expected
+
+    # The next update removes the files left by the interrupted one.
+    download_db[DATES[0]] = [ModelNDownload("a", 1), ModelNDownload("c", 7)]
+    download_db.persist()
+    download_db = DeltaDownloadTrendDB(path)
+    assert _records(download_db, DATES[0]) == [("a", 1), ("c", 7)]
+    assert _records(download_db, DATES[2]) == expected[DATES[2]]
+    assert sorted(f for f in os.listdir(path) if ".bin" in f) == sorted(download_db.files.values())
+
+
+def test_prune_removes_the_files_of_pruned_dates(tmp_path):
+    path = str(tmp_path / "db.delta")
+    download_db = _make_db(path)
+    download_db.prune(max_records=1)
+    assert sorted(f for f in os.listdir(path) if ".bin" in f) == [download_db.files[DATES[2]]]
+    assert DeltaDownloadTrendDB(path).dates() == DATES[2:]
+
+
+def test_date_index_without_files(tmp_path):
+    path = str(tmp_path / "db.delta")
+    download_db = _make_db(path)
+    expected = _records(download_db, DATES[1])
+
+    # The layout before generations.
+    date_index = os.path.join(path, "dates.json")
+    with open(date_index, "r") as filep:
+        entries = json.load(filep)
+    for date, _, file_name in entries:
+        os.rename(os.path.join(path, file_name), os.path.join(path, f"{date}.bin"))
+    with open(date_index, "w") as filep:
+        json.dump([entry[:2] for entry in entries], filep)
+
+    download_db = DeltaDownloadTrendDB(path)
+    assert _records(download_db, DATES[1]) == expected
+    download_db[DATES[1]] = [ModelNDownload("b", 3)]
+    download_db.persist()
+    download_db = DeltaDownloadTrendDB(path)
+    assert _records(download_db, DATES[1]) == [("b", 3)]
+    assert not os.path.exists(os.path.join(path, f"{DATES[1]}.bin"))
+
+
+def test_records_keep_their_order(tmp_path):
+    path = str(tmp_path / "db.json")
+    download_db = DownloadTrendDB(path)
+    model_ids = [f"org/m{i}" for i in range(20)]
+    # Records in the order of downloads, records with ties in the reverse order of models
+    # first seen, and records in no particular order.
+    download_db[DATES[0]] = [ModelNDownload(m, 100 - i) for i, m in enumerate(model_ids)]
+    download_db[DATES[1]] = [ModelNDownload(m, i // 5) for i, m in enumerate(model_ids)][::-1]
+    download_db[DATES[2]] = [ModelNDownload(m, i % 3) for i, m in enumerate(model_ids[::7])]
+    download_db.persist()
+    delta_path = str(tmp_path / "db.delta")
+    convert_download_db(path, delta_path)
+
+    delta_db = DeltaDownloadTrendDB(delta_path)
+    for date in DATES:
+        assert _records(delta_db, date) == _records(download_db, date)
+        results = query_db.query_model_download(model_ids[::-3], date, open_download_db(path))
+        delta_results = query_db.query_model_download(model_ids[::-3], date, delta_db)
+        assert [r.to_dict() for r in delta_results] == [r.to_dict() for r in results]
+    # Only dates out of the canonical order have order files.
+    assert [delta_db.order_files[date] is None for date in DATES] == [True, False, False]
+
+    # Re-encoding later dates keeps their order.
+    delta_db[DATES[0]] = [ModelNDownload(m, 50) for m in model_ids[::-2]]
+    delta_db.persist()
+    delta_db = DeltaDownloadTrendDB(delta_path)
+    for date in DATES[1:]:
+        assert _records(delta_db, date) == _records(download_db, date)
+    assert _records(delta_db, DATES[0]) == [(m, 50) for m in model_ids[::-2]]
+    files = set(delta_db.files.values()) | set(delta_db.order_files.values()) - {None}
+    assert set(os.listdir(delta_path)) - {"models.json", "dates.json"} == files
@@ -0,0 +1,89 @@
+"""The JSON download trend DB, its date index and segments."""
+import os
+
+import pytest
+
+from hf_hub_stats.download_db import DownloadTrendDB, ModelNDownload, convert_download_db
+
+DATE = "01-01-23"
+
+
+def test_unwritable_date_index(tmp_path):
+    path = str(tmp_path / "db.json")
+    download_db = DownloadTrendDB(path)
+    download_db[DATE] = [ModelNDownload("a", 2), ModelNDownload("b", 1)]
+
+    # The index cannot replace a directory.
+    (tmp_path / "db.json.index").mkdir()
+    download_db.persist()
+    assert not (tmp_path / "db.json.index.tmp").exists()
+
+    download_db = DownloadTrendDB(path)
+    assert [r.model_id for r in download_db[DATE]] == ["a", "b"]
+
+
+def _crash_on(monkeypatch, name, path):
+    # Stop the persist at the `os.<name>` of the path, as if the process was killed.
+    func = getattr(os, name)
+
+    def crash(src, *args):
+        if src == path or args and args[0] == path:
+            raise KeyboardInterrupt
+        return func(src, *args)
+
+    monkeypatch.setattr(os, name, crash)
+
+
+def _segment_db(tmp_path):
+    path = str(tmp_path / "db.json")
+    download_db = DownloadTrendDB(path)
+    download_db[DATE] = [ModelNDownload("a", 2)]
+    download_db.persist()
+    download_db.append_segment(DATE, [ModelNDownload("b", 1)])
+    return path, download_db
+
+
+def test_merged_segments_are_not_loaded_again(tmp_path, monkeypatch):
+    path, download_db = _segment_db(tmp_path)
+    with monkeypatch.context() as patch:
+        _crash_on(patch, "remove", download_db.segments[0])
+        with pytest.raises(KeyboardInterrupt):
+            download_db.compact()
+
+    download_db = DownloadTrendDB(path)
+    assert [r.model_id for r in download_db[DATE]] == ["a", "b"]
+    assert download_db.segments == []
+    assert not os.path.exists(download_db.merge_file)
+
+
+def test_segments_are_kept_if_the_db_file_is_not_replaced(tmp_path, monkeypatch):
+    path, download_db = _segment_db(tmp_path)
+    with monkeypatch.context() as patch:
+        _crash_on(patch, "replace", path)
+        with pytest.raises(KeyboardInterrupt):
+            download_db.compact()
+
+    download_db = DownloadTrendDB(path)
+    assert [r.model_id for r in download_db[DATE]] == ["a", "b"]
+    assert len(download_db.segments) == 1
+    assert not os.path.exists(download_db.merge_file)
+
+
+@pytest.mark.parametrize("via", [None, "db", "db.sqlite"])
+@pytest.mark.parametrize("pretty", [False, True])
+def test_conversion_keeps_the_file(tmp_path, via, pretty):
+    path = str(tmp_path / "src.json")
+    download_db = DownloadTrendDB(path, pretty=pretty)
+    # Dates out of the chronological order, e.g., a DB edited by hand.
+    for n, date in enumerate(["12-25-22", "01-01-23", "11-30-22"]):
+        download_db[date] = [ModelNDownload("a", 2 + n), ModelNDownload("b", 2 + n)]
+    download_db.persist()
+
+    src = path
+    if via is not None:
+        src = str(tmp_path / via)
+        convert_download_db(path, src)
+    dst = str(tmp_path / "dst.json")
+    convert_download_db(src, dst, pretty=pretty)
+    with open(path, "rb") as expected, open(dst, "rb") as filep:
+        assert filep.read() == expected.read()
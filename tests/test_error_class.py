@@ -0,0 +1,69 @@
+"""Classification of failed size estimations for the retry policy."""
+from types import SimpleNamespace
+
+from hf_hub_stats.size_db import CalcModelSizeResult, SizeDB, classify_error, failed_result
+
+
+class LocalEntryNotFoundError(Exception):
+    pass
+
+
+class HTTPError(OSError):
+    def __init__(self, msg, status_code):
+        super().__init__(msg)
+        self.response = SimpleNamespace(status_code=status_code)
+
+
+def raise_from(err, cause):
+    try:
+        try:
+            raise cause
+        except Exception as inner:
+            raise err from inner
+    except Exception as outer:
+        return outer
+
+
+def test_offline_error_is_transient():
+    # transformers raises an OSError from the connection error of huggingface_hub.
+    err = raise_from(
+        OSError("We couldn't connect to 'https://huggingface.co' to load this file"),
+        LocalEntryNotFoundError("Connection error, and we cannot find the requested files"),
+    )
+    assert failed_result("org/model", err).error_class == "transient"
+    assert failed_result("org/model", ConnectionResetError()).error_class == "transient"
+
+
+def test_http_status():
+    assert failed_result("m", HTTPError("Server Error", 503)).error_class == "transient"
+    assert failed_result("m", HTTPError("Too Many Requests", 429)).error_class == "transient"
+    assert failed_result("m", HTTPError("Not Found", 404)).error_class == "permanent"
+
+
+def test_memo_fallback():
+    def classify(memo):
+        return classify_error(CalcModelSizeResult("m", 0, 1, memo))
+
+    assert classify("503 Server Error: Service Unavailable for url") == "transient"
+    assert classify("Read TIMED OUT") == "transient"
+    assert classify("org/llama-500m does not appear to have a file named config.json") == (
+        "permanent"
+    )
+
+
+def test_size_db_keeps_error_class():
+    size_db = SizeDB(None)
+    size_db["m"] = failed_result("m", HTTPError("Server Error for org/model-404", 502))
+    assert size_db["m"].error_class == "transient"
+    assert size_db["m"].failed_at is not None
+
+
+def test_legacy_failure_is_not_retried_by_queries():
+    size_db = SizeDB(None)
+    size_db.db["legacy"] = CalcModelSizeResult("legacy", 0, 1, "Connection error")
+    assert size_db.lookup("legacy") is not None
+
+    retried = []
+    size_db._estimate = lambda model_ids, args: retried.extend(model_ids)
+    size_db.retry_failed(None)
+    assert retried == ["legacy"]
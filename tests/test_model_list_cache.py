@@ -0,0 +1,100 @@
+"""The versioned binary cache of the model list of the Hub."""
+import struct
+import sys
+import time
+import types
+
+import pytest
+
+from hf_hub_stats import model_list_cache
+from hf_hub_stats.model_list_cache import ModelListCache
+from hf_hub_stats.query_hub import MODEL_FILTERS, query_hf_hub
+
+MODEL_IDS = ["org/a", "org/b-ünïcode", "c"]
+DOWNLOADS = [2**40, 7, 0]
+
+
+def test_round_trip(tmp_path):
+    cache = ModelListCache(str(tmp_path))
+    cache.save(MODEL_FILTERS, MODEL_IDS, DOWNLOADS)
+    assert cache.load(MODEL_FILTERS, ttl_days=7) == (MODEL_IDS, DOWNLOADS)
+
+    header, _ = cache.read(cache.path(MODEL_FILTERS), with_models=False)
+    assert header["count"] == 3 and header["filters"] == MODEL_FILTERS
+
+    # Other filters have their own file.
+    assert cache.load({"library": "jax"}, ttl_days=7) is None
+
+    cache.save(MODEL_FILTERS, [], [])
+    assert cache.load(MODEL_FILTERS, ttl_days=7) == ([], [])
+
+
+def test_top_k(tmp_path):
+    cache = ModelListCache(str(tmp_path))
+    cache.save(MODEL_FILTERS, MODEL_IDS[:2], DOWNLOADS[:2], top_k=2)
+    assert cache.load(MODEL_FILTERS, ttl_days=7, top_k=1) == (MODEL_IDS[:1], DOWNLOADS[:1])
+    assert cache.load(MODEL_FILTERS, ttl_days=7, top_k=3) is None
+    assert cache.load(MODEL_FILTERS, ttl_days=7) is None
+
+
+def test_expired_cache(tmp_path, monkeypatch):
+    cache = ModelListCache(str(tmp_path))
+    cache.save(MODEL_FILTERS, MODEL_IDS, DOWNLOADS)
+    now = time.time()
+    monkeypatch.setattr(model_list_cache.time, "time", lambda: now + 8 * 86400)
+    assert cache.load(MODEL_FILTERS, ttl_days=7) is None
+    assert cache.load(MODEL_FILTERS, ttl_days=10) == (MODEL_IDS, DOWNLOADS)
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    """A stand-in of huggingface_hub, which lists the models and counts the listings."""
+    listings = []
+
+    class HfApi:
+        def list_models(self, filter=None):
+            listings.append(filter)
+            return [
+                types.SimpleNamespace(modelId=model_id, downloads=downloads)
+                for model_id, downloads in zip(MODEL_IDS, DOWNLOADS)
+            ]
+
+    module = types.SimpleNamespace(HfApi=HfApi, ModelFilter=lambda **kwargs: kwargs)
+    monkeypatch.setitem(sys.modules, "huggingface_hub", module)
+    return listings
+
+
+def _records(models):
+    return [(m.modelId, m.downloads) for m in models]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # A cache file of another schema version.
+        model_list_cache.MAGIC + struct.pack("<II", model_list_cache.SCHEMA_VERSION + 1, 2) + b"{}",
+        # A truncated cache file.
+        model_list_cache.MAGIC + struct.pack("<II", model_list_cache.SCHEMA_VERSION, 100) + b"{",
+        b"not a cache file",
+    ],
+)
+def test_incompatible_cache_is_rebuilt(tmp_path, hub, content):
+    cache = ModelListCache(str(tmp_path))
+    with open(cache.path(MODEL_FILTERS), "wb") as filep:
+        filep.write(content)
+
+    expected = sorted(zip(MODEL_IDS, DOWNLOADS), key=lambda m: -m[1])
+    assert _records(query_hf_hub(cache_dir=str(tmp_path))) == expected
+    assert len(hub) == 1
+
+    # The rebuilt cache is used next time.
+    assert _records(query_hf_hub(cache_dir=str(tmp_path))) == expected
+    assert len(hub) == 1
+
+
+def test_expired_cache_is_rebuilt(tmp_path, hub, monkeypatch):
+    query_hf_hub(7, cache_dir=str(tmp_path))
+    now = time.time()
+    monkeypatch.setattr(model_list_cache.time, "time", lambda: now + 8 * 86400)
+    query_hf_hub(7, cache_dir=str(tmp_path))
+    assert len(hub) == 2
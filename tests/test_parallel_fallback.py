@@ -0,0 +1,138 @@
+"""Memory budget of concurrent pretrained fallbacks in get_model_sizes_in_parallel."""
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from hf_hub_stats import size_db
+from hf_hub_stats.size_db import CalcModelSizeResult, FallbackBudget
+
+GB = 1e9
+
+
+def max_concurrency(footprints, budget):
+    """Schedule fallbacks of the footprints in order, finishing the earliest started job
+    whenever the next job cannot start, and return the max number of concurrent jobs."""
+    budget = FallbackBudget(budget)
+    running = []
+    max_running = 0
+    for footprint in footprints:
+        while not budget.can_start(footprint):
+            budget.finish(running.pop(0))
+        budget.start(footprint)
+        running.append(footprint)
+        max_running = max(max_running, len(budget))
+    while running:
+        budget.finish(running.pop(0))
+    assert len(budget) == 0 and budget.reserved == 0
+    return max_running
+
+
+def test_known_footprints_within_budget():
+    assert max_concurrency([10 * GB] * 3, 15 * GB) == 1
+    assert max_concurrency([5 * GB] * 6, 15 * GB) == 3
+
+
+def test_zero_budget_runs_alone():
+    assert max_concurrency([1 * GB] * 4, 0) == 1
+
+
+def test_unknown_footprint_runs_alone():
+    inf = float("inf")
+    assert max_concurrency([inf, 1 * GB, inf, 1 * GB, 1 * GB], 15 * GB) == 2
+    assert max_concurrency([inf] * 3, 15 * GB) == 1
+
+    # The reserved memory stays finite after unknown jobs finish.
+    budget = FallbackBudget(15 * GB)
+    budget.start(inf)
+    budget.finish(inf)
+    assert budget.reserved == 0
+    assert budget.can_start(10 * GB)
+    budget.start(10 * GB)
+    assert not budget.can_start(10 * GB)
+    assert not budget.can_start(inf)
+
+
+def _estimate_needs_fallback(model_id, config_store=None):
+    footprint = float("inf") if model_id.startswith("unknown") else 10 * GB
+    return CalcModelSizeResult(model_id, 0, 2), footprint
+
+
+def _pretrained(model_id):
+    # Record the running interval of the job.
+    start = time.time()
+    time.sleep(0.2)
+    with open(os.path.join(os.environ["FALLBACK_LOG_DIR"], model_id), "w") as filep:
+        filep.write(f"{start} {time.time()}")
+    return CalcModelSizeResult(model_id, 1, 0)
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork", reason="Workers must inherit the stubs"
+)
+@pytest.mark.parametrize("prefix", ["known", "unknown"])
+def test_parallel_fallbacks_within_budget(tmp_path, monkeypatch, prefix):
+    monkeypatch.setenv("FALLBACK_LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        size_db, "_get_size_with_empty_weights_and_footprint", _estimate_needs_fallback
+    )
+    monkeypatch.setattr(size_db, "_get_size", _pretrained)
+
+    model_ids = [f"{prefix}-{i}" for i in range(3)]
+    results = list(size_db.get_model_sizes_in_parallel(model_ids, 3, fallback_mem_gb=15))
+    assert sorted(r.model_id for r in results) == model_ids
+
+    intervals = []
+    for model_id in model_ids:
+        with open(tmp_path / model_id) as filep:
+            intervals.append(tuple(map(float, filep.read().split())))
+    max_running = max(sum(s <= start < e for s, e in intervals) for start, _ in intervals)
+    assert max_running == 1
+
+
+def _crash_or_sleep(model_id):
+    # Kill the worker of the crashing model while the other jobs are running.
+    time.sleep(0.2)
+    if model_id == "crash":
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+def _estimate_or_crash(model_id, config_store=None):
+    _crash_or_sleep(model_id)
+    return CalcModelSizeResult(model_id, 1, 0), None
+
+
+def _estimate_needs_small_fallback(model_id, config_store=None):
+    return CalcModelSizeResult(model_id, 0, 2), 1 * GB
+
+
+def _pretrained_or_crash(model_id):
+    _crash_or_sleep(model_id)
+    return CalcModelSizeResult(model_id, 1, 0)
+
+
+@pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork", reason="Workers must inherit the stubs"
+)
+@pytest.mark.parametrize("pool", ["config", "fallback"])
+def test_crashed_worker_only_fails_its_model(monkeypatch, pool):
+    if pool == "config":
+        monkeypatch.setattr(
+            size_db, "_get_size_with_empty_weights_and_footprint", _estimate_or_crash
+        )
+    else:
+        monkeypatch.setattr(
+            size_db, "_get_size_with_empty_weights_and_footprint", _estimate_needs_small_fallback
+        )
+        monkeypatch.setattr(size_db, "_get_size", _pretrained_or_crash)
+
+    model_ids = ["a", "b", "crash", "c"]
+    results = list(size_db.get_model_sizes_in_parallel(model_ids, 4, fallback_mem_gb=15))
+    results = {result.model_id: result for result in results}
+    assert sorted(results) == sorted(model_ids)
+    for model_id in ["a", "b", "c"]:
+        assert results[model_id].code == 0
+    assert results["crash"].code == 1
+    assert results["crash"].error_class == "transient"
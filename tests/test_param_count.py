@@ -0,0 +1,24 @@
+"""Analytical parameter counts of configs."""
+from hf_hub_stats.param_count import count_parameters
+
+BERT_BASE = {
+    "model_type": "bert",
+    "hidden_size": 768,
+    "intermediate_size": 3072,
+    "num_hidden_layers": 12,
+    "vocab_size": 30522,
+    "max_position_embeddings": 512,
+    "type_vocab_size": 2,
+}
+
+
+def test_bert():
+    # The parameters of BertModel of bert-base-uncased.
+    assert count_parameters(BERT_BASE) == 109482240
+
+
+def test_bert_with_cross_attention_is_not_counted():
+    # The cross-attention layers of BERT decoders are not in the formula.
+    config = dict(BERT_BASE, is_decoder=True, add_cross_attention=True)
+    assert count_parameters(config) is None
+    assert count_parameters(dict(BERT_BASE, is_decoder=True)) == 109482240
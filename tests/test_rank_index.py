@@ -0,0 +1,32 @@
+"""Rebuilding the rank index of dates whose records are rewritten."""
+import pytest
+
+from hf_hub_stats.download_db import ModelNDownload, open_download_db
+from hf_hub_stats.rank_index import open_rank_index
+
+DATE = "01-01-23"
+
+
+@pytest.mark.parametrize("name", ["db.json", "db", "db.delta", "db.sqlite"])
+def test_rewritten_date_is_reindexed(tmp_path, name):
+    path = str(tmp_path / name)
+    download_db = open_download_db(path)
+    download_db[DATE] = [ModelNDownload("a", 3), ModelNDownload("b", 2), ModelNDownload("c", 1)]
+    download_db.persist()
+    rank_index = open_rank_index(download_db, path)
+    rank_index.build()
+    assert [rank_index.model_ids[i] for i in rank_index.order(DATE)] == ["a", "b", "c"]
+
+    # A second update of the same day.
+    download_db = open_download_db(path)
+    download_db[DATE] = [ModelNDownload("a", 1), ModelNDownload("b", 2), ModelNDownload("c", 3)]
+    download_db.persist()
+
+    download_db = open_download_db(path)
+    rank_index = open_rank_index(download_db, path)
+    rank_index.build()
+    assert [rank_index.model_ids[i] for i in rank_index.order(DATE)] == ["c", "b", "a"]
+
+    # Unchanged dates are not indexed again.
+    rank_index = open_rank_index(open_download_db(path), path)
+    assert rank_index._is_fresh(DATE)
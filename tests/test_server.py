@@ -0,0 +1,81 @@
+"""Responses of the query server and the fallback of its client."""
+import argparse
+import json
+import socket
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from hf_hub_stats.server import QueryHandler, QueryServer, forward
+from hf_hub_stats.size_db import SizeDB
+
+
+@pytest.fixture
+def size_db_file(tmp_path):
+    path = str(tmp_path / "size_db.json")
+    SizeDB(path).persist()
+    return path
+
+
+@pytest.fixture
+def server(size_db_file):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), QueryHandler)
+    httpd.query_server = QueryServer(size_db_file)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(httpd, mode, request):
+    req = urllib.request.Request(
+        f"http://127.0.0.1:{httpd.server_port}/{mode}", data=json.dumps(request).encode()
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return resp.status
+    except urllib.error.HTTPError as err:
+        return err.code
+
+
+def test_query_of_a_db_that_is_not_loaded(server):
+    # The server only has a size DB.
+    assert _post(server, "query_download", {"model_ids": ["a/b"]}) == 409
+
+
+def test_failed_query(server, monkeypatch):
+    def fail(request):
+        raise RuntimeError("the DB is being written")
+
+    monkeypatch.setattr(server.query_server, "query_size", fail)
+    assert _post(server, "query_size", {"model_ids": ["a/b"]}) == 500
+
+
+def test_client_falls_back_when_the_server_disconnects(size_db_file):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def disconnect():
+        conn, _ = listener.accept()
+        conn.recv(65536)
+        conn.close()
+
+    thread = threading.Thread(target=disconnect)
+    thread.start()
+    args = argparse.Namespace(
+        mode="query_size",
+        server=f"http://127.0.0.1:{listener.getsockname()[1]}",
+        size_db=size_db_file,
+        model_ids=["a/b"],
+    )
+    try:
+        assert forward(args) is False
+    finally:
+        thread.join()
+        listener.close()
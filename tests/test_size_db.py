@@ -0,0 +1,199 @@
+"""The JSON model size DB: resuming interrupted updates, crash-safe persisting, and the
+architecture cache."""
+import argparse
+import json
+import os
+
+import pytest
+
+from hf_hub_stats import serialization, size_db
+from hf_hub_stats.size_db import INTERRUPTED_MSG, ArchSizeCache, CalcModelSizeResult, SizeDB
+
+
+class Model:
+    def __init__(self, model_id):
+        self.modelId = model_id
+
+
+def _args():
+    return argparse.Namespace(start=0, end=float("inf"), workers=1)
+
+
+@pytest.fixture
+def estimated(monkeypatch):
+    """The models estimated by updates, which all have 1B parameters."""
+    model_ids = []
+
+    def estimate(model_id, fallback=True, config_store=None):
+        model_ids.append(model_id)
+        return CalcModelSizeResult(model_id, 1, 0)
+
+    monkeypatch.setattr(size_db, "get_model_size_in_b_with_empty_weights", estimate)
+    return model_ids
+
+
+def test_interrupted_update_is_resumed_from_the_journal(tmp_path, estimated):
+    path = str(tmp_path / "size_db.json")
+    db = SizeDB(path)
+    db["org/done"] = CalcModelSizeResult("org/done", 3, 0)
+    db.persist()
+
+    # The update was killed while estimating org/crash, and in the middle of a line.
+    entries = [
+        {"start": "org/a"},
+        {"result": {"model_id": "org/a", "size": 1.5, "code": 0}},
+        {"start": "org/b"},
+        {"result": {"model_id": "org/b", "size": 7, "code": 0}},
+        {"start": "org/crash"},
+    ]
+    with open(db.journal_file, "w") as filep:
+        filep.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        filep.write('{"result": {"model_id": "org/c"')
+
+    db = SizeDB(path)
+    assert db["org/a"].size == 1.5 and db["org/b"].size == 7
+    assert db["org/crash"].memo == INTERRUPTED_MSG and not db["org/crash"].valid
+    assert "org/c" not in db
+
+    # Only the models without journaled results are estimated, and the interrupted one is
+    # left to the retry policy.
+    models = [Model(m) for m in ["org/done", "org/a", "org/b", "org/crash", "org/c", "org/d"]]
+    db.update(models, _args())
+    assert estimated == ["org/c", "org/d"]
+    assert not os.path.exists(db.journal_file)
+
+    db = SizeDB(path)
+    assert sorted(db.db) == ["org/a", "org/b", "org/c", "org/crash", "org/d", "org/done"]
+
+
+def test_reader_does_not_replay_the_journal(tmp_path):
+    path = str(tmp_path / "size_db.json")
+    SizeDB(path).persist()
+    with open(f"{path}.journal", "w") as filep:
+        filep.write(json.dumps({"result": {"model_id": "org/a", "size": 1, "code": 0}}) + "\n")
+
+    reader = SizeDB(path, recover=False)
+    assert "org/a" not in reader
+    assert reader.tail_journal() > 0
+    assert reader["org/a"].size == 1
+    assert os.path.exists(f"{path}.journal")
+
+
+def test_failed_persist_keeps_the_previous_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "size_db.json")
+    db = SizeDB(path)
+    db["org/a"] = CalcModelSizeResult("org/a", 1, 0)
+    db.persist()
+    with open(path, "rb") as filep:
+        before = filep.read()
+
+    def fail(*args, **kwargs):
+        raise OSError("No space left on device")
+
+    db["org/b"] = CalcModelSizeResult("org/b", 2, 0)
+    monkeypatch.setattr(serialization, "dumps", fail)
+    with pytest.raises(OSError):
+        db.persist()
+    monkeypatch.undo()
+
+    with open(path, "rb") as filep:
+        assert filep.read() == before
+    assert sorted(SizeDB(path).db) == ["org/a"]
+
+
+BERT = {
+    "model_type": "bert",
+    "hidden_size": 768,
+    "intermediate_size": 3072,
+    "num_hidden_layers": 12,
+    "num_attention_heads": 12,
+    "vocab_size": 30522,
+    "max_position_embeddings": 512,
+    "type_vocab_size": 2,
+}
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """The configs whose parameters are counted, with an empty architecture cache."""
+    configs = {}
+    counted = []
+
+    def count(cfg):
+        counted.append(cfg)
+        return cfg["hidden_size"] * cfg["num_hidden_layers"]
+
+    monkeypatch.setattr(size_db, "ARCH_SIZE_CACHE", ArchSizeCache())
+    monkeypatch.setattr(size_db, "_load_config", lambda model_id, store=None: configs[model_id])
+    monkeypatch.setattr(size_db, "count_parameters", count)
+    return configs, counted
+
+
+def test_same_architecture_shares_the_cache_entry(counted):
+    configs, counted = counted
+    configs["org/base"] = BERT
+    configs["org/finetune"] = dict(
+        BERT,
+        _name_or_path="org/finetune",
+        architectures=["BertForSequenceClassification"],
+        id2label={"0": "NEG", "1": "POS"},
+        label2id={"NEG": 0, "POS": 1},
+        hidden_dropout_prob=0.2,
+        pad_token_id=1,
+        torch_dtype="float16",
+        transformers_version="4.40.0",
+    )
+    base = size_db._get_size_with_empty_weights("org/base")
+    finetune = size_db._get_size_with_empty_weights("org/finetune")
+    assert len(counted) == 1
+    assert finetune.size == base.size and finetune.config_hash == base.config_hash
+    assert size_db.ARCH_SIZE_CACHE.hits == 1
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        ("hidden_size", 1024),
+        ("intermediate_size", 4096),
+        ("num_hidden_layers", 24),
+        ("vocab_size", 50265),
+        ("max_position_embeddings", 514),
+        ("model_type", "roberta"),
+        ("add_cross_attention", True),
+        ("tie_word_embeddings", False),
+    ],
+)
+def test_size_relevant_field_misses_the_cache(counted, field, value):
+    configs, counted = counted
+    configs["org/base"] = BERT
+    configs["org/other"] = dict(BERT, **{field: value})
+    base = size_db._get_size_with_empty_weights("org/base")
+    other = size_db._get_size_with_empty_weights("org/other")
+    assert len(counted) == 2
+    assert other.config_hash != base.config_hash
+
+
+def test_arch_cache_evicts_the_least_recently_used():
+    cache = ArchSizeCache(max_entries=2)
+    cache.put("a", 1.0)
+    cache.put("b", 2.0)
+    assert cache.get("a") == 1.0
+    cache.put("c", 3.0)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1.0 and cache.get("c") == 3.0
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_arch_cache_is_warmed_up_by_the_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(size_db, "ARCH_SIZE_CACHE", ArchSizeCache())
+    path = str(tmp_path / "size_db.json")
+    db = SizeDB(path)
+    db["org/a"] = CalcModelSizeResult("org/a", 1.5, 0, config_hash="h")
+    db["org/b"] = CalcModelSizeResult("org/b", 0, 1, "failed", config_hash="h2")
+    db.persist()
+
+    monkeypatch.setattr(size_db, "ARCH_SIZE_CACHE", ArchSizeCache())
+    SizeDB(path)
+    assert size_db.ARCH_SIZE_CACHE.get("h") == 1.5
+    assert size_db.ARCH_SIZE_CACHE.get("h2") is None
@@ -0,0 +1,64 @@
+"""Selecting the top models in a size range with lazily resolved sizes."""
+import random
+
+import pytest
+
+from hf_hub_stats.size_db import CalcModelSizeResult
+from hf_hub_stats.size_stats import SizeJoin, top_in_range
+
+
+class SizeDB:
+    def __init__(self, results):
+        self.results = results
+
+    def lookup(self, model_id):
+        return self.results.get(model_id)
+
+
+def _top(sizes, known, downloads, limit, min_size, max_size):
+    """Select the top models of the sizes, and return the models resolved on the way."""
+    model_ids = [f"m{i}" for i in range(len(sizes))]
+    join = SizeJoin(
+        SizeDB({m: CalcModelSizeResult(m, s, 0) for m, s, k in zip(model_ids, sizes, known) if k})
+    )
+    resolved = []
+
+    def resolve(model_id):
+        resolved.append(model_id)
+        return CalcModelSizeResult(model_id, sizes[int(model_id[1:])], 0)
+
+    selected = top_in_range(
+        join, join.slots(model_ids), downloads, resolve, limit, min_size, max_size
+    )
+    return selected, resolved
+
+
+def test_resolves_only_the_models_to_select():
+    # None of the sizes are known, and all models are in the range.
+    (sizes, _), resolved = _top([1.0] * 10, [False] * 10, list(range(10, 0, -1)), 3, 0, 2)
+    assert resolved == ["m0", "m1", "m2"]
+    assert sizes.tolist() == [1.0] * 3
+
+
+def test_resolves_the_next_models_if_resolved_ones_are_out_of_range():
+    sizes = [9.0, 9.0, 1.0, 1.0, 1.0, 1.0]
+    (sizes, _), resolved = _top(sizes, [False] * 6, list(range(6, 0, -1)), 2, 0, 2)
+    assert resolved == ["m0", "m1", "m2", "m3"]
+    assert sizes.tolist() == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_same_as_walking_in_order(seed):
+    rng = random.Random(seed)
+    n = 50
+    sizes = [rng.choice([0.5, 1.0, 3.0, 8.0]) for _ in range(n)]
+    known = [rng.random() < 0.5 for _ in range(n)]
+    downloads = [rng.randrange(5) for _ in range(n)]
+    limit = rng.choice([0, 1, 5, 20])
+
+    (top_sizes, top_downloads), resolved = _top(sizes, known, downloads, limit, 1.0, 3.0)
+    order = sorted(range(n), key=lambda i: -downloads[i])
+    expected = [i for i in order if 1.0 <= sizes[i] <= 3.0]
+    expected = expected if limit == 0 else expected[:limit]
+    assert top_sizes.tolist() == [sizes[i] for i in expected]
+    assert top_downloads.tolist() == [downloads[i] for i in expected]
@@ -0,0 +1,95 @@
+"""Migrating the JSON databases to SQLite, which must answer queries the same way."""
+import argparse
+import time
+from dataclasses import asdict
+
+import pytest
+
+from hf_hub_stats import query_db
+from hf_hub_stats.download_db import DownloadTrendDB, ModelNDownload, open_download_db
+from hf_hub_stats.size_db import CalcModelSizeResult, SizeDB, open_size_db
+from hf_hub_stats.sqlite_db import migrate_to_sqlite
+
+DATES = ["12-25-22", "01-01-23"]
+SIZES = {f"org/m{i}": [0.1, 1.0, 3.0, 7.0, 13.0][i % 5] for i in range(30)}
+
+
+def _estimate(model_id, fallback=True, config_store=None):
+    return CalcModelSizeResult(model_id, SIZES[model_id], 0)
+
+
+@pytest.fixture
+def dbs(tmp_path, monkeypatch):
+    """The paths of the JSON size and download DBs, and of the SQLite file migrated from them."""
+    monkeypatch.setattr(query_db, "get_model_size_in_b_with_empty_weights", _estimate)
+
+    size_db = SizeDB(str(tmp_path / "size_db.json"))
+    for i, (model_id, size) in enumerate(SIZES.items()):
+        if i % 7 == 3:
+            # Unsupported models are negative cached.
+            size_db[model_id] = CalcModelSizeResult(model_id, 0, 1, "unsupported")
+        elif i % 4 != 1:
+            # The others miss the size DB and are estimated on queries.
+            size_db[model_id] = CalcModelSizeResult(model_id, size, 0, config_hash=f"h{i % 5}")
+    size_db.persist()
+
+    download_db = DownloadTrendDB(str(tmp_path / "download_db.json"))
+    for n, date in enumerate(DATES):
+        # Ties of downloads keep the order of records.
+        download_db[date] = [
+            ModelNDownload(model_id, (i // 3) * 10 + n) for i, model_id in enumerate(SIZES)
+        ][::-1]
+    download_db.persist()
+
+    sqlite_file = str(tmp_path / "hub.sqlite")
+    migrate_to_sqlite(sqlite_file, size_db=size_db.file_name, download_db=download_db.file_name)
+    return size_db.file_name, download_db.file_name, sqlite_file
+
+
+def test_size_lookups(dbs):
+    json_file, _, sqlite_file = dbs
+    json_db, sqlite_db = open_size_db(json_file), open_size_db(sqlite_file)
+    assert len(sqlite_db) == len(json_db)
+    now = time.time()
+    for model_id in SIZES:
+        expected = json_db.lookup(model_id, now)
+        result = sqlite_db.lookup(model_id, now)
+        assert (result and asdict(result)) == (expected and asdict(expected))
+
+
+def test_download_queries(dbs):
+    _, json_file, sqlite_file = dbs
+    model_ids = ["org/m3", "org/m0", "org/unknown", "org/m29"]
+    for date in DATES + [None]:
+        expected = query_db.query_model_download(model_ids, date, open_download_db(json_file))
+        results = query_db.query_model_download(model_ids, date, open_download_db(sqlite_file))
+        assert [r.to_dict() for r in results] == [r.to_dict() for r in expected]
+
+
+@pytest.mark.parametrize(
+    "limit, min_size, max_size, include_unsupported",
+    [(10, 0, float("inf"), False), (5, 1, 7, False), (4, 2, 20, True), (0, 0.5, 5, False)],
+)
+def test_top_queries(dbs, limit, min_size, max_size, include_unsupported):
+    json_size_db, json_download_db, sqlite_file = dbs
+
+    def query_top(size_db, download_db, date):
+        args = argparse.Namespace(
+            size_db=size_db,
+            download_db=download_db,
+            date=date,
+            start=0,
+            end=float("inf"),
+            limit=limit,
+            min_size=min_size,
+            max_size=max_size,
+            include_unsupported=include_unsupported,
+            lookahead=0,
+            pretty=False,
+        )
+        return [(m.model_id, m.download, m.size) for m in query_db.query_top_models(args)]
+
+    for date in DATES:
+        expected = query_top(json_size_db, json_download_db, date)
+        assert expected
+        assert query_top(sqlite_file, sqlite_file, date) == expected
@@ -0,0 +1,19 @@
+"""Startup time and imports of read-only subcommands, checked by benchmarks/bench_startup.py."""
+import os
+import subprocess
+import sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_read_only_subcommands_start_fast():
+    budget_ms = os.environ.get("STARTUP_BUDGET_MS", "500")
+    proc = subprocess.run(
+        [sys.executable, os.path.join(REPO, "benchmarks", "bench_startup.py")]
+        + ["--repeat", "3", "--budget-ms", budget_ms],
+        capture_output=True,
+        text=True,
+        cwd=REPO,
+        env={k: v for k, v in os.environ.items() if k != "PYTHONPATH"},
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr
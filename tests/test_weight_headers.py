@@ -0,0 +1,65 @@
+"""Model sizes from the headers and index files of local weight file fixtures."""
+import json
+import struct
+
+from hf_hub_stats.size_db import _get_size_from_weight_headers
+
+MODEL_ID = "org/model"
+
+
+def write_safetensors(path, shapes):
+    header = {"__metadata__": {"format": "pt"}}
+    offset = 0
+    for name, shape in shapes.items():
+        numel = 1
+        for dim in shape:
+            numel *= dim
+        header[name] = {
+            "dtype": "F16",
+            "shape": shape,
+            "data_offsets": [offset, offset + 2 * numel],
+        }
+        offset += 2 * numel
+    header = json.dumps(header).encode()
+    with open(path, "wb") as filep:
+        filep.write(struct.pack("<Q", len(header)) + header + bytes(offset))
+
+
+def test_single_safetensors(tmp_path):
+    write_safetensors(tmp_path / "model.safetensors", {"w": [3, 4], "b": [4]})
+    result = _get_size_from_weight_headers(MODEL_ID, root=str(tmp_path))
+    assert (result.code, result.memo) == (3, "model.safetensors")
+    assert result.size == 16 / 1e9
+
+
+def test_sharded_safetensors(tmp_path):
+    write_safetensors(tmp_path / "model-00001-of-00002.safetensors", {"a": [10, 10]})
+    write_safetensors(tmp_path / "model-00002-of-00002.safetensors", {"b": [5], "c": [2, 3]})
+    index = {
+        "metadata": {"total_size": 222},
+        "weight_map": {
+            "a": "model-00001-of-00002.safetensors",
+            "b": "model-00002-of-00002.safetensors",
+            "c": "model-00002-of-00002.safetensors",
+        },
+    }
+    (tmp_path / "model.safetensors.index.json").write_text(json.dumps(index))
+    result = _get_size_from_weight_headers(MODEL_ID, root=str(tmp_path))
+    assert (result.code, result.memo) == (3, "model.safetensors.index.json")
+    assert result.size == 111 / 1e9
+
+
+def test_sharded_pytorch_checkpoint(tmp_path):
+    index = {"metadata": {"total_size": 2000}, "weight_map": {"a": "pytorch_model-1.bin"}}
+    (tmp_path / "pytorch_model.bin.index.json").write_text(json.dumps(index))
+    (tmp_path / "config.json").write_text(json.dumps({"torch_dtype": "bfloat16"}))
+    result = _get_size_from_weight_headers(MODEL_ID, root=str(tmp_path))
+    assert (result.code, result.memo) == (3, "pytorch_model.bin.index.json")
+    assert result.size == 1000 / 1e9
+
+
+def test_missing_shard(tmp_path):
+    index = {"weight_map": {"a": "model-00001-of-00001.safetensors"}}
+    (tmp_path / "model.safetensors.index.json").write_text(json.dumps(index))
+    assert _get_size_from_weight_headers(MODEL_ID, root=str(tmp_path)) is None
+    assert _get_size_from_weight_headers(MODEL_ID, root=str(tmp_path / "empty")) is None